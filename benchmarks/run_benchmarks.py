@@ -0,0 +1,455 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Benchmark the functions of image_utils on synthetic images.
+
+Every case records its wall time (best of --repeat runs) and, in one more
+run traced by tracemalloc, its peak memory allocated through Python/NumPy.
+A case raising an error is reported as failed and the others still run.
+Results can be saved as a baseline and later runs compared against it: any
+case slower or more memory hungry than the baseline by more than the
+tolerance is reported and the script exits with an error.
+
+    python benchmarks/run_benchmarks.py --save baseline.json
+    python benchmarks/run_benchmarks.py --baseline baseline.json
+"""
+
+import argparse
+import itertools
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+import tracemalloc
+
+import numpy as np
+
+from image_utils.utils.canvas import PaddedImage, write_padded
+from image_utils.utils.frames import (iter_frames, write_frame,
+                                      write_frames)
+from image_utils.utils.image import (auto_crop, generate_mosaic,
+                                     pad_image_to_center, remove_background,
+                                     resize, resize_stack)
+from image_utils.utils.io import encode_image, read_image, write_image
+from image_utils.utils.layout import justified_layout
+from image_utils.utils.palette import plan_palettes, write_gif
+from image_utils.utils.perceptual_hash import (HASH_METHODS, find_duplicates,
+                                               hash_images)
+from image_utils.utils.pyramid import resize_pyramid
+from image_utils.utils.quality import search_quality
+
+CASES = []
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'scripts')
+
+
+def benchmark(sized=True, **params):
+    """ Register a benchmark case, run for each combination of params
+
+    Cases that do not depend on the image size (sized=False) are run once,
+    whatever the --sizes.
+    """
+    def _register(func):
+        CASES.append((func, sized, params))
+        return func
+    return _register
+
+
+def synthetic_image(megapixels, channels=3, seed=0):
+    """ Noisy uniform background with a few colored shapes """
+    rng = np.random.default_rng(seed)
+    width = int(np.sqrt(megapixels * 1e6 * 4 / 3))
+    height = int(megapixels * 1e6 / width)
+    img = np.empty((height, width, channels), dtype=np.uint8)
+    img[...] = 240
+    # Light noise on a band of the background
+    band = img[0:height // 8]
+    band += rng.integers(0, 4, band.shape, dtype=np.uint8)
+    for i in range(5):
+        y, x = height * (i + 1) // 7, width * (i + 1) // 7
+        img[y:y + height // 10, x:x + width // 10, 0:3] = (40 * i, 80, 160)
+    if channels == 4:
+        img[:, :, 3] = 255
+    return img
+
+
+def _channels(name):
+    return {'RGB': 3, 'RGBA': 4}[name]
+
+
+@benchmark(mode=['fill', 'value'], channels=['RGB', 'RGBA'])
+def bench_remove_background(size, mode, channels):
+    img = synthetic_image(size, _channels(channels))
+    return lambda: remove_background(img, 10, (0, 0), mode)
+
+
+@benchmark(borders=[0, 40], channels=['RGB', 'RGBA'])
+def bench_auto_crop(size, borders, channels):
+    img = synthetic_image(size, _channels(channels))
+    return lambda: auto_crop(img, borders)
+
+
+@benchmark(scale=[0.25, 2.0], channels=['RGB', 'RGBA'])
+def bench_resize(size, scale, channels):
+    img = synthetic_image(size, _channels(channels))
+    return lambda: np.asarray(resize(img, scale=scale))
+
+
+@benchmark(draft=[False, True])
+def bench_jpeg_thumbnail(size, draft):
+    img = synthetic_image(size)
+    tmp = tempfile.mkdtemp()
+    filename = os.path.join(tmp, 'in.jpg')
+    write_image(filename, img, quality=90)
+    dimensions = (512, int(512 * img.shape[0] / img.shape[1]))
+    min_size = dimensions[::-1] if draft else None
+    return lambda: resize(read_image(filename, min_size),
+                          dimensions=dimensions), \
+        lambda: shutil.rmtree(tmp)
+
+
+@benchmark(derive=[False, True])
+def bench_resize_pyramid(size, derive):
+    img = synthetic_image(size)
+    dimensions = [(img.shape[1] // 2 ** i, img.shape[0] // 2 ** i)
+                  for i in range(1, 6)]
+    if derive:
+        return lambda: resize_pyramid(img, dimensions)
+    return lambda: [np.asarray(resize(img, dimensions=d)) for d in dimensions]
+
+
+@benchmark(channels=['RGB', 'RGBA'])
+def bench_pad_image_to_center(size, channels):
+    img = synthetic_image(size, _channels(channels))
+    new_shape = (img.shape[0] + 100, img.shape[1] + 100)
+    return lambda: pad_image_to_center(img, new_shape)
+
+
+@benchmark(lazy=[False, True])
+def bench_write_padded(size, lazy):
+    img = synthetic_image(size)
+    new_shape = (img.shape[0] * 3 // 2, img.shape[1] * 3 // 2)
+    tmp = tempfile.mkdtemp()
+    filename = os.path.join(tmp, 'out.png')
+    if lazy:
+        return lambda: write_padded(filename, PaddedImage(img, new_shape)), \
+            lambda: shutil.rmtree(tmp)
+    return lambda: write_image(filename,
+                               pad_image_to_center(img, new_shape)), \
+        lambda: shutil.rmtree(tmp)
+
+
+@benchmark(scaling_method=['resize_to_avg', 'resize_to_max', 'pad_to_max'],
+           tiles=[16])
+def bench_generate_mosaic(size, scaling_method, tiles):
+    # The total number of pixels of the tiles is the benchmark size
+    imgs = [synthetic_image(size / tiles * (1 + (i % 3) / 4), seed=i)
+            for i in range(tiles)]
+    side = int(np.ceil(np.sqrt(tiles)))
+    return lambda: generate_mosaic([img.copy() for img in imgs], side, side,
+                                   True, False, scaling_method)
+
+
+@benchmark(tiles=[16])
+def bench_justified_mosaic(size, tiles):
+    imgs = [synthetic_image(size / tiles * (1 + (i % 3) / 4), seed=i)
+            for i in range(tiles)]
+    # Mixed ratios, where a grid of identical cells wastes the most canvas
+    imgs = [np.ascontiguousarray(img.transpose(1, 0, 2)) if i % 2 else img
+            for i, img in enumerate(imgs)]
+    side = int(np.ceil(np.sqrt(tiles)))
+    return lambda: generate_mosaic([img.copy() for img in imgs], side, side,
+                                   True, False, layout='justified')
+
+
+@benchmark(sized=False, tiles=[5000])
+def bench_justified_layout(size, tiles):
+    rng = np.random.default_rng(0)
+    heights = rng.integers(200, 2000, tiles)
+    ratios = rng.choice([0.5, 0.75, 1, 4 / 3, 1.5, 2, 3], tiles)
+    sizes = np.stack([heights, heights * ratios], axis=1)
+    return lambda: justified_layout(sizes, row_height=100)
+
+
+@benchmark(jobs=[1, 4], tiles=[64])
+def bench_resize_stack(size, jobs, tiles):
+    imgs = [synthetic_image(size / tiles * (1 + (i % 3) / 4), seed=i)
+            for i in range(tiles)]
+    return lambda: resize_stack(imgs, (224, 224), jobs=jobs)
+
+
+@benchmark(ext=['.jpg', '.png'])
+def bench_compress_image(size, ext):
+    img = synthetic_image(size)
+    tmp = tempfile.mkdtemp()
+    filename = os.path.join(tmp, 'out' + ext)
+    kwargs = {'quality': 10} if ext == '.jpg' else {}
+    return lambda: write_image(filename, img, **kwargs), \
+        lambda: shutil.rmtree(tmp)
+
+
+@benchmark(ext=['.png', '.npy'])
+def bench_interchange(size, ext):
+    # An intermediate of a shell pipeline, written then read by the next
+    # script
+    img = synthetic_image(size)
+    tmp = tempfile.mkdtemp()
+    filename = os.path.join(tmp, 'stage' + ext)
+
+    def _roundtrip():
+        write_image(filename, img)
+        np.asarray(read_image(filename)).sum()
+    return _roundtrip, lambda: shutil.rmtree(tmp)
+
+
+@benchmark(target=['max_bytes', 'min_ssim'], jobs=[1, 4])
+def bench_search_quality(size, target, jobs):
+    img = synthetic_image(size)
+    # Targets reached at neither end of the quality range, the size of
+    # the image encoded at an intermediate quality
+    if target == 'max_bytes':
+        value = len(encode_image(img, '.jpg', quality=75))
+    else:
+        value = 0.995
+    return lambda: search_quality(img, '.jpg', jobs=jobs, **{target: value})
+
+
+@benchmark(method=HASH_METHODS, tiles=[64])
+def bench_hash_images(size, method, tiles):
+    imgs = [synthetic_image(size / tiles, seed=i) for i in range(tiles)]
+    return lambda: hash_images(imgs, method)
+
+
+@benchmark(sized=False, hashes=[20000])
+def bench_find_duplicates(size, hashes):
+    rng = np.random.default_rng(0)
+    values = [int(v) for v in rng.integers(0, 2 ** 63, hashes // 2,
+                                           dtype=np.int64)]
+    # Every hash has a near-duplicate, 2 bits away
+    values += [v ^ 0b101 for v in values]
+    return lambda: find_duplicates(values)
+
+
+def _animation(size, frames):
+    """ Synthetic frames, size is the number of megapixels of all frames """
+    base = synthetic_image(size / frames)
+    return [np.roll(base, 10 * i, axis=1) for i in range(frames)]
+
+
+@benchmark(frames=[10, 50])
+def bench_compress_gif(size, frames):
+    imgs = _animation(size, frames)
+    tmp = tempfile.mkdtemp()
+    filename = os.path.join(tmp, 'out.gif')
+    return lambda: write_frames(filename, imgs, quantizer=2, palettesize=32), \
+        lambda: shutil.rmtree(tmp)
+
+
+@benchmark(frames=[10, 50], scenes=[False, True])
+def bench_quantize_gif(size, frames, scenes):
+    imgs = _animation(size, frames)
+    # A cut halfway, the second scene having inverted colors
+    imgs[frames // 2:] = [255 - img for img in imgs[frames // 2:]]
+    tmp = tempfile.mkdtemp()
+    filename = os.path.join(tmp, 'out.gif')
+    threshold = 0.5 if scenes else None
+    return lambda: write_gif(filename, imgs,
+                             plan_palettes(imgs, 32, threshold)), \
+        lambda: shutil.rmtree(tmp)
+
+
+@benchmark(frames=[10, 50])
+def bench_split_gif(size, frames):
+    tmp = tempfile.mkdtemp()
+    filename = os.path.join(tmp, 'in.gif')
+    write_frames(filename, _animation(size, frames))
+
+    def _split():
+        for i, frame in enumerate(iter_frames(filename)):
+            write_frame(os.path.join(tmp, 'frame_{:06d}.png'.format(i)),
+                        frame)
+    return _split, lambda: shutil.rmtree(tmp)
+
+
+@benchmark(frames=[50], step=[1, 10])
+def bench_select_frames(size, frames, step):
+    tmp = tempfile.mkdtemp()
+    filename = os.path.join(tmp, 'in.gif')
+    write_frames(filename, _animation(size, frames))
+
+    def _select():
+        for _ in iter_frames(filename, frames // 2, None, step):
+            pass
+    return _select, lambda: shutil.rmtree(tmp)
+
+
+@benchmark(frames=[10, 50])
+def bench_merge_gif(size, frames):
+    imgs = _animation(size, frames)
+    tmp = tempfile.mkdtemp()
+    filename = os.path.join(tmp, 'out.gif')
+    return lambda: write_frames(filename, iter(imgs)), \
+        lambda: shutil.rmtree(tmp)
+
+
+def _python(*args):
+    """ Run a fresh interpreter, as a script invocation would """
+    return lambda: subprocess.run([sys.executable] + list(args), check=True,
+                                  stdout=subprocess.DEVNULL)
+
+
+@benchmark(sized=False, module=['batch', 'frames', 'image', 'io', 'mosaic',
+                                'pipeline', 'tiled'])
+def bench_import(size, module):
+    return _python('-c', 'import image_utils.utils.' + module)
+
+
+@benchmark(sized=False, command=['compress_image', 'remove_background',
+                                 'resize', 'split_merge_gif'])
+def bench_startup(size, command):
+    return _python(os.path.join(SCRIPTS_DIR, 'iu.py'), command, '--help')
+
+
+def measure(func, repeat):
+    """ Best wall time over repeat runs and peak traced memory
+
+    tracemalloc slows down allocations, so the timed runs are not traced
+    and the peak memory is measured by a separate run.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return min(times), peak
+
+
+def iter_cases(sizes, pattern=None):
+    """ Name, setup function and parameters of every selected case """
+    for func, sized, params in CASES:
+        keys = sorted(params)
+        for size in sizes if sized else [None]:
+            for values in itertools.product(*[params[k] for k in keys]):
+                kwargs = dict(zip(keys, values))
+                labels = ['{}MP'.format(size)] if sized else []
+                labels += ['{}={}'.format(k, v) for k, v in kwargs.items()]
+                name = '{}[{}]'.format(func.__name__[len('bench_'):],
+                                       ','.join(labels))
+                if pattern and not re.search(pattern, name):
+                    continue
+                yield name, func, size, kwargs
+
+
+def compare(results, baseline, time_tolerance, memory_tolerance):
+    """ Names and descriptions of the cases regressing from the baseline """
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        ref = baseline[name]
+        if result['time'] > ref['time'] * (1 + time_tolerance):
+            regressions.append('{}: time {:.3f}s > baseline {:.3f}s'.format(
+                name, result['time'], ref['time']))
+        memory, ref_memory = result['peak_memory'], ref['peak_memory']
+        if memory > ref_memory * (1 + memory_tolerance) and memory > 2 ** 20:
+            regressions.append(
+                '{}: memory {:.1f}MB > baseline {:.1f}MB'.format(
+                    name, memory / 2 ** 20, ref_memory / 2 ** 20))
+    return regressions
+
+
+def _build_arg_parser():
+    p = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawTextHelpFormatter)
+    p.add_argument('--sizes', nargs='+', type=float, default=[1, 10],
+                   help='Image sizes in megapixels (e.g. 1 10 100). '
+                        '[%(default)s]')
+    p.add_argument('--filter', default=None,
+                   help='Only run the cases matching this regular '
+                        'expression.')
+    p.add_argument('--repeat', type=int, default=3,
+                   help='Number of runs of each case. [%(default)s]')
+    p.add_argument('--save', default=None,
+                   help='Save the results as JSON (e.g. a new baseline).')
+    p.add_argument('--baseline', default=None,
+                   help='Compare the results to a saved baseline.')
+    p.add_argument('--time_tolerance', type=float, default=0.25,
+                   help='Allowed relative slowdown. [%(default)s]')
+    p.add_argument('--memory_tolerance', type=float, default=0.10,
+                   help='Allowed relative memory increase. [%(default)s]')
+    return p
+
+
+def main():
+    parser = _build_arg_parser()
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        if not os.path.isfile(args.baseline):
+            raise IOError('{} does not exist.'.format(args.baseline))
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+
+    results = {}
+    failures = []
+    for name, func, size, kwargs in iter_cases(args.sizes, args.filter):
+        try:
+            setup = func(size, **kwargs)
+            run, teardown = setup if isinstance(setup, tuple) \
+                else (setup, None)
+            try:
+                elapsed, peak = measure(run, args.repeat)
+            finally:
+                if teardown is not None:
+                    teardown()
+        except Exception as e:
+            failures.append(name)
+            print('{:<70} FAILED {}: {}'.format(name, type(e).__name__, e))
+            traceback.print_exc(limit=3)
+            continue
+        results[name] = {'time': elapsed, 'peak_memory': peak}
+        print('{:<70} {:>9.4f}s {:>9.1f}MB'.format(
+            name, elapsed, peak / 2 ** 20))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'python': sys.version.split()[0],
+                       'numpy': np.__version__,
+                       'results': results}, f, indent=2, sort_keys=True)
+
+    if failures:
+        print('\n{} case(s) failed:'.format(len(failures)))
+        for name in failures:
+            print('  FAILED ' + name)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.time_tolerance,
+                              args.memory_tolerance)
+        if regressions:
+            print('\n{} regression(s) against {}:'.format(len(regressions),
+                                                          args.baseline))
+            for regression in regressions:
+                print('  REGRESSION ' + regression)
+            sys.exit(1)
+        print('\nNo regression against {}.'.format(args.baseline))
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+import glob
+import json
+import os
+import time
+import traceback
+from concurrent import futures
+
+from image_utils.utils.perceptual_hash import HashIndex, dedupe_files
+
+
+def add_batch_args(p):
+    """ Add the batch processing options to an argparse parser
+
+    Parameters
+    ----------
+    p : argparse.ArgumentParser
+        Parser of the script.
+
+    """
+    g = p.add_argument_group('Batch processing')
+    g.add_argument('--batch', action='store_true',
+                   help='Treat in_filename as a glob, a directory or a text '
+                        'file listing\nimages, and out_filename as the '
+                        'output directory.')
+    g.add_argument('--jobs', type=int, default=1,
+                   help='Number of processes used in batch mode. '
+                        '[%(default)s]')
+    g.add_argument('--out_ext', default=None,
+                   help='Extension of the outputs in batch mode (e.g. .png). '
+                        '[same as input]')
+    g.add_argument('--summary', default=None,
+                   help='Path of a JSON summary of failures and timings in '
+                        'batch mode.')
+    g.add_argument('--skip_duplicates', type=int, default=None,
+                   metavar='DISTANCE',
+                   help='Skip the inputs whose perceptual hash is within '
+                        'DISTANCE bits of\nan earlier input (e.g. 6).')
+    g.add_argument('--hash_index', default=None,
+                   help='SQLite index of perceptual hashes, reused across '
+                        'runs.')
+    g.add_argument('--verbose', action='store_true',
+                   help='Print the full traceback of each failure in batch '
+                        'mode,\nand keep them in the summary.')
+
+
+def expand_inputs(pattern):
+    """ Expand a glob, a directory or a text file list into filenames
+
+    Parameters
+    ----------
+    pattern : str
+        Glob pattern, directory or text file (.txt, .lst) with one path
+        per line.
+
+    Returns
+    -------
+    filenames : list
+        Sorted list of files.
+
+    """
+    if os.path.isdir(pattern):
+        filenames = [os.path.join(pattern, f) for f in os.listdir(pattern)
+                     if not f.startswith('.')]
+    elif os.path.isfile(pattern) and \
+            os.path.splitext(pattern)[1].lower() in ['.txt', '.lst']:
+        with open(pattern) as f:
+            filenames = [line.strip() for line in f
+                         if line.strip() and not line.startswith('#')]
+        return filenames
+    else:
+        filenames = glob.glob(pattern)
+
+    return sorted(f for f in filenames if os.path.isfile(f))
+
+
+def output_filenames(in_filenames, out_dir, out_ext=None):
+    """ Build the output filenames of a batch in out_dir
+
+    Parameters
+    ----------
+    in_filenames : list
+        List of input files.
+    out_dir : str
+        Output directory.
+    out_ext : str, optional
+        Replace the extension of the inputs.
+
+    Returns
+    -------
+    out_filenames : list
+        List of output files.
+
+    """
+    out_filenames = []
+    for filename in in_filenames:
+        basename = os.path.basename(filename)
+        if out_ext is not None:
+            if not out_ext.startswith('.'):
+                out_ext = '.' + out_ext
+            basename = os.path.splitext(basename)[0] + out_ext
+        out_filenames.append(os.path.join(out_dir, basename))
+
+    if len(set(out_filenames)) != len(out_filenames):
+        raise ValueError('Several inputs share the same basename, outputs '
+                         'would overwrite each other.')
+    return out_filenames
+
+
+def _run_one(func, in_filename, out_filename, args):
+    """ Run func on one file, never raise (the error is returned) """
+    start = time.perf_counter()
+    status, error, trace = None, None, None
+    try:
+        status = func(in_filename, out_filename, args)
+    except Exception as e:
+        error = '{}: {}'.format(type(e).__name__, e)
+        if getattr(args, 'verbose', False):
+            trace = traceback.format_exc()
+    return in_filename, time.perf_counter() - start, error, status, trace
+
+
+def run_batch(func, in_filenames, out_filenames, args, jobs=1,
+              max_in_flight=None):
+    """ Run func(in_filename, out_filename, args) over many files
+
+    Work is spread over a process pool, with at most max_in_flight files
+    submitted at once so that huge batches do not queue everything up
+    front. A failing file is recorded and the batch keeps going, even
+    when it crashes its worker process: the files pending in the pool are
+    then recorded as failed and a new pool processes the remaining ones.
+
+    Parameters
+    ----------
+    func : callable
+        Picklable function processing a single file, it can return a
+        status string.
+    in_filenames : list
+        List of input files.
+    out_filenames : list
+        List of output files (same length as in_filenames).
+    args : argparse.Namespace
+        Arguments forwarded to func.
+    jobs : int, optional
+        Number of processes (1 runs everything in the current process).
+    max_in_flight : int, optional
+        Maximum number of pending files. [2 * jobs]
+
+    Returns
+    -------
+    summary : dict
+        Number of processed files, failures, timings and count of each
+        status returned by func (e.g. cache hits). The full tracebacks of
+        the failures are included when args.verbose is set.
+
+    """
+    start = time.perf_counter()
+    results = []
+    if jobs <= 1:
+        for in_filename, out_filename in zip(in_filenames, out_filenames):
+            results.append(_run_one(func, in_filename, out_filename, args))
+    else:
+        max_in_flight = max_in_flight or 2 * jobs
+        executor = futures.ProcessPoolExecutor(max_workers=jobs)
+        pending = {}
+
+        def _collect(return_when):
+            # Whether a worker died (e.g. segfault or out of memory in a
+            # decoder), which fails every file pending in the pool
+            done, _ = futures.wait(pending, return_when=return_when)
+            broken = False
+            for future in done:
+                in_filename = pending.pop(future)
+                try:
+                    results.append(future.result())
+                except futures.BrokenExecutor as e:
+                    broken = True
+                    results.append((in_filename, 0.0, '{}: {}'.format(
+                        type(e).__name__, e), None, None))
+            return broken
+
+        def _restart():
+            nonlocal executor
+            _collect(futures.ALL_COMPLETED)
+            executor.shutdown()
+            executor = futures.ProcessPoolExecutor(max_workers=jobs)
+
+        try:
+            for in_filename, out_filename in zip(in_filenames,
+                                                 out_filenames):
+                future = None
+                while future is None:
+                    try:
+                        future = executor.submit(_run_one, func, in_filename,
+                                                 out_filename, args)
+                    except futures.BrokenExecutor:
+                        # Broken since the last results were collected
+                        _restart()
+                pending[future] = in_filename
+                if len(pending) >= max_in_flight \
+                        and _collect(futures.FIRST_COMPLETED):
+                    _restart()
+            _collect(futures.ALL_COMPLETED)
+        finally:
+            executor.shutdown()
+
+    timings = {filename: elapsed for filename, elapsed, _, _, _ in results}
+    failures = {filename: error for filename, _, error, _, _ in results
+                if error is not None}
+    statuses = {}
+    for _, _, _, status, _ in results:
+        if status is not None:
+            statuses[status] = statuses.get(status, 0) + 1
+    elapsed = sorted(timings.values())
+    summary = {'processed': len(results),
+               'succeeded': len(results) - len(failures),
+               'failed': len(failures),
+               'jobs': jobs,
+               'total_time': time.perf_counter() - start,
+               'mean_time': sum(elapsed) / len(elapsed) if elapsed else 0.0,
+               'max_time': elapsed[-1] if elapsed else 0.0,
+               'statuses': statuses,
+               'failures': failures,
+               'timings': timings}
+    if getattr(args, 'verbose', False):
+        summary['tracebacks'] = {filename: trace
+                                 for filename, _, _, _, trace in results
+                                 if trace is not None}
+    return summary
+
+
+def batch_main(func, args):
+    """ Run a script in batch mode from its parsed arguments
+
+    Expects in_filename, out_filename and the options of add_batch_args.
+
+    Parameters
+    ----------
+    func : callable
+        Picklable function processing a single file.
+    args : argparse.Namespace
+        Parsed arguments of the script.
+
+    Returns
+    -------
+    summary : dict
+        Output of run_batch.
+
+    """
+    in_filenames = expand_inputs(args.in_filename)
+    if not in_filenames:
+        raise IOError('No input found for {}.'.format(args.in_filename))
+
+    duplicates = {}
+    if getattr(args, 'skip_duplicates', None) is not None:
+        index = HashIndex(args.hash_index) if args.hash_index else None
+        try:
+            in_filenames, duplicates = dedupe_files(
+                in_filenames, args.skip_duplicates, index=index,
+                jobs=args.jobs)
+        finally:
+            if index is not None:
+                index.close()
+        print('Skipping {} duplicates.'.format(len(duplicates)))
+
+    if not os.path.isdir(args.out_filename):
+        os.makedirs(args.out_filename)
+    out_filenames = output_filenames(in_filenames, args.out_filename,
+                                     args.out_ext)
+
+    summary = run_batch(func, in_filenames, out_filenames, args,
+                        jobs=args.jobs)
+    summary['duplicates'] = duplicates
+
+    print('Processed {} files in {:.2f}s ({} failed).'.format(
+        summary['processed'], summary['total_time'], summary['failed']))
+    for status, count in sorted(summary['statuses'].items()):
+        print('  {}: {}'.format(status, count))
+    for filename, error in sorted(summary['failures'].items()):
+        print('  {}: {}'.format(filename, error))
+        if args.verbose:
+            print(summary['tracebacks'][filename])
+
+    if args.summary:
+        with open(args.summary, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+    return summary
@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from image_utils.utils.io import is_pipe
+from image_utils.utils.lazy import lazy_import
+from image_utils.utils.profiling import stage
+
+np = lazy_import('numpy')
+
+
+def add_cache_args(p):
+    """ Add the result cache options to an argparse parser
+
+    Parameters
+    ----------
+    p : argparse.ArgumentParser
+        Parser of the script.
+
+    """
+    g = p.add_argument_group('Result cache')
+    g.add_argument('--cache_dir', default=None,
+                   help='Directory of a cache of results, keyed by the '
+                        'content of the input\nand the parameters.')
+    g.add_argument('--cache_size', type=float, default=1024,
+                   help='Maximum size of the cache (MB), the least recently '
+                        'used\nresults are evicted. [%(default)s]')
+
+
+def hash_file(filename, chunk_size=2 ** 20):
+    """ Hash of the content of a file
+
+    Parameters
+    ----------
+    filename : str
+        Path of the file.
+    chunk_size : int, optional
+        Number of bytes read at once.
+
+    Returns
+    -------
+    digest : str
+        Hexadecimal BLAKE2b digest.
+
+    """
+    h = hashlib.blake2b(digest_size=20)
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def hash_array(arr):
+    """ Hash of the content, shape and dtype of an array
+
+    Parameters
+    ----------
+    arr : ndarray
+        Array to hash.
+
+    Returns
+    -------
+    digest : str
+        Hexadecimal BLAKE2b digest.
+
+    """
+    arr = np.ascontiguousarray(arr)
+    h = hashlib.blake2b(digest_size=20)
+    h.update('{}{}'.format(arr.shape, arr.dtype.str).encode())
+    h.update(arr.data)
+    return h.hexdigest()
+
+
+class ResultCache(object):
+    """ Content-addressed cache of encoded results on disk
+
+    Results are files stored under a key made of the hash of the input,
+    the operation and its parameters. An SQLite table keeps their size and
+    last access time, the least recently used results are evicted when the
+    cache grows over max_bytes.
+
+    Parameters
+    ----------
+    directory : str
+        Directory of the cache (created if needed).
+    max_bytes : int, optional
+        Maximum total size of the stored results.
+
+    """
+
+    def __init__(self, directory, max_bytes=2 ** 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._db = sqlite3.connect(os.path.join(directory, 'index.sqlite'),
+                                   timeout=30)
+        self._db.execute('CREATE TABLE IF NOT EXISTS entries ('
+                         'key TEXT PRIMARY KEY, size INTEGER, '
+                         'last_access REAL)')
+        self._db.commit()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(input_hash, operation, params=None, ext=''):
+        """ Key of a result
+
+        Parameters
+        ----------
+        input_hash : str
+            Hash of the input (see hash_file and hash_array).
+        operation : str
+            Name of the operation.
+        params : dict, optional
+            Parameters of the operation, must be JSON serializable.
+        ext : str, optional
+            Extension of the stored result.
+
+        Returns
+        -------
+        key : str
+            Key of the result, with its extension.
+
+        """
+        desc = json.dumps([input_hash, operation, params or {}],
+                          sort_keys=True, default=str)
+        return hashlib.blake2b(desc.encode(), digest_size=20).hexdigest() \
+            + ext.lower()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[0:2], key)
+
+    def get(self, key):
+        """ Path of a stored result, None if it is not in the cache
+
+        Parameters
+        ----------
+        key : str
+            Key of the result.
+
+        Returns
+        -------
+        path : str or None
+            Path of the stored result.
+
+        """
+        path = self._path(key)
+        with self._db:
+            found = self._db.execute('UPDATE entries SET last_access = ? '
+                                     'WHERE key = ?',
+                                     (time.time(), key)).rowcount
+        if found and os.path.isfile(path):
+            self.hits += 1
+            return path
+        self.misses += 1
+        return None
+
+    def put(self, key, filename):
+        """ Store a copy of a result file, then evict old results if needed
+
+        Parameters
+        ----------
+        key : str
+            Key of the result.
+        filename : str
+            Path of the result to store.
+
+        """
+        path = self._path(key)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Copy then rename so that readers never see a partial file
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        os.close(fd)
+        shutil.copyfile(filename, tmp)
+        os.replace(tmp, path)
+
+        with self._db:
+            self._db.execute('INSERT OR REPLACE INTO entries VALUES '
+                             '(?, ?, ?)',
+                             (key, os.path.getsize(path), time.time()))
+        self.evict()
+
+    def evict(self):
+        """ Remove the least recently used results over max_bytes """
+        with self._db:
+            total = self._db.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            for key, size in self._db.execute(
+                    'SELECT key, size FROM entries '
+                    'ORDER BY last_access').fetchall():
+                if total <= self.max_bytes:
+                    break
+                if os.path.isfile(self._path(key)):
+                    os.remove(self._path(key))
+                self._db.execute('DELETE FROM entries WHERE key = ?', (key,))
+                total -= size
+
+    def stats(self):
+        """ Statistics of the cache
+
+        Returns
+        -------
+        stats : dict
+            Hits and misses of this instance, number of results and total
+            size of the cache.
+
+        """
+        entries, size = self._db.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        return {'hits': self.hits, 'misses': self.misses,
+                'entries': entries, 'bytes': size}
+
+    def call(self, func, img, *args, **kwargs):
+        """ Call an image function through the cache
+
+        The result (an array, a PIL image or a tuple of them) is stored as
+        a NumPy archive and returned as ndarrays.
+
+        Parameters
+        ----------
+        func : callable
+            Function of image_utils.utils.image, called as
+            func(img, *args, **kwargs).
+        img : ndarray
+            Input image.
+
+        Returns
+        -------
+        result : ndarray or tuple
+            Result of func, with arrays instead of PIL images.
+
+        """
+        operation = '{}.{}'.format(func.__module__, func.__qualname__)
+        key = self.key(hash_array(img), operation,
+                       {'args': args, 'kwargs': kwargs}, '.npz')
+        path = self.get(key)
+        if path is not None:
+            with np.load(path) as data:
+                arrays = [data['arr_{}'.format(i)]
+                          for i in range(len(data.files))]
+            return tuple(arrays) if len(arrays) > 1 else arrays[0]
+
+        result = func(img, *args, **kwargs)
+        if isinstance(result, tuple):
+            result = tuple(np.asarray(r) for r in result)
+            arrays = result
+        else:
+            result = np.asarray(result)
+            arrays = (result,)
+
+        fd, tmp = tempfile.mkstemp(suffix='.npz', dir=self.directory)
+        os.close(fd)
+        try:
+            np.savez(tmp, *arrays)
+            self.put(key, tmp)
+        finally:
+            os.remove(tmp)
+        return result
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def run_cached(func, operation, in_filename, out_filename, args, params):
+    """ Run func(in_filename, out_filename, args) of a script through a cache
+
+    When args.cache_dir is set, the output is copied from the cache if the
+    same input was already processed with the same parameters, otherwise it
+    is computed and stored. Pipes (standard input or output) are never
+    cached.
+
+    Parameters
+    ----------
+    func : callable
+        Function processing a single file.
+    operation : str
+        Name of the operation.
+    in_filename : str
+        Path of the input image.
+    out_filename : str
+        Path of the output image.
+    args : argparse.Namespace
+        Arguments of the script.
+    params : list
+        Names of the arguments changing the output, part of the key. The
+        other arguments (e.g. --jobs) are ignored.
+
+    Returns
+    -------
+    status : str or None
+        'cache hit', 'cache miss' or None when no cache is used.
+
+    """
+    with stage('process', operation=operation, filename=in_filename) \
+            as fields:
+        if not getattr(args, 'cache_dir', None) or is_pipe(in_filename) \
+                or is_pipe(out_filename):
+            func(in_filename, out_filename, args)
+            return None
+
+        params = {k: getattr(args, k) for k in params}
+        _, ext = os.path.splitext(out_filename)
+        with ResultCache(args.cache_dir,
+                         int(args.cache_size * 1024 ** 2)) as cache:
+            key = cache.key(hash_file(in_filename), operation, params, ext)
+            path = cache.get(key)
+            if path is not None:
+                shutil.copyfile(path, out_filename)
+                fields['cache'] = 'hit'
+                return 'cache hit'
+
+            func(in_filename, out_filename, args)
+            cache.put(key, out_filename)
+            fields['cache'] = 'miss'
+            return 'cache miss'
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+import os
+import struct
+import zlib
+
+from image_utils.utils.io import write_image
+from image_utils.utils.lazy import lazy_import
+from image_utils.utils.profiling import stage
+
+np = lazy_import('numpy')
+
+# Number of rows materialized at once when streaming a padded image
+ROW_BLOCK = 256
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# PNG color type of each number of channels
+PNG_COLOR_TYPES = {1: 0, 2: 4, 3: 2, 4: 6}
+
+
+class PaddedImage(object):
+    """ Image placed on a larger canvas of a fill color, computed lazily
+
+    Only the image, its offset and the fill color are stored. Rows or
+    regions of the canvas are produced on demand and np.asarray builds the
+    full canvas, so the padded image can be used as an ndarray, but
+    write_padded streams it to the encoder without ever allocating it.
+
+    Parameters
+    ----------
+    img : ndarray
+        Image to pad.
+    new_shape : tuple
+        Height and width of the canvas, at least those of the image.
+    offset : tuple, optional
+        Row and column of the image on the canvas. [centered]
+    color : array_like, optional
+        Fill color of the canvas. [color of the top-left pixel]
+
+    """
+
+    def __init__(self, img, new_shape, offset=None, color=None):
+        height, width = (int(d) for d in new_shape[0:2])
+        if img.shape[0] > height or img.shape[1] > width:
+            raise ValueError('New shape must be larger than old shape!')
+        self.img = img
+        self.shape = (height, width) + img.shape[2:]
+        self.dtype = img.dtype
+        if offset is None:
+            offset = ((height - img.shape[0]) // 2,
+                      (width - img.shape[1]) // 2)
+        self.offset = tuple(int(o) for o in offset)
+        self.color = np.array(img[0, 0] if color is None else color,
+                              dtype=img.dtype)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def region(self, row_start, row_stop, col_start, col_stop):
+        """ Pixels of a region of the canvas, as a new array """
+        out = np.empty((row_stop - row_start, col_stop - col_start)
+                       + self.shape[2:], dtype=self.dtype)
+        out[...] = self.color
+        # Intersection of the region with the image, in canvas coordinates
+        y, x = self.offset
+        y0, y1 = max(row_start, y), min(row_stop, y + self.img.shape[0])
+        x0, x1 = max(col_start, x), min(col_stop, x + self.img.shape[1])
+        if y0 < y1 and x0 < x1:
+            out[y0 - row_start:y1 - row_start, x0 - col_start:x1 - col_start] \
+                = self.img[y0 - y:y1 - y, x0 - x:x1 - x]
+        return out
+
+    def iter_rows(self, block=ROW_BLOCK):
+        """ Blocks of full rows of the canvas, from top to bottom
+
+        Returns
+        -------
+        blocks : generator
+            (row_start, rows) of each block of at most block rows.
+
+        """
+        for start in range(0, self.shape[0], block):
+            stop = min(start + block, self.shape[0])
+            yield start, self.region(start, stop, 0, self.shape[1])
+
+    def iter_tiles(self, tile_size):
+        """ Tiles of the canvas, as expected by tiled.write_tiles """
+        for r0 in range(0, self.shape[0], tile_size):
+            for c0 in range(0, self.shape[1], tile_size):
+                r1 = min(r0 + tile_size, self.shape[0])
+                c1 = min(c0 + tile_size, self.shape[1])
+                yield (r0, r1, c0, c1), self.region(r0, r1, c0, c1)
+
+    def materialize(self):
+        """ The full padded image """
+        return self.region(0, self.shape[0], 0, self.shape[1])
+
+    def __array__(self, dtype=None, copy=None):
+        out = self.materialize()
+        return out if dtype is None else out.astype(dtype, copy=False)
+
+
+def _png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data \
+        + struct.pack('>I', zlib.crc32(data, zlib.crc32(kind)))
+
+
+def _up_filter(rows, previous):
+    """ Rows prefixed by the PNG Up filter, each byte minus the one above
+
+    Parameters
+    ----------
+    rows : ndarray
+        Block of rows, as a 2D uint8 array.
+    previous : ndarray
+        Last row of the previous block, zeros for the first block.
+
+    """
+    out = np.empty((rows.shape[0], rows.shape[1] + 1), dtype=np.uint8)
+    out[:, 0] = 2
+    np.subtract(rows[0], previous, out=out[0, 1:])
+    np.subtract(rows[1:], rows[:-1], out=out[1:, 1:])
+    return out
+
+
+def write_png_rows(filename, shape, dtype, blocks, level=6):
+    """ Encode a PNG from blocks of rows, without holding the image
+
+    Rows are filtered with the Up filter, which is vectorized over a block
+    and compresses the padding and photographs about as well as the
+    adaptive filtering of Pillow.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the output PNG.
+    shape : tuple
+        Shape of the image, (H, W) or (H, W, C) with 1 to 4 channels.
+    dtype : dtype
+        uint8 or uint16.
+    blocks : iterable
+        (row_start, rows) of consecutive blocks of rows (see
+        PaddedImage.iter_rows).
+    level : int, optional
+        zlib compression level (0-9).
+
+    """
+    channels = shape[2] if len(shape) == 3 else 1
+    if channels not in PNG_COLOR_TYPES:
+        raise ValueError('PNG images have 1 to 4 channels.')
+    dtype = np.dtype(dtype)
+    if dtype not in [np.uint8, np.uint16]:
+        raise ValueError('PNG images are uint8 or uint16.')
+
+    compressor = zlib.compressobj(level)
+    with open(filename, 'wb') as f:
+        f.write(PNG_SIGNATURE)
+        f.write(_png_chunk(b'IHDR', struct.pack(
+            '>IIBBBBB', shape[1], shape[0], dtype.itemsize * 8,
+            PNG_COLOR_TYPES[channels], 0, 0, 0)))
+        previous = np.zeros(shape[1] * channels * dtype.itemsize,
+                            dtype=np.uint8)
+        for _, rows in blocks:
+            # PNG samples are big-endian
+            rows = np.ascontiguousarray(rows, dtype=dtype.newbyteorder('>'))
+            rows = rows.view(np.uint8).reshape(rows.shape[0], -1)
+            data = compressor.compress(_up_filter(rows, previous))
+            previous = rows[-1]
+            if data:
+                f.write(_png_chunk(b'IDAT', data))
+        f.write(_png_chunk(b'IDAT', compressor.flush()))
+        f.write(_png_chunk(b'IEND', b''))
+
+
+def _has_tifffile():
+    """ Whether tifffile, needed to write tiled TIFF, is installed """
+    try:
+        import tifffile
+    except ImportError:
+        return False
+    del tifffile
+    return True
+
+
+def write_padded(filename, padded, **kwargs):
+    """ Encode a padded image, streaming it when the format allows
+
+    PNG outputs are encoded by blocks of rows and .npy or .tif outputs (the
+    latter when tifffile is installed) by tiles, so only the unpadded image
+    and a block are in memory. Other formats (or PNG options other than
+    compress_level) build the full canvas and go through write_image.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the output image.
+    padded : PaddedImage
+        Image to encode.
+    **kwargs
+        Options of the writer (e.g. compress_level for PNG).
+
+    """
+    # Imported here, tiled depends on this module
+    from image_utils.utils.tiled import TILE_MULTIPLE, write_tiles
+
+    _, ext = os.path.splitext(filename)
+    ext = ext.lower()
+    if ext == '.png' and set(kwargs) <= {'compress_level'} \
+            and padded.dtype in [np.uint8, np.uint16] \
+            and (padded.ndim == 2 or padded.shape[2] in PNG_COLOR_TYPES):
+        with stage('encode', filename=filename) as fields:
+            write_png_rows(filename, padded.shape, padded.dtype,
+                           padded.iter_rows(),
+                           kwargs.get('compress_level', 6))
+            fields['bytes_written'] = os.path.getsize(filename)
+    elif not kwargs and (ext == '.npy' or ext in ['.tif', '.tiff']
+                         and _has_tifffile()):
+        tile_size = ROW_BLOCK // TILE_MULTIPLE * TILE_MULTIPLE
+        with stage('encode', filename=filename) as fields:
+            write_tiles(filename, padded.shape, padded.dtype,
+                        padded.iter_tiles(tile_size), tile_size)
+            fields['bytes_written'] = os.path.getsize(filename)
+    else:
+        write_image(filename, np.asarray(padded), **kwargs)
@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from image_utils.utils.lazy import lazy_import
+from image_utils.utils.profiling import stage
+
+imageio = lazy_import('imageio.v2')
+np = lazy_import('numpy')
+Image = lazy_import('PIL.Image')
+
+FRAME_FORMATS = ['png', 'webp', 'jpg', 'npy']
+
+_END = object()
+
+
+def parse_frame_range(text):
+    """ Start, stop and step of a frame selection written as a slice
+
+    Parameters
+    ----------
+    text : str
+        'start:stop:step' with optional parts (e.g. '100:200:5', '::10',
+        '50:'), or a single frame index.
+
+    Returns
+    -------
+    selection : tuple
+        (start, stop, step), stop is None for the end of the file.
+
+    """
+    parts = text.split(':')
+    if len(parts) > 3:
+        raise ValueError('Invalid frame range {}.'.format(text))
+    try:
+        values = [int(p) if p.strip() else None for p in parts]
+    except ValueError:
+        raise ValueError('Invalid frame range {}.'.format(text))
+    if len(values) == 1:
+        if values[0] is None:
+            raise ValueError('Invalid frame range {}.'.format(text))
+        values.append(values[0] + 1)
+    start, stop, step = (values + [None])[0:3]
+    start = start or 0
+    step = step or 1
+    if start < 0 or (stop is not None and stop < 0) or step < 1:
+        raise ValueError('Frame ranges are positive, with a positive step.')
+    return start, stop, step
+
+
+def iter_frames(filename, start=0, stop=None, step=1):
+    """ Decode the frames of an animated image or a video one at a time
+
+    With a selection, only the selected frames are converted to arrays and
+    the file is closed after the last one. The reader seeks to the others:
+    videos (ffmpeg) jump to the keyframe before a distant frame and skip
+    the rest of the way, GIF frames, which depend on the previous ones, are
+    decompressed but never composed into arrays.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the GIF or video.
+    start : int, optional
+        Index of the first frame.
+    stop : int, optional
+        Index after the last frame. [end of the file]
+    step : int, optional
+        Keep one frame out of step.
+
+    Returns
+    -------
+    frames : generator
+        Decoded frames, only the current one is held in memory.
+
+    """
+    reader = imageio.get_reader(filename)
+    try:
+        if start == 0 and stop is None and step == 1:
+            for frame in reader:
+                yield frame
+            return
+
+        length = reader.get_length()
+        if length is not None and np.isfinite(length):
+            stop = int(length) if stop is None else min(stop, int(length))
+        index = start
+        while stop is None or index < stop:
+            try:
+                frame = reader.get_data(index)
+            except (IndexError, EOFError, StopIteration):
+                # Past the end of a file that does not store its length
+                break
+            yield frame
+            index += step
+    finally:
+        reader.close()
+
+
+def count_frames(filename):
+    """ Number of frames of an animated image or a video, if known
+
+    Parameters
+    ----------
+    filename : str
+        Path of the GIF or video.
+
+    Returns
+    -------
+    count : int or None
+        Number of frames, None if the container does not store it.
+
+    """
+    reader = imageio.get_reader(filename)
+    try:
+        count = reader.get_length()
+    finally:
+        reader.close()
+    if count is None or not np.isfinite(count):
+        return None
+    return int(count)
+
+
+def prefetch(iterable, size=8):
+    """ Consume an iterable in a background thread through a bounded queue
+
+    Decoding (done by the thread) overlaps with whatever the caller does
+    with the items (e.g. encoding), while at most size items are waiting in
+    memory. Exceptions raised by the iterable are raised to the caller.
+
+    Parameters
+    ----------
+    iterable : iterable
+        Items to prefetch (e.g. iter_frames).
+    size : int, optional
+        Maximum number of items waiting in the queue.
+
+    Returns
+    -------
+    items : generator
+        The items of iterable, in order.
+
+    """
+    items = queue.Queue(maxsize=max(1, size))
+    stop = threading.Event()
+
+    def _put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _worker():
+        try:
+            for item in iterable:
+                if not _put(item):
+                    return
+            _put(_END)
+        except BaseException as e:
+            _put(e)
+
+    thread = threading.Thread(target=_worker, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is _END:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        # The consumer stopped early, let the worker exit
+        stop.set()
+        thread.join()
+
+
+def write_frames(filename, frames, **kwargs):
+    """ Encode frames one at a time to an animated image or a video
+
+    Parameters
+    ----------
+    filename : str
+        Path of the output GIF or video.
+    frames : iterable
+        Frames to encode (e.g. prefetch(iter_frames(...))).
+    **kwargs
+        Options of the imageio writer.
+
+    Returns
+    -------
+    count : int
+        Number of frames written.
+
+    """
+    count = 0
+    with stage('encode_frames', filename=filename) as fields:
+        with imageio.get_writer(filename, mode='I', **kwargs) as writer:
+            for frame in frames:
+                writer.append_data(frame)
+                count += 1
+        fields['frames'] = count
+        fields['bytes_written'] = os.path.getsize(filename)
+    return count
+
+
+def parallel_map(func, iterable, jobs=1, max_in_flight=None):
+    """ Map func over an iterable with a thread pool, keeping the order
+
+    At most max_in_flight items are submitted at once, so the iterable is
+    consumed lazily. Encoders and decoders (PIL, zlib) release the GIL,
+    which makes threads effective for them.
+
+    Parameters
+    ----------
+    func : callable
+        Function applied to each item.
+    iterable : iterable
+        Items to process.
+    jobs : int, optional
+        Number of threads (1 runs everything in the current thread).
+    max_in_flight : int, optional
+        Maximum number of pending items. [2 * jobs]
+
+    Returns
+    -------
+    results : generator
+        func(item) for each item, in order.
+
+    """
+    if jobs <= 1:
+        for item in iterable:
+            yield func(item)
+        return
+
+    max_in_flight = max_in_flight or 2 * jobs
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = deque()
+        for item in iterable:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= max_in_flight:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def frame_filename(out_dir, index, fmt='png', digits=6):
+    """ Zero-padded, sortable filename of a frame
+
+    Parameters
+    ----------
+    out_dir : str
+        Output directory.
+    index : int
+        Index of the frame.
+    fmt : {'png', 'webp', 'jpg', 'npy'}, optional
+        Output format.
+    digits : int, optional
+        Number of digits of the index.
+
+    Returns
+    -------
+    filename : str
+        Path of the frame.
+
+    """
+    return os.path.join(out_dir, 'frame_{:0{}d}.{}'.format(index, digits, fmt))
+
+
+def write_frame(filename, frame, level=None):
+    """ Encode a single frame, the format is given by the extension
+
+    Parameters
+    ----------
+    filename : str
+        Path of the frame (.png, .webp, .jpg or .npy).
+    frame : ndarray
+        Frame to encode.
+    level : int, optional
+        zlib level for PNG (0-9) or quality for WebP and JPEG (0-100).
+        Ignored for .npy, which are written raw.
+
+    """
+    with stage('encode', filename=filename) as fields:
+        _write_frame(filename, frame, level)
+        fields['bytes_written'] = os.path.getsize(filename)
+
+
+def _write_frame(filename, frame, level):
+    _, ext = os.path.splitext(filename)
+    ext = ext.lower()
+    if ext == '.npy':
+        np.save(filename, frame)
+        return
+
+    img = Image.fromarray(np.asarray(frame))
+    if ext == '.png':
+        img.save(filename, compress_level=6 if level is None else int(level))
+    elif ext == '.webp':
+        img.save(filename, quality=80 if level is None else int(level))
+    elif ext in ['.jpg', '.jpeg']:
+        if img.mode not in ['RGB', 'L']:
+            img = img.convert('RGB')
+        img.save(filename, quality=90 if level is None else int(level))
+    else:
+        img.save(filename)
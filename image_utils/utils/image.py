@@ -1,10 +1,39 @@
 # -*- coding: utf-8 -*-
-import numpy as np
-from PIL import Image
-from skimage.segmentation import flood_fill
+from image_utils.utils.canvas import PaddedImage
+from image_utils.utils.frames import parallel_map
+from image_utils.utils.layout import (grid_layout, justified_layout,
+                                      layout_cells)
+from image_utils.utils.lazy import lazy_import
+from image_utils.utils.mask import (bounding_box, color_distance_mask,
+                                    colors_distance_mask, connected_to_seeds,
+                                    flood_fill_mask)
+from image_utils.utils.profiling import profiled
 
+np = lazy_import('numpy')
+Image = lazy_import('PIL.Image')
 
-def remove_background(img, threshold=10, init_pos=(0, 0), mode='fill'):
+
+def image_corners(shape):
+    """ Positions of the four corners of an image
+
+    Parameters
+    ----------
+    shape : tuple
+        Shape of the image.
+
+    Returns
+    -------
+    corners : list
+        (row, col) of the corners.
+
+    """
+    return [(0, 0), (0, shape[1] - 1), (shape[0] - 1, 0),
+            (shape[0] - 1, shape[1] - 1)]
+
+
+@profiled
+def remove_background(img, threshold=10, init_pos=(0, 0), mode='fill',
+                      colors=None):
     """ Remove background of img using pixel value from a position
 
     Parameters
@@ -13,10 +42,14 @@ def remove_background(img, threshold=10, init_pos=(0, 0), mode='fill'):
         Input img.
     threshold : int, optional
         Threshold for background detection in case of noise.
-    init_pos : tuple, optional
-        Position at which the color is detected.
+    init_pos : tuple or list, optional
+        Position at which the color is detected, or a list of positions
+        (e.g. image_corners) to fill from several seeds at once.
     mode : {'fill', 'value'}, optional
         Either replace all close values or use a floodfill.
+    colors : array-like, optional
+        Additional background colors (N, 3) in 'value' mode, e.g. for noisy
+        or gradient backgrounds.
 
     Returns
     -------
@@ -26,33 +59,126 @@ def remove_background(img, threshold=10, init_pos=(0, 0), mode='fill'):
         Mask of the background.
 
     """
-    img = img.astype(np.float32)
-    if img.shape[-1] == 4:
-        img = img[:, :, 0:3]
-
-    value = img[init_pos]
-    norm = np.linalg.norm(np.abs(img - value), axis=-1)
+    rgb = img[:, :, 0:3]
+    seeds = np.asarray(init_pos, dtype=np.intp).reshape(-1, 2)
 
     if mode == 'fill':
-        binary_struct = np.zeros((3, 3))
-        binary_struct[0:3, 1] = 1
-        binary_struct[1, 0:3] = 1
-
-        mask = flood_fill(norm, init_pos, 999,
-                          footprint=binary_struct,
-                          tolerance=threshold)
-        mask = np.where(mask == 999, 0, 255)
+        background = flood_fill_mask(rgb, seeds, threshold)
     else:
-        mask = np.where(norm < threshold, 0, 255)
+        # Integer squared distances on uint8 data, no float temporaries
+        value = rgb[seeds[:, 0], seeds[:, 1]]
+        if colors is not None:
+            value = np.vstack([value, np.asarray(colors).reshape(-1, 3)])
+        background = colors_distance_mask(rgb, value, threshold,
+                                          inclusive=False)
 
     # The detected background is used in the Alpha channel
-    new_img = np.zeros(img.shape[0:2] + (4,)).astype(np.uint8)
-    new_img[:, :, 0:3] = img
-    new_img[:, :, 3] = mask
+    new_img = np.empty(img.shape[0:2] + (4,), dtype=np.uint8)
+    new_img[:, :, 0:3] = rgb
+    np.multiply(~background, 255, out=new_img[:, :, 3], casting='unsafe')
+
+    return new_img, new_img[:, :, 3].copy()
+
 
-    return new_img, mask.astype(np.uint8)
+@profiled
+def find_bbox(img, borders=0, threshold=10):
+    """ Find the crop window of an image around its non-background content
 
+    The background color is taken at the top-left pixel and the background
+    is the region connected to it, through the borders of background color
+    added around the image. Only a boolean mask is built and the extent is
+    found from row/column reductions.
 
+    Parameters
+    ----------
+    img : ndarray
+        Input img.
+    borders : int, optional
+        Border around the bounding box.
+    threshold : int, optional
+        Threshold for background detection in case of noise.
+
+    Returns
+    -------
+    bbox : tuple or None
+        (row_start, row_stop, col_start, col_stop) in img coordinates, can
+        extend outside of img when borders are requested. None if the image
+        only contains background.
+
+    """
+    value = img[0, 0]
+    background = color_distance_mask(img, value, threshold)
+
+    # The original algorithm pads the image with borders of the background
+    # color and floods it from the top-left corner. Padding on all sides
+    # connects every side to the corner. With a single border pixel, only
+    # the bottom and right sides are padded: they are connected to each
+    # other, and to the corner only if its region reaches one of them.
+    before, after = borders // 2, borders - borders // 2
+    seeds = np.zeros(img.shape[0:2], dtype=bool)
+    seeds[0, 0] = True
+    if before > 0:
+        seeds[0, :] = True
+        seeds[:, 0] = True
+        seeds[-1, :] = True
+        seeds[:, -1] = True
+    seeds &= background
+
+    connected = connected_to_seeds(background, seeds)
+    if before == 0 and after > 0:
+        if not connected[-1, :].any() and not connected[:, -1].any():
+            # The padding is not reached, it is kept as content and spans
+            # the whole padded image
+            return 0, img.shape[0] + after, 0, img.shape[1] + after
+        seeds[-1, :] |= background[-1, :]
+        seeds[:, -1] |= background[:, -1]
+        connected = connected_to_seeds(background, seeds)
+
+    bbox = bounding_box(~connected)
+    if bbox is None:
+        return None
+
+    x_min, x_max, y_min, y_max = bbox
+    return (x_min - before, min(x_max + before + 1, img.shape[0] + after),
+            y_min - before, min(y_max + before + 1, img.shape[1] + after))
+
+
+def crop_to_bbox(img, bbox):
+    """ Crop image to a window, padding with the background color if needed
+
+    Parameters
+    ----------
+    img : ndarray
+        Input img.
+    bbox : tuple
+        (row_start, row_stop, col_start, col_stop), as given by find_bbox.
+
+    Returns
+    -------
+    cropped : ndarray
+        Cropped img, a view of img when the window fits inside of it.
+
+    """
+    x_start, x_stop, y_start, y_stop = bbox
+    if x_start >= 0 and y_start >= 0 \
+            and x_stop <= img.shape[0] and y_stop <= img.shape[1]:
+        return img[x_start:x_stop, y_start:y_stop]
+
+    # Only the cropped output is allocated, filled with the background color
+    cropped = np.empty((x_stop - x_start, y_stop - y_start) + img.shape[2:],
+                       dtype=img.dtype)
+    cropped[...] = img[0, 0]
+    src_x, src_y = max(x_start, 0), max(y_start, 0)
+    dst_x, dst_y = src_x - x_start, src_y - y_start
+    height = min(x_stop, img.shape[0]) - src_x
+    width = min(y_stop, img.shape[1]) - src_y
+    cropped[dst_x:dst_x + height, dst_y:dst_y + width] = \
+        img[src_x:src_x + height, src_y:src_y + width]
+
+    return cropped
+
+
+@profiled
 def auto_crop(img, borders=0):
     """ Crop image to the bounding box of the background
 
@@ -66,27 +192,55 @@ def auto_crop(img, borders=0):
     Returns
     -------
     cropped : ndarray
-        Cropped img.
+        Cropped img, a view of img when the borders fit inside of it.
 
     """
-    value = img[0, 0]
-    new_shape = (img.shape[0] + borders, img.shape[1] + borders, img.shape[2])
-    new_img = np.ones(new_shape, dtype=np.uint8) * value
+    bbox = find_bbox(img, borders)
+    if bbox is None:
+        return img
 
-    new_img[borders//2:borders//2 + img.shape[0],
-            borders//2:borders//2 + img.shape[1], :] = img
-    _, mask = remove_background(new_img)
+    return crop_to_bbox(img, bbox)
 
-    # Find the bounding box of the background mask
-    x, y = np.where(mask == 255)
-    x_min, x_max = np.min(x), np.max(x)
-    y_min, y_max = np.min(y), np.max(y)
-    cropped = new_img[x_min - borders//2:x_max + borders//2 + 1,
-                      y_min - borders//2:y_max + borders//2 + 1, :]
 
-    return cropped
+def resize_dimensions(shape, ratio_frac=None, ratio_val=None,
+                      dimensions=None, scale=None):
+    """ Dimensions of a resized image, from the shape of the original
+
+    Parameters
+    ----------
+    shape : tuple
+        Shape of the original image.
+    ratio_frac, ratio_val, dimensions, scale : optional
+        Same as for resize.
+
+    Returns
+    -------
+    dimensions : tuple
+        Width and height of the resized image.
+
+    """
+    if ratio_val is not None:
+        if len(ratio_val) != 2:
+            raise ValueError('Ratio must be a 2-tuple')
+        if ratio_val[1] == 0:
+            raise ValueError('Ratio must be non-zero')
+    ratio_frac = ratio_val[1] / \
+        ratio_val[0] if ratio_val is not None else ratio_frac
+    if scale is not None:
+        dimensions = (shape[1] * scale, shape[0] * scale)
+
+    if dimensions is not None:
+        dim_1, dim_2 = dimensions
+    elif ratio_frac is not None:
+        dim_1 = shape[0]
+        dim_2 = shape[0] * ratio_frac
+    else:
+        raise ValueError('At least one in three option must be specified!')
+
+    return int(dim_1), int(dim_2)
 
 
+@profiled
 def resize(img, ratio_frac=None, ratio_val=None, dimensions=None, scale=None):
     """ Resize image
 
@@ -109,29 +263,315 @@ def resize(img, ratio_frac=None, ratio_val=None, dimensions=None, scale=None):
         Resized image.
 
     """
-    if ratio_val is not None:
-        if len(ratio_val) != 2:
-            raise ValueError('Ratio must be a 2-tuple')
-        if ratio_val[1] == 0:
-            raise ValueError('Ratio must be non-zero')
-    ratio_frac = ratio_val[1] / \
-        ratio_val[0] if ratio_val is not None else ratio_frac
-    if scale is not None:
-        dimensions = (img.shape[1] * scale, img.shape[0] * scale)
+    return Image.fromarray(img).resize(resize_dimensions(
+        img.shape, ratio_frac, ratio_val, dimensions, scale))
 
-    if dimensions is not None:
-        dim_1, dim_2 = dimensions
-    elif ratio_frac is not None:
-        dim_1 = img.shape[0]
-        dim_2 = img.shape[0] * ratio_frac
+
+def mosaic_borders(shape, auto_bbox=True, auto_border=True):
+    """ Borders used to crop an image of a mosaic
+
+    Parameters
+    ----------
+    shape : tuple
+        Shape of the image.
+    auto_bbox : bool, optional
+        Crop the images to the bounding box of the background.
+    auto_border : bool, optional
+        Add a border around the bounding box.
+
+    Returns
+    -------
+    borders : int or None
+        Borders for auto_crop, None if the image is not cropped.
+
+    """
+    if auto_border:
+        return (shape[0] + shape[1]) // 20
+    if auto_bbox:
+        return 0
+    return None
+
+
+def mosaic_cell_size(sizes, scaling_method='resize_to_avg',
+                     max_cell_size=None):
+    """ Size of the cells of a mosaic
+
+    Parameters
+    ----------
+    sizes : ndarray
+        (N, 2) heights and widths of the images.
+    scaling_method : {'resize_to_avg', 'resize_to_max', 'pad_to_max'}, optional
+        Method used to scale the images.
+    max_cell_size : int, optional
+        Largest side of a cell, the cells are scaled down (keeping their
+        ratio) to fit. Only with the resize methods.
+
+    Returns
+    -------
+    final_size : ndarray
+        Height and width of a cell.
+
+    """
+    if scaling_method == 'resize_to_avg':
+        final_size = np.mean(sizes, axis=0, dtype=np.uint16)
+    elif scaling_method == 'resize_to_max' or scaling_method == 'pad_to_max':
+        final_size = np.max(sizes, axis=0).astype(np.uint16)
     else:
-        raise ValueError('At least one in three option must be specified!')
+        raise ValueError('Unknown scaling method {}.'.format(scaling_method))
+
+    if max_cell_size is None or final_size.max() <= max_cell_size:
+        return final_size
+    if scaling_method == 'pad_to_max':
+        raise ValueError('The cells can only be limited when the images are '
+                         'resized.')
+    scale = max_cell_size / final_size.max()
+    return np.maximum(final_size * scale, 1).astype(np.uint16)
 
-    return Image.fromarray(img).resize((int(dim_1), int(dim_2)))
 
+def fit_to_cell(size, final_size):
+    """ Dimensions of an image scaled to fit a cell, keeping its ratio
 
+    Parameters
+    ----------
+    size : tuple
+        Height and width of the image.
+    final_size : tuple
+        Height and width of a cell.
+
+    Returns
+    -------
+    dimensions : tuple
+        Width and height (as given to resize) of the scaled image.
+
+    """
+    ratio = size[0] / size[1]
+    avg_ratio = final_size[0] / final_size[1]
+    # If the image is wider than the final, then the width is set to the
+    # final width and we compute the height accordingly.
+    if ratio > avg_ratio:
+        dim_1 = final_size[0]
+        dim_2 = dim_1 / ratio
+    else:
+        dim_2 = final_size[1]
+        dim_1 = dim_2 * ratio
+
+    return dim_2, dim_1
+
+
+def mosaic_cell(i, rows, columns, final_size):
+    """ Window of the i-th image in a mosaic
+
+    Parameters
+    ----------
+    i : int
+        Index of the image.
+    rows : int
+        Number of rows in the mosaic.
+    columns : int
+        Number of columns in the mosaic.
+    final_size : tuple
+        Height and width of a cell.
+
+    Returns
+    -------
+    window : tuple
+        Slices (rows, columns) of the cell in the mosaic.
+
+    """
+    top, left, height, width = grid_layout(i + 1, rows, columns,
+                                           final_size).boxes[i]
+    return slice(top, top + height), slice(left, left + width)
+
+
+def place_in_cell(cell, img):
+    """ Write an image centered in a mosaic cell, padded with its color
+
+    Same result as pad_image_to_center followed by a copy in the cell, but
+    without allocating the padded image.
+
+    Parameters
+    ----------
+    cell : ndarray
+        View of the mosaic (H, W, C) receiving the image, only the first C
+        channels of the image are copied.
+    img : ndarray
+        Image (smaller than the cell).
+
+    """
+    height, width = img.shape[0:2]
+    if height > cell.shape[0] or width > cell.shape[1]:
+        raise ValueError('New shape must be larger than old shape!')
+    y_center = (cell.shape[0] - height) // 2
+    x_center = (cell.shape[1] - width) // 2
+    channels = cell.shape[2]
+
+    cell[...] = img[0, 0, 0:channels]
+    cell[y_center:y_center + height, x_center:x_center + width] = \
+        img[:, :, 0:channels]
+
+
+def scale_into_cell(cell, img, fit=True):
+    """ Resize an image to fit a cell, keeping its ratio, and center it
+
+    Parameters
+    ----------
+    cell : ndarray
+        View (H, W, C) receiving the image.
+    img : ndarray
+        Input image.
+    fit : bool, optional
+        Resize the image to fit the cell, otherwise it is only padded and
+        must be smaller than the cell.
+
+    """
+    if fit:
+        dimensions = fit_to_cell(img.shape[0:2], cell.shape[0:2])
+        # Pillow releases the GIL while resampling
+        img = np.asarray(resize(img, dimensions=dimensions))
+    place_in_cell(cell, img)
+
+
+def resize_into_cells(imgs, cells, fit=True, jobs=1):
+    """ Resize and center many images into preallocated cells
+
+    Each image is resampled once and written directly in its cell, no
+    padded copy is allocated. The images are independent, so they are
+    processed by a pool of threads.
+
+    Parameters
+    ----------
+    imgs : list
+        List of images.
+    cells : ndarray or list
+        (N, H, W, C) array or list of N (H, W, C) views (e.g. the cells of
+        a mosaic) receiving the images.
+    fit : bool, optional
+        Resize the images to fit the cells, otherwise they are only padded.
+    jobs : int, optional
+        Number of threads.
+
+    """
+    if len(imgs) != len(cells):
+        raise ValueError('There must be as many cells as images.')
+
+    def _scale(i):
+        scale_into_cell(cells[i], imgs[i], fit)
+
+    for _ in parallel_map(_scale, range(len(imgs)), jobs):
+        pass
+
+
+@profiled
+def resize_stack(imgs, cell_size, fit=True, channels=3, jobs=1):
+    """ Resize and center many images into one (N, H, W, C) uint8 array
+
+    Parameters
+    ----------
+    imgs : list
+        List of images, with at least channels channels.
+    cell_size : tuple
+        Height and width of the output images.
+    fit : bool, optional
+        Resize the images to fit (keeping their ratio), otherwise they are
+        only padded and must be smaller than cell_size.
+    channels : int, optional
+        Number of channels kept.
+    jobs : int, optional
+        Number of threads.
+
+    Returns
+    -------
+    stack : ndarray
+        Stack of the centered images, padded with the color of their top
+        left pixel.
+
+    """
+    stack = np.empty((len(imgs), int(cell_size[0]), int(cell_size[1]),
+                      channels), dtype=np.uint8)
+    resize_into_cells(imgs, stack, fit, jobs)
+    return stack
+
+
+def mosaic_layout(sizes, rows, columns, scaling_method='resize_to_avg',
+                  max_cell_size=None, layout='grid', canvas_width=None,
+                  row_height=None, spacing=0):
+    """ Boxes of the images of a mosaic
+
+    Parameters
+    ----------
+    sizes : ndarray
+        (N, 2) heights and widths of the images.
+    rows : int
+        Number of rows in the mosaic (grid layout).
+    columns : int
+        Number of columns in the mosaic (grid layout).
+    scaling_method : {'resize_to_avg', 'resize_to_max', 'pad_to_max'}, optional
+        Method used to scale the images (grid layout).
+    max_cell_size : int, optional
+        Largest side of a cell, or largest row height of a justified
+        layout.
+    layout : {'grid', 'justified'}, optional
+        Grid of identical cells, or rows of images scaled to fill the width
+        of the canvas (see layout.justified_layout).
+    canvas_width : int, optional
+        Width of the canvas (justified layout).
+    row_height : float, optional
+        Target height of the rows (justified layout).
+    spacing : int, optional
+        Pixels between the images (justified layout).
+
+    Returns
+    -------
+    layout : Layout
+        Boxes of the images and shape of the canvas.
+
+    """
+    if layout == 'grid':
+        final_size = mosaic_cell_size(sizes, scaling_method, max_cell_size)
+        return grid_layout(len(sizes), rows, columns, final_size)
+    if layout != 'justified':
+        raise ValueError('Unknown layout {}.'.format(layout))
+    if scaling_method == 'pad_to_max':
+        raise ValueError('The justified layout resizes the images.')
+    if row_height is None:
+        row_height = float(np.median(np.asarray(sizes)[:, 0]))
+    if max_cell_size is not None:
+        row_height = min(row_height, max_cell_size)
+    return justified_layout(sizes, canvas_width, row_height, spacing)
+
+
+def mosaic_canvas(final_size, rows, columns, memmap_filename=None):
+    """ Allocate the uint8 canvas of a mosaic
+
+    Parameters
+    ----------
+    final_size : tuple
+        Height and width of a cell.
+    rows : int
+        Number of rows in the mosaic.
+    columns : int
+        Number of columns in the mosaic.
+    memmap_filename : str, optional
+        Build the mosaic in a memory-mapped .npy file instead of in memory.
+
+    Returns
+    -------
+    mosaic : ndarray
+        Empty (black) canvas.
+
+    """
+    mosaic_shape = (int(final_size[0] * rows), int(final_size[1] * columns), 3)
+    if memmap_filename is None:
+        return np.zeros(mosaic_shape, dtype=np.uint8)
+    return np.lib.format.open_memmap(memmap_filename, mode='w+',
+                                     dtype=np.uint8, shape=mosaic_shape)
+
+
+@profiled
 def generate_mosaic(imgs, rows, columns, auto_bbox=True, auto_border=True,
-                    scaling_method='resize_to_avg'):
+                    scaling_method='resize_to_avg', memmap_filename=None,
+                    jobs=1, max_cell_size=None, layout='grid',
+                    canvas_width=None, row_height=None, spacing=0):
     """ Generate a mosaic from a list of images
 
     Parameters
@@ -148,6 +588,17 @@ def generate_mosaic(imgs, rows, columns, auto_bbox=True, auto_border=True,
         Add a border around the bounding box.
     scaling_method : {'resize_to_avg', 'resize_to_max', 'pad_to_max'}, optional
         Method used to scale the images.
+    memmap_filename : str, optional
+        Build the mosaic in a memory-mapped .npy file instead of in memory.
+    jobs : int, optional
+        Number of threads used to scale the images.
+    max_cell_size : int, optional
+        Largest side of a cell (see mosaic_layout).
+    layout : {'grid', 'justified'}, optional
+        Grid of rows x columns identical cells, or justified rows that
+        scale each image to fill the canvas (see mosaic_layout).
+    canvas_width, row_height, spacing : optional
+        Options of the justified layout (see layout.justified_layout).
 
     Returns
     -------
@@ -157,55 +608,30 @@ def generate_mosaic(imgs, rows, columns, auto_bbox=True, auto_border=True,
     """
     sizes = np.zeros((len(imgs), 2))
     for i, img in enumerate(imgs):
-        if auto_bbox:
-            imgs[i] = auto_crop(img)
-        if auto_border:
-            border = (img.shape[0] + img.shape[1]) // 20
-            imgs[i] = auto_crop(img, borders=border)
+        borders = mosaic_borders(img.shape, auto_bbox, auto_border)
+        if borders is not None:
+            imgs[i] = auto_crop(img, borders=borders)
         sizes[i] = imgs[i].shape[0:2]
 
-    # Compute the final size of the mosaic using one of three methods
-    ratio = sizes[:, 0] / sizes[:, 1]
-    if scaling_method == 'resize_to_avg':
-        final_size = np.mean(sizes, axis=0, dtype=np.uint16)
-    elif scaling_method == 'resize_to_max' or scaling_method == 'pad_to_max':
-        final_size = np.max(sizes, axis=0).astype(np.uint16)
-    avg_ratio = final_size[0] / final_size[1]
-    for i, img in enumerate(imgs):
-        # If the image is wider than the final, then the width is set to the
-        # final width and we compute the height accordingly.
-        if ratio[i] > avg_ratio:
-            dim_1 = final_size[0]
-            dim_2 = dim_1 / ratio[i]
-        else:
-            dim_2 = final_size[1]
-            dim_1 = dim_2 * ratio[i]
-
-        if scaling_method == 'resize_to_avg' \
-                or scaling_method == 'resize_to_max':
-            imgs[i] = np.asarray(resize(img, dimensions=(dim_2, dim_1)))
-        imgs[i] = pad_image_to_center(imgs[i], final_size)
-
-    mosaic = np.zeros((int(final_size[0] * rows),
-                       int(final_size[1] * columns), 3))
-
-    # With the image now resized, we can create the mosaic
-    for i, img in enumerate(imgs):
-        if rows <= columns:
-            row = i % columns
-            col = i // columns
-        else:
-            row = i // rows
-            col = i % rows
-        mosaic[col * final_size[0]:(col + 1) * final_size[0],
-               row * final_size[1]:(row + 1) * final_size[1], :] = img[:, :, 0:3]
+    plan = mosaic_layout(sizes, rows, columns, scaling_method, max_cell_size,
+                         layout, canvas_width, row_height, spacing)
+    mosaic = mosaic_canvas(plan.shape, 1, 1, memmap_filename)
+
+    # The images are scaled directly in their cell of the mosaic
+    fit = scaling_method == 'resize_to_avg' \
+        or scaling_method == 'resize_to_max' or layout == 'justified'
+    resize_into_cells(imgs, layout_cells(mosaic, plan), fit, jobs)
 
-    return mosaic.astype(np.uint8)
+    return mosaic
 
 
+@profiled
 def pad_image_to_center(img, new_shape):
     """ Pad image to center (always larger than the original image)
 
+    The padded image is allocated, use canvas.PaddedImage to only record
+    the padding until the image is written.
+
     Parameters
     ----------
     img : ndarray
@@ -219,21 +645,4 @@ def pad_image_to_center(img, new_shape):
         Padded image.
 
     """
-    old_image_height, old_image_width, channels = img.shape
-    new_image_width, new_image_height = new_shape[::-1]
-    if old_image_width > new_image_width or old_image_height > new_image_height:
-        raise ValueError('New shape must be larger than old shape!')
-
-    color = img[0, 0]
-    new_img = np.full((new_image_height, new_image_width, channels),
-                      color, dtype=np.uint8)
-
-    # compute center offset
-    x_center = (new_image_width - old_image_width) // 2
-    y_center = (new_image_height - old_image_height) // 2
-
-    # copy img image into center of result image
-    new_img[y_center:y_center+old_image_height,
-            x_center:x_center+old_image_width] = img
-
-    return new_img
+    return PaddedImage(img, new_shape).materialize()
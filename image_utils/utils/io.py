@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import sys
+
+from image_utils.utils.lazy import lazy_import
+from image_utils.utils.profiling import stage
+
+imageio = lazy_import('imageio.v2')
+imageio_v3 = lazy_import('imageio.v3')
+np = lazy_import('numpy')
+Image = lazy_import('PIL.Image')
+
+JPEG_EXTENSIONS = ['.jpg', '.jpeg', '.JPG', '.JPEG']
+
+# Filename standing for the standard input or output
+PIPE = '-'
+NPY_MAGIC = b'\x93NUMPY'
+
+# Image read from the standard input, which can only be consumed once
+_stdin = {}
+
+
+def is_pipe(filename):
+    """ Whether a filename stands for the standard input or output """
+    return filename == PIPE
+
+
+def _read_npy_stream(f):
+    """ Read a .npy array from a stream, which cannot be memory-mapped """
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        header = np.lib.format.read_array_header_1_0(f)
+    else:
+        header = np.lib.format.read_array_header_2_0(f)
+    shape, fortran_order, dtype = header
+    img = np.empty(shape, dtype=dtype, order='F' if fortran_order else 'C')
+    view = memoryview(img.reshape(-1, order='A')).cast('B')
+    read = 0
+    while read < len(view):
+        count = f.readinto(view[read:])
+        if not count:
+            raise IOError('Truncated .npy stream.')
+        read += count
+    return img
+
+
+def _write_npy_stream(f, img):
+    """ Write an array as .npy to a stream, which cannot be seeked """
+    img = np.ascontiguousarray(img)
+    np.lib.format.write_array_header_1_0(
+        f, np.lib.format.header_data_from_array_1_0(img))
+    f.write(memoryview(img.reshape(-1)).cast('B'))
+    f.flush()
+
+
+def _read_stdin():
+    """ Image on the standard input, .npy or any format known by imageio """
+    if 'img' not in _stdin:
+        f = sys.stdin.buffer
+        with stage('decode', filename=PIPE) as fields:
+            magic = f.peek(len(NPY_MAGIC))[0:len(NPY_MAGIC)]
+            if not magic:
+                raise IOError('No image on the standard input.')
+            if magic == NPY_MAGIC:
+                img = _read_npy_stream(f)
+            else:
+                img = imageio.imread(f.read())
+            fields['bytes_read'] = img.nbytes
+        _stdin['img'] = img
+    return _stdin['img']
+
+
+def _read_jpeg_draft(filename, min_size):
+    """ Decode a JPEG at the smallest DCT scale covering min_size """
+    with Image.open(filename) as img:
+        if img.format != 'JPEG' or img.mode not in ['RGB', 'L']:
+            return None
+        img.draft(img.mode, (int(np.ceil(min_size[1])),
+                             int(np.ceil(min_size[0]))))
+        return np.asarray(img)
+
+
+def read_image(filename, min_size=None):
+    """ Decode an image file to an ndarray
+
+    NumPy files are memory-mapped (copy-on-write): the pixels are only read
+    when they are used, which makes .npy the cheapest format between the
+    stages of a shell pipeline. A filename of '-' reads the standard input
+    (a .npy stream or any encoded image), once per process.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the image, or '-'.
+    min_size : tuple, optional
+        Height and width the image is going to be scaled down to. JPEG
+        images are then decoded by libjpeg at a reduced scale (1/2, 1/4 or
+        1/8) that is still at least min_size, which is several times faster
+        for large downscales. Other formats are fully decoded.
+
+    Returns
+    -------
+    img : ndarray
+        Decoded image.
+
+    """
+    if is_pipe(filename):
+        return _read_stdin()
+    with stage('decode', filename=filename,
+               bytes_read=os.path.getsize(filename)) as fields:
+        _, ext = os.path.splitext(filename)
+        if ext.lower() == '.npy':
+            return np.load(filename, mmap_mode='c')
+        if min_size is not None and ext in JPEG_EXTENSIONS:
+            img = _read_jpeg_draft(filename, min_size)
+            if img is not None:
+                fields['draft_shape'] = img.shape
+                return img
+        return imageio.imread(filename)
+
+
+def decode_image(data):
+    """ Decode an encoded image held in memory
+
+    Parameters
+    ----------
+    data : bytes
+        Content of an image file.
+
+    Returns
+    -------
+    img : ndarray
+        Decoded image.
+
+    """
+    with stage('decode', bytes_read=len(data)):
+        if data[0:len(NPY_MAGIC)] == NPY_MAGIC:
+            return np.load(io.BytesIO(data))
+        return imageio.imread(data)
+
+
+def _drop_alpha(img, ext):
+    """ JPEG does not support transparency """
+    if ext in JPEG_EXTENSIONS and img.ndim == 3 and img.shape[-1] == 4:
+        return img[:, :, 0:3]
+    return img
+
+
+def write_bytes(filename, data):
+    """ Write an image encoded in memory (e.g. by encode_image) to a file
+
+    A filename of '-' writes it to the standard output, from which the
+    next stage of a pipeline decodes it.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the output image, or '-'.
+    data : bytes
+        Content of the image file.
+
+    """
+    with stage('encode', filename=filename) as fields:
+        if is_pipe(filename):
+            sys.stdout.buffer.write(data)
+            sys.stdout.buffer.flush()
+        else:
+            with open(filename, 'wb') as f:
+                f.write(data)
+        fields['bytes_written'] = len(data)
+
+
+def encode_image(img, ext, **kwargs):
+    """ Encode an ndarray (or PIL image) in memory
+
+    The alpha channel is dropped for JPEG outputs, as in write_image.
+
+    Parameters
+    ----------
+    img : ndarray or PIL.Image.Image
+        Image to encode.
+    ext : str
+        Extension of the format (e.g. '.png' or '.jpg').
+    **kwargs
+        Options of the writer (e.g. quality for JPEG).
+
+    Returns
+    -------
+    data : bytes
+        Content of the image file.
+
+    """
+    img = _drop_alpha(np.asarray(img), ext)
+    with stage('encode') as fields:
+        if ext.lower() == '.npy':
+            buffer = io.BytesIO()
+            np.save(buffer, img)
+            data = buffer.getvalue()
+        else:
+            data = imageio_v3.imwrite('<bytes>', img, extension=ext,
+                                      **kwargs)
+        fields['bytes_written'] = len(data)
+    return data
+
+
+def write_image(filename, img, **kwargs):
+    """ Encode an ndarray (or PIL image) to a file
+
+    The alpha channel is dropped for JPEG outputs since the format does not
+    support it. .npy outputs are written raw, and a filename of '-' writes
+    a .npy stream to the standard output, to be read by the next stage of
+    a pipeline.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the output image, or '-'.
+    img : ndarray or PIL.Image.Image
+        Image to encode.
+    **kwargs
+        Options of the imageio writer (e.g. quality for JPEG).
+
+    """
+    _, ext = os.path.splitext(filename)
+    img = _drop_alpha(np.asarray(img), ext)
+    with stage('encode', filename=filename) as fields:
+        if is_pipe(filename):
+            _write_npy_stream(sys.stdout.buffer, img)
+            fields['bytes_written'] = img.nbytes
+            return
+        if ext.lower() == '.npy':
+            np.save(filename, img)
+        else:
+            imageio.imwrite(filename, img, **kwargs)
+        fields['bytes_written'] = os.path.getsize(filename)
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+from collections import namedtuple
+
+from image_utils.utils.lazy import lazy_import
+from image_utils.utils.profiling import profiled
+
+np = lazy_import('numpy')
+
+LAYOUTS = ['grid', 'justified']
+# Rows of a justified layout of several images are at least this fraction
+# of the target height, which bounds the rows tried by the optimization
+MIN_ROW_SCALE = 0.5
+
+Layout = namedtuple('Layout', ['boxes', 'shape'])
+
+
+def grid_layout(count, rows, columns, cell_size):
+    """ Layout of a grid of identical cells
+
+    The images fill the grid row by row, or column by column when there
+    are more rows than columns.
+
+    Parameters
+    ----------
+    count : int
+        Number of images.
+    rows : int
+        Number of rows in the mosaic.
+    columns : int
+        Number of columns in the mosaic.
+    cell_size : tuple
+        Height and width of a cell.
+
+    Returns
+    -------
+    layout : Layout
+        Boxes (top, left, height, width) of the images, as an (N, 4) int
+        array, and height and width of the canvas.
+
+    """
+    height, width = int(cell_size[0]), int(cell_size[1])
+    i = np.arange(count)
+    if rows <= columns:
+        row, col = i // columns, i % columns
+    else:
+        row, col = i % rows, i // rows
+    boxes = np.stack([row * height, col * width,
+                      np.full(count, height), np.full(count, width)], axis=1)
+    return Layout(boxes.astype(np.intp),
+                  (int(height * rows), int(width * columns)))
+
+
+def _row_heights(ratios, counts, width, row_height, spacing, last):
+    """ Heights of rows of images, from the sums of their ratios """
+    heights = (width - spacing * (counts - 1)) / ratios
+    if last:
+        # The last row is not stretched, it keeps the target height
+        heights = np.minimum(heights, row_height)
+    return heights
+
+
+@profiled
+def justified_layout(sizes, width=None, row_height=None, spacing=0):
+    """ Layout of rows of images scaled to fill the width of the canvas
+
+    The images keep their ratio and their order. Each row is scaled so that
+    its images exactly fill the canvas width, and the rows are chosen by
+    dynamic programming to keep their heights as close as possible to
+    row_height, so that only the last row is padded and the images are
+    resampled as little as possible. Thousands of images are laid out in
+    a fraction of a second.
+
+    Parameters
+    ----------
+    sizes : ndarray
+        (N, 2) heights and widths of the images.
+    width : int, optional
+        Width of the canvas. [about the height of the canvas]
+    row_height : float, optional
+        Target height of the rows. [median height of the images]
+    spacing : int, optional
+        Pixels between the images.
+
+    Returns
+    -------
+    layout : Layout
+        Boxes (top, left, height, width) of the images, as an (N, 4) int
+        array, and height and width of the canvas.
+
+    """
+    sizes = np.asarray(sizes, dtype=np.float64).reshape(-1, 2)
+    count = len(sizes)
+    if count == 0:
+        raise ValueError('No image to lay out.')
+    aspects = sizes[:, 1] / sizes[:, 0]
+    if row_height is None:
+        row_height = float(np.median(sizes[:, 0]))
+    if width is None:
+        # Squarish canvas, the area of the images at the target height
+        width = max(np.sqrt(aspects.sum() * row_height ** 2
+                            + spacing * count * row_height),
+                    aspects.max() * row_height)
+    width = int(round(width))
+
+    # Prefix sums of the ratios, the width of a row of height 1
+    cumulative = np.concatenate([[0.0], np.cumsum(aspects)])
+    best = np.full(count + 1, np.inf)
+    best[0] = 0.0
+    previous = np.zeros(count + 1, dtype=np.intp)
+    for stop in range(1, count + 1):
+        # Rows grow shorter as images are added, only the starts keeping
+        # them above the minimum height are considered
+        lowest = width / (MIN_ROW_SCALE * row_height)
+        first = np.searchsorted(cumulative, cumulative[stop] - lowest)
+        first = min(max(0, first), stop - 1)
+        counts = stop - np.arange(first, stop)
+        heights = _row_heights(cumulative[stop] - cumulative[first:stop],
+                               counts, width, row_height, spacing,
+                               stop == count)
+        # Each image of a row is scaled by the ratio of the row and target
+        # heights, which costs both canvas and resampling
+        totals = best[first:stop] \
+            + counts * np.log(heights / row_height) ** 2
+        start = int(np.argmin(totals))
+        best[stop] = totals[start]
+        previous[stop] = first + start
+
+    breaks = [count]
+    while breaks[-1] > 0:
+        breaks.append(previous[breaks[-1]])
+    breaks = breaks[::-1]
+
+    boxes = np.zeros((count, 4), dtype=np.intp)
+    top = 0
+    for start, stop in zip(breaks[:-1], breaks[1:]):
+        exact = _row_heights(cumulative[stop] - cumulative[start],
+                             stop - start, width, row_height, spacing,
+                             stop == count)
+        height = max(1, int(round(exact)))
+        # Rounded edges, so that a full row ends exactly at the width
+        edges = np.round(np.concatenate(
+            [[0.0], np.cumsum(aspects[start:stop] * exact + spacing)]))
+        boxes[start:stop, 0] = top
+        boxes[start:stop, 1] = edges[:-1]
+        boxes[start:stop, 2] = height
+        boxes[start:stop, 3] = np.maximum(1, edges[1:] - edges[:-1]
+                                          - spacing)
+        top += height + spacing
+
+    return Layout(boxes, (int(top - spacing),
+                          int(max(width, (boxes[:, 1] + boxes[:, 3]).max()))))
+
+
+def layout_cells(canvas, layout):
+    """ Views of the canvas receiving each image of a layout """
+    return [canvas[top:top + height, left:left + width]
+            for top, left, height, width in layout.boxes]
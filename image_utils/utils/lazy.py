@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+import importlib
+import sys
+
+
+class _LazyModule(object):
+    """ Stand-in for a module, imported on the first attribute access """
+
+    def __init__(self, name):
+        self.__name__ = name
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self.__name__)
+        value = getattr(module, attr)
+        # Cache the attribute so later accesses are plain lookups
+        setattr(self, attr, value)
+        return value
+
+    def __repr__(self):
+        return '<lazy module {!r}>'.format(self.__name__)
+
+
+def lazy_import(name):
+    """ Import a module on the first access to one of its attributes
+
+    Used for the heavy dependencies (numpy, scipy, PIL, imageio) so that
+    importing image_utils, or running a script with --help, does not pay
+    for modules that are never used.
+
+    Parameters
+    ----------
+    name : str
+        Absolute name of the module (e.g. 'scipy.ndimage').
+
+    Returns
+    -------
+    module : module
+        The module if it is already imported, otherwise a stand-in that
+        imports it when one of its attributes is first accessed.
+
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    return _LazyModule(name)
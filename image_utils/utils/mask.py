@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+from image_utils.utils.lazy import lazy_import
+
+np = lazy_import('numpy')
+ndimage = lazy_import('scipy.ndimage')
+
+# Number of pixels processed at once when computing color distances, this
+# bounds the size of the temporaries independently of the image size.
+CHUNK_PIXELS = 2 ** 22
+
+# From this number of reference colors, a lookup table over the 256**3
+# colors is faster than computing one distance per color.
+LUT_MIN_COLORS = 4
+
+
+def color_distance_mask(img, value, threshold, inclusive=True):
+    """ Find the pixels close to a color
+
+    The squared euclidean distance is compared to threshold**2 so that no
+    square root is needed. For uint8 images the distances are computed with
+    integers and, whatever the dtype, the image is processed by chunks of
+    rows to avoid full-size temporaries.
+
+    Parameters
+    ----------
+    img : ndarray
+        Input img (H, W, C). Only the first three channels are used.
+    value : array-like
+        Reference color.
+    threshold : float
+        Maximum distance to the reference color.
+    inclusive : bool, optional
+        Whether a distance equal to threshold is considered close.
+
+    Returns
+    -------
+    mask : ndarray
+        Boolean mask (H, W), True where the pixel is close to value.
+
+    """
+    img = img[:, :, 0:3] if img.ndim == 3 else img[:, :, None]
+    if img.dtype == np.uint8:
+        work_dtype = np.int32
+    else:
+        work_dtype = np.float64
+    value = np.asarray(value)[0:img.shape[-1]].astype(work_dtype)
+    limit = float(threshold) ** 2
+
+    mask = np.empty(img.shape[0:2], dtype=bool)
+    step = max(1, CHUNK_PIXELS // max(1, img.shape[1]))
+    for start in range(0, img.shape[0], step):
+        chunk = img[start:start + step]
+        dist = np.zeros(chunk.shape[0:2], dtype=work_dtype)
+        for c in range(chunk.shape[-1]):
+            diff = chunk[:, :, c].astype(work_dtype)
+            diff -= value[c]
+            diff *= diff
+            dist += diff
+        if inclusive:
+            np.less_equal(dist, limit, out=mask[start:start + step])
+        else:
+            np.less(dist, limit, out=mask[start:start + step])
+
+    return mask
+
+
+def color_lut(colors, threshold, inclusive=True):
+    """ Lookup table of the uint8 colors close to any reference color
+
+    Only the cube around each reference color is evaluated, the table is
+    indexed by (r << 16) | (g << 8) | b.
+
+    Parameters
+    ----------
+    colors : array-like
+        Reference colors (N, 3).
+    threshold : float
+        Maximum distance to a reference color.
+    inclusive : bool, optional
+        Whether a distance equal to threshold is considered close.
+
+    Returns
+    -------
+    lut : ndarray
+        Boolean table of 256**3 entries.
+
+    """
+    lut = np.zeros(256 ** 3, dtype=bool)
+    limit = float(threshold) ** 2
+    radius = int(np.floor(threshold))
+    for color in np.asarray(colors, dtype=np.int32).reshape(-1, 3):
+        axes = [np.arange(max(0, c - radius), min(255, c + radius) + 1,
+                          dtype=np.int32) for c in color]
+        r, g, b = np.meshgrid(*axes, indexing='ij', sparse=True)
+        dist = (r - color[0]) ** 2 + (g - color[1]) ** 2 + (b - color[2]) ** 2
+        close = dist <= limit if inclusive else dist < limit
+        index = (r << 16) | (g << 8) | b
+        lut[index[close]] = True
+    return lut
+
+
+def lut_mask(img, lut):
+    """ Apply a color lookup table to a uint8 image
+
+    Parameters
+    ----------
+    img : ndarray
+        Input img (H, W, C) of dtype uint8. Only the first three channels
+        are used.
+    lut : ndarray
+        Boolean table of 256**3 entries (see color_lut).
+
+    Returns
+    -------
+    mask : ndarray
+        Boolean mask (H, W).
+
+    """
+    mask = np.empty(img.shape[0:2], dtype=bool)
+    step = max(1, CHUNK_PIXELS // max(1, img.shape[1]))
+    for start in range(0, img.shape[0], step):
+        chunk = img[start:start + step]
+        index = chunk[:, :, 0].astype(np.uint32) << 16
+        index |= chunk[:, :, 1].astype(np.uint32) << 8
+        index |= chunk[:, :, 2]
+        np.take(lut, index, out=mask[start:start + step])
+    return mask
+
+
+def colors_distance_mask(img, colors, threshold, inclusive=True):
+    """ Find the pixels close to any of several colors
+
+    Uses a lookup table for uint8 images with many reference colors (see
+    LUT_MIN_COLORS), otherwise one integer distance per color.
+
+    Parameters
+    ----------
+    img : ndarray
+        Input img (H, W, C). Only the first three channels are used.
+    colors : array-like
+        Reference colors (N, 3).
+    threshold : float
+        Maximum distance to a reference color.
+    inclusive : bool, optional
+        Whether a distance equal to threshold is considered close.
+
+    Returns
+    -------
+    mask : ndarray
+        Boolean mask (H, W), True where the pixel is close to a color.
+
+    """
+    colors = np.asarray(colors).reshape(-1, np.asarray(colors).shape[-1])
+    if img.dtype == np.uint8 and img.ndim == 3 and img.shape[-1] >= 3 \
+            and len(colors) >= LUT_MIN_COLORS:
+        return lut_mask(img, color_lut(colors[:, 0:3], threshold, inclusive))
+
+    mask = color_distance_mask(img, colors[0], threshold, inclusive)
+    for color in colors[1:]:
+        mask |= color_distance_mask(img, color, threshold, inclusive)
+    return mask
+
+
+def connected_to_seeds(mask, seeds):
+    """ Keep the regions of a mask connected to at least one seed
+
+    Regions are 4-connected and labeled in a single linear pass.
+
+    Parameters
+    ----------
+    mask : ndarray
+        Boolean mask (H, W).
+    seeds : list or ndarray
+        Seed positions as (row, col) or a boolean mask of the same shape.
+
+    Returns
+    -------
+    connected : ndarray
+        Boolean mask (H, W) of the regions containing a seed.
+
+    """
+    labels, nb_labels = ndimage.label(mask)
+    if isinstance(seeds, np.ndarray) and seeds.shape == mask.shape:
+        seed_labels = np.unique(labels[seeds])
+    else:
+        seeds = np.asarray(seeds, dtype=np.intp).reshape(-1, 2)
+        seed_labels = np.unique(labels[seeds[:, 0], seeds[:, 1]])
+    keep = np.zeros(nb_labels + 1, dtype=bool)
+    keep[seed_labels] = True
+    keep[0] = False
+
+    return keep[labels]
+
+
+def flood_fill_mask(img, seeds, threshold, inclusive=True):
+    """ Regions of similar color connected to one or several seeds
+
+    Equivalent to a 4-connected flood fill from each seed, with the color of
+    the seed as reference, but computed with a single labeling pass per
+    distinct seed color (e.g. one pass for four corners of the same color).
+    The cost is linear in the number of pixels.
+
+    Parameters
+    ----------
+    img : ndarray
+        Input img (H, W, C). Only the first three channels are used.
+    seeds : list
+        Seed positions as (row, col).
+    threshold : float
+        Maximum distance to the color of the seed.
+    inclusive : bool, optional
+        Whether a distance equal to threshold is considered close.
+
+    Returns
+    -------
+    mask : ndarray
+        Boolean mask (H, W), True in the filled regions.
+
+    """
+    seeds = np.asarray(seeds, dtype=np.intp).reshape(-1, 2)
+    rgb = img[:, :, 0:3] if img.ndim == 3 else img[:, :, None]
+    seed_colors = rgb[seeds[:, 0], seeds[:, 1]]
+    colors, groups = np.unique(seed_colors, axis=0, return_inverse=True)
+
+    mask = None
+    for i, color in enumerate(colors):
+        candidates = color_distance_mask(rgb, color, threshold, inclusive)
+        filled = connected_to_seeds(candidates, seeds[groups.ravel() == i])
+        if mask is None:
+            mask = filled
+        else:
+            mask |= filled
+    return mask
+
+
+def bounding_box(mask):
+    """ Bounding box of the True values of a mask
+
+    Parameters
+    ----------
+    mask : ndarray
+        Boolean mask (H, W).
+
+    Returns
+    -------
+    bbox : tuple or None
+        (row_min, row_max, col_min, col_max), inclusive, or None if the mask
+        is empty.
+
+    """
+    rows = np.flatnonzero(mask.any(axis=1))
+    if rows.size == 0:
+        return None
+    cols = np.flatnonzero(mask[rows[0]:rows[-1] + 1].any(axis=0))
+
+    return rows[0], rows[-1], cols[0], cols[-1]
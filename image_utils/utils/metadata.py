@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import sqlite3
+from collections import namedtuple
+
+from image_utils.utils.io import NPY_MAGIC, is_pipe, read_image
+from image_utils.utils.lazy import lazy_import
+
+imageio = lazy_import('imageio.v2')
+np = lazy_import('numpy')
+Image = lazy_import('PIL.Image')
+
+ImageInfo = namedtuple('ImageInfo', ['height', 'width', 'mode', 'n_frames'])
+
+
+def probe(filename):
+    """ Read the dimensions of an image from its header
+
+    The pixels are not decoded. NumPy files are memory-mapped, PIL is used
+    for still and animated images and imageio (e.g. ffmpeg) for videos.
+    The standard input ('-') is read once and kept, see io.read_image.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the image, or '-'.
+
+    Returns
+    -------
+    info : ImageInfo
+        Height, width, mode (e.g. 'RGB', None if unknown) and number of
+        frames (None if unknown).
+
+    """
+    if is_pipe(filename):
+        shape = read_image(filename).shape
+        return ImageInfo(shape[0], shape[1], None, 1)
+    if os.path.splitext(filename)[1].lower() == '.npy':
+        shape = np.load(filename, mmap_mode='r').shape
+        return ImageInfo(shape[0], shape[1], None, 1)
+
+    try:
+        with Image.open(filename) as img:
+            return ImageInfo(img.size[1], img.size[0], img.mode,
+                             getattr(img, 'n_frames', 1))
+    except Image.UnidentifiedImageError:
+        pass
+
+    reader = imageio.get_reader(filename)
+    try:
+        meta = reader.get_meta_data()
+        n_frames = reader.get_length()
+        if 'size' in meta:
+            width, height = meta['size']
+        else:
+            height, width = reader.get_data(0).shape[0:2]
+    finally:
+        reader.close()
+    if n_frames is None or n_frames == float('inf'):
+        n_frames = None
+    return ImageInfo(int(height), int(width), None, n_frames)
+
+
+def probe_bytes(data):
+    """ Read the dimensions of an image held in memory from its header
+
+    Parameters
+    ----------
+    data : bytes
+        Content of an image file.
+
+    Returns
+    -------
+    info : ImageInfo
+        See probe, None if the header is not understood by NumPy or PIL
+        (e.g. a video).
+
+    """
+    f = io.BytesIO(data)
+    if data[0:len(NPY_MAGIC)] == NPY_MAGIC:
+        try:
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape = np.lib.format.read_array_header_1_0(f)[0]
+            else:
+                shape = np.lib.format.read_array_header_2_0(f)[0]
+        except ValueError:
+            return None
+        if len(shape) < 2:
+            return None
+        return ImageInfo(shape[0], shape[1], None, 1)
+
+    try:
+        with Image.open(f) as img:
+            return ImageInfo(img.size[1], img.size[0], img.mode,
+                             getattr(img, 'n_frames', 1))
+    except Image.DecompressionBombError as e:
+        raise ValueError(str(e))
+    except (Image.UnidentifiedImageError, OSError):
+        return None
+
+
+class MetadataIndex(object):
+    """ Persistent index of image headers, stored in SQLite
+
+    Entries are keyed by the absolute path and invalidated when the
+    modification time or the size of the file changes, so repeated runs
+    over the same files do not probe them again.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the SQLite database (created if needed).
+
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._db = sqlite3.connect(filename, timeout=30)
+        self._db.execute('CREATE TABLE IF NOT EXISTS images ('
+                         'path TEXT PRIMARY KEY, mtime REAL, size INTEGER, '
+                         'height INTEGER, width INTEGER, mode TEXT, '
+                         'n_frames INTEGER)')
+        self._db.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, filename):
+        """ Dimensions of an image, from the index or from its header
+
+        Parameters
+        ----------
+        filename : str
+            Path of the image.
+
+        Returns
+        -------
+        info : ImageInfo
+            See probe.
+
+        """
+        return self.get_many([filename])[0]
+
+    def get_many(self, filenames):
+        """ Dimensions of many images, committed in a single transaction
+
+        Parameters
+        ----------
+        filenames : list
+            Paths of the images.
+
+        Returns
+        -------
+        infos : list
+            ImageInfo of each image.
+
+        """
+        infos = []
+        with self._db:
+            for filename in filenames:
+                path = os.path.abspath(filename)
+                stat = os.stat(path)
+                key = (path, stat.st_mtime, stat.st_size)
+                row = self._db.execute(
+                    'SELECT height, width, mode, n_frames FROM images '
+                    'WHERE path = ? AND mtime = ? AND size = ?',
+                    key).fetchone()
+                if row is not None:
+                    self.hits += 1
+                    infos.append(ImageInfo(*row))
+                    continue
+
+                self.misses += 1
+                info = probe(path)
+                self._db.execute('INSERT OR REPLACE INTO images VALUES '
+                                 '(?, ?, ?, ?, ?, ?, ?)', key + tuple(info))
+                infos.append(info)
+        return infos
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def image_info(filename, index=None):
+    """ Dimensions of an image, through an index if one is given
+
+    Parameters
+    ----------
+    filename : str
+        Path of the image.
+    index : MetadataIndex, optional
+        Persistent index to use.
+
+    Returns
+    -------
+    info : ImageInfo
+        See probe.
+
+    """
+    if index is not None and not is_pipe(filename):
+        return index.get(filename)
+    return probe(filename)
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+from image_utils.utils.frames import parallel_map
+from image_utils.utils.image import (crop_to_bbox, find_bbox, fit_to_cell,
+                                     mosaic_borders, mosaic_canvas,
+                                     mosaic_layout, scale_into_cell)
+from image_utils.utils.io import read_image
+from image_utils.utils.layout import layout_cells
+from image_utils.utils.lazy import lazy_import
+from image_utils.utils.metadata import image_info
+
+np = lazy_import('numpy')
+
+
+def generate_mosaic_from_files(filenames, rows, columns, auto_bbox=True,
+                               auto_border=True,
+                               scaling_method='resize_to_avg',
+                               memmap_filename=None, index=None, jobs=1,
+                               draft=False, max_cell_size=None,
+                               layout='grid', canvas_width=None,
+                               row_height=None, spacing=0):
+    """ Generate a mosaic from image files, one image in memory at a time
+
+    Same result as generate_mosaic, in two passes. The first pass only
+    collects the sizes (from the headers, or the crop windows when the
+    images are cropped). The second pass decodes, crops and scales each
+    image and writes it directly in its cell, so the peak memory is about
+    the canvas plus one image per thread. With memmap_filename, the canvas
+    itself is on disk.
+
+    Parameters
+    ----------
+    filenames : list
+        List of image files.
+    rows : int
+        Number of rows in the mosaic.
+    columns : int
+        Number of columns in the mosaic.
+    auto_bbox : bool, optional
+        Crop the images to the bounding box of the background.
+    auto_border : bool, optional
+        Add a border around the bounding box.
+    scaling_method : {'resize_to_avg', 'resize_to_max', 'pad_to_max'}, optional
+        Method used to scale the images.
+    memmap_filename : str, optional
+        Build the mosaic in a memory-mapped .npy file instead of in memory.
+    index : MetadataIndex, optional
+        Index used to get the sizes of the images without probing them.
+    jobs : int, optional
+        Number of threads decoding and scaling the images of the second
+        pass.
+    draft : bool, optional
+        In the second pass, decode JPEG images at the smallest scale still
+        larger than their cell (see read_image). Much faster for large
+        photos, the result differs slightly from a full decode.
+    max_cell_size : int, optional
+        Largest side of a cell (see mosaic_layout).
+    layout : {'grid', 'justified'}, optional
+        Grid of identical cells or justified rows (see mosaic_layout).
+    canvas_width, row_height, spacing : optional
+        Options of the justified layout (see layout.justified_layout).
+
+    Returns
+    -------
+    mosaic : ndarray
+        Mosaic of the images.
+
+    """
+    # First pass, sizes only
+    sizes = np.zeros((len(filenames), 2))
+    full_sizes = np.zeros((len(filenames), 2))
+    bboxes = []
+    for i, filename in enumerate(filenames):
+        bbox = None
+        if auto_bbox or auto_border:
+            img = read_image(filename)
+            full_sizes[i] = img.shape[0:2]
+            borders = mosaic_borders(img.shape, auto_bbox, auto_border)
+            bbox = find_bbox(img, borders)
+            if bbox is None:
+                sizes[i] = img.shape[0:2]
+            else:
+                sizes[i] = (bbox[1] - bbox[0], bbox[3] - bbox[2])
+            del img
+        else:
+            info = image_info(filename, index)
+            full_sizes[i] = sizes[i] = (info.height, info.width)
+        bboxes.append(bbox)
+
+    plan = mosaic_layout(sizes, rows, columns, scaling_method, max_cell_size,
+                         layout, canvas_width, row_height, spacing)
+    mosaic = mosaic_canvas(plan.shape, 1, 1, memmap_filename)
+    cells = layout_cells(mosaic, plan)
+
+    # Second pass, each image is placed as soon as it is scaled
+    fit = scaling_method == 'resize_to_avg' \
+        or scaling_method == 'resize_to_max' or layout == 'justified'
+
+    def _place(i):
+        bbox = bboxes[i]
+        if draft and fit:
+            # Size of the whole image such that its crop covers the cell
+            width, height = fit_to_cell(sizes[i], cells[i].shape[0:2])
+            img = read_image(filenames[i],
+                             min_size=(full_sizes[i] * (height, width)
+                                       / sizes[i]))
+            if bbox is not None and img.shape[0] != full_sizes[i][0]:
+                factors = np.repeat(img.shape[0:2] / full_sizes[i], 2)
+                bbox = tuple(int(x) for x in np.round(bbox * factors))
+        else:
+            img = read_image(filenames[i])
+        if bbox is not None:
+            img = crop_to_bbox(img, bbox)
+        scale_into_cell(cells[i], img, fit)
+
+    for _ in parallel_map(_place, range(len(filenames)), jobs):
+        pass
+
+    return mosaic
@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+import os
+from collections import namedtuple
+
+from image_utils.utils.frames import iter_frames, prefetch
+from image_utils.utils.lazy import lazy_import
+from image_utils.utils.profiling import profiled, stage
+
+np = lazy_import('numpy')
+Image = lazy_import('PIL.Image')
+GifImagePlugin = lazy_import('PIL.GifImagePlugin')
+spatial = lazy_import('scipy.spatial')
+
+# Bits per channel of the color cube used to map pixels to a palette
+CUBE_BITS = 6
+# Pixels sampled from each frame to build the palettes
+SAMPLE_PIXELS = 16384
+# Maximum number of samples kept per palette
+MAX_SAMPLES = 2 ** 20
+# Bits per channel of the histograms compared to detect scene cuts
+HISTOGRAM_BITS = 3
+# Duration of the frames (ms) that do not store one
+DEFAULT_DURATION = 100
+
+PalettePlan = namedtuple('PalettePlan', ['starts', 'palettes', 'alpha'])
+
+
+def _rgb(frame):
+    frame = np.asarray(frame)
+    if frame.ndim == 2:
+        return np.stack([frame] * 3, axis=-1)
+    return frame[:, :, 0:3]
+
+
+def _has_alpha(frame):
+    frame = np.asarray(frame)
+    return frame.ndim == 3 and frame.shape[2] == 4 \
+        and bool((frame[:, :, 3] < 255).any())
+
+
+def sample_pixels(frame, count=SAMPLE_PIXELS):
+    """ Evenly spaced pixels of a frame
+
+    Parameters
+    ----------
+    frame : ndarray
+        Input frame.
+    count : int, optional
+        Approximate number of pixels to sample.
+
+    Returns
+    -------
+    pixels : ndarray
+        Sampled RGB colors, of shape (N, 3).
+
+    """
+    rgb = _rgb(frame)
+    step = max(1, int(np.sqrt(rgb.shape[0] * rgb.shape[1] / count)))
+    return rgb[step // 2::step, step // 2::step].reshape(-1, 3)
+
+
+def color_histogram(frame, bits=HISTOGRAM_BITS):
+    """ Normalized histogram of the colors of a frame, on a coarse cube """
+    pixels = sample_pixels(frame, 4096).astype(np.intp) >> (8 - bits)
+    bins = (pixels[:, 0] << (2 * bits)) | (pixels[:, 1] << bits) \
+        | pixels[:, 2]
+    hist = np.bincount(bins, minlength=2 ** (3 * bits))
+    return hist / max(1, len(bins))
+
+
+@profiled
+def build_palette(pixels, colors=256):
+    """ Palette of the most representative colors of some pixels
+
+    Parameters
+    ----------
+    pixels : ndarray
+        RGB colors, of shape (N, 3).
+    colors : int, optional
+        Maximum number of colors of the palette.
+
+    Returns
+    -------
+    palette : ndarray
+        Colors of the palette, of shape (colors, 3) or fewer.
+
+    """
+    pixels = np.ascontiguousarray(pixels, dtype=np.uint8).reshape(1, -1, 3)
+    quantized = Image.fromarray(pixels).quantize(
+        colors, method=Image.Quantize.MEDIANCUT)
+    palette = np.asarray(quantized.getpalette()[0:3 * colors],
+                         dtype=np.uint8).reshape(-1, 3)
+    return palette[np.unique(np.asarray(quantized))]
+
+
+def palette_lut(palette, bits=CUBE_BITS):
+    """ Nearest palette index of every cell of a color cube
+
+    Parameters
+    ----------
+    palette : ndarray
+        Colors of the palette, of shape (N, 3), N <= 256.
+    bits : int, optional
+        Bits per channel of the cube, 2 ** (3 * bits) cells.
+
+    Returns
+    -------
+    lut : ndarray
+        Palette index of each cell, flat uint8 array (see map_to_palette).
+
+    """
+    shift = 8 - bits
+    centers = (np.arange(2 ** bits) << shift) + ((1 << shift) >> 1)
+    grid = np.stack(np.meshgrid(centers, centers, centers, indexing='ij'),
+                    axis=-1).reshape(-1, 3)
+    _, indices = spatial.cKDTree(palette.astype(np.float64)).query(grid)
+    return indices.astype(np.uint8)
+
+
+def map_to_palette(frame, lut, bits=CUBE_BITS):
+    """ Palette indices of the pixels of a frame, through a color cube
+
+    Parameters
+    ----------
+    frame : ndarray
+        Input frame.
+    lut : ndarray
+        Color cube, as returned by palette_lut.
+    bits : int, optional
+        Bits per channel of the cube.
+
+    Returns
+    -------
+    indices : ndarray
+        Palette index of each pixel, 2D uint8 array.
+
+    """
+    rgb = _rgb(frame)
+    shift = 8 - bits
+    cells = (rgb[:, :, 0] >> shift).astype(np.intp) << (2 * bits)
+    cells |= (rgb[:, :, 1] >> shift).astype(np.intp) << bits
+    cells |= rgb[:, :, 2] >> shift
+    return lut[cells]
+
+
+def _decimate(samples, max_samples):
+    pixels = np.concatenate(samples)
+    if len(pixels) > max_samples:
+        pixels = pixels[::int(np.ceil(len(pixels) / max_samples))]
+    return [pixels]
+
+
+@profiled
+def plan_palettes(frames, colors=256, scene_threshold=None):
+    """ Palettes of an animation, global or one per scene
+
+    The palettes are built from pixels sampled in every frame, keeping one
+    entry free for transparency. With a scene_threshold, a new palette is
+    started whenever the color histogram of a frame differs from the
+    previous one by more than the threshold.
+
+    Parameters
+    ----------
+    frames : iterable
+        Frames of the animation (e.g. iter_frames).
+    colors : int, optional
+        Number of colors of the GIF, including the transparent one (2-256).
+    scene_threshold : float, optional
+        Histogram distance (0-1) above which a frame starts a new scene.
+        A single global palette if None.
+
+    Returns
+    -------
+    plan : PalettePlan
+        Index of the first frame of each scene, palette of each scene and
+        whether the frames have transparent pixels.
+
+    """
+    starts, scenes = [], []
+    alpha = False
+    previous = None
+    for i, frame in enumerate(frames):
+        alpha = alpha or _has_alpha(frame)
+        if scene_threshold is not None:
+            hist = color_histogram(frame)
+            cut = previous is not None \
+                and np.abs(hist - previous).sum() / 2 > scene_threshold
+            previous = hist
+        else:
+            cut = False
+        if not scenes or cut:
+            starts.append(i)
+            scenes.append([])
+        scenes[-1].append(sample_pixels(frame))
+        if sum(len(s) for s in scenes[-1]) > 2 * MAX_SAMPLES:
+            scenes[-1] = _decimate(scenes[-1], MAX_SAMPLES)
+
+    palettes = [build_palette(_decimate(samples, MAX_SAMPLES)[0], colors - 1)
+                for samples in scenes]
+    return PalettePlan(starts, palettes, alpha)
+
+
+def _bbox(mask):
+    rows = np.flatnonzero(mask.any(axis=1))
+    if not len(rows):
+        return None
+    cols = np.flatnonzero(mask.any(axis=0))
+    return rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+
+
+def _palette_image(indices, palette):
+    img = Image.fromarray(indices)
+    # Makes a P image, the transparent entry follows the colors
+    img.putpalette(np.concatenate([palette, [[0, 0, 0]]]).astype(
+        np.uint8).tobytes())
+    return img
+
+
+def _duration(frame, default):
+    duration = getattr(frame, 'meta', {}).get('duration')
+    return duration if duration else default
+
+
+@profiled
+def write_gif(filename, frames, plan, loop=0, duration=None, delta=True):
+    """ Encode frames to a GIF with reusable palettes and delta frames
+
+    The frames are streamed: each one is mapped to the palette of its
+    scene, then only the box of pixels that changed since the previous
+    frame is written, unchanged pixels in it being transparent. Frames
+    identical to the previous one extend its duration instead. The first
+    palette is the global color table, the frames of the other scenes carry
+    theirs as local color tables.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the output GIF.
+    frames : iterable
+        Frames to encode (e.g. prefetch(iter_frames(...))).
+    plan : PalettePlan
+        Palettes of the frames, see plan_palettes.
+    loop : int, optional
+        Number of loops, 0 loops forever.
+    duration : float, optional
+        Duration of each frame (ms), by default the duration stored with
+        the frames (imageio meta) or DEFAULT_DURATION.
+    delta : bool, optional
+        Write only the changes between frames. Disabled for frames with
+        transparent pixels, which are then disposed to the background.
+
+    Returns
+    -------
+    count : int
+        Number of GIF frames written (identical frames are merged).
+
+    """
+    delta = delta and not plan.alpha
+    disposal = 1 if delta else 2
+    scenes = dict(zip(plan.starts, plan.palettes))
+    count = 0
+    with stage('encode_frames', filename=filename) as fields:
+        with open(filename, 'wb') as f:
+            pending = None
+            previous = None
+            for i, frame in enumerate(frames):
+                new_scene = i in scenes
+                if new_scene:
+                    palette = scenes[i]
+                    lut = palette_lut(palette)
+                    transparent = len(palette)
+                    # Only the first palette is the global color table
+                    local = i > 0
+                indices = map_to_palette(frame, lut)
+                if plan.alpha and np.asarray(frame).shape[-1] == 4:
+                    indices[np.asarray(frame)[:, :, 3] < 128] = transparent
+                frame_duration = duration or _duration(frame, DEFAULT_DURATION)
+
+                box = (0, indices.shape[0], 0, indices.shape[1])
+                crop = indices
+                if previous is not None and not new_scene:
+                    changed = indices != previous
+                    changed_box = _bbox(changed)
+                    if changed_box is None:
+                        pending[2]['duration'] += frame_duration
+                        continue
+                    if delta:
+                        box = changed_box
+                        r0, r1, c0, c1 = box
+                        crop = np.where(changed[r0:r1, c0:c1],
+                                        indices[r0:r1, c0:c1],
+                                        np.uint8(transparent))
+                previous = indices
+
+                params = {'duration': frame_duration, 'disposal': disposal,
+                          'transparency': transparent,
+                          'include_color_table': local}
+                img = _palette_image(crop, palette)
+                if pending is None:
+                    header, _ = GifImagePlugin.getheader(
+                        _palette_image(indices, palette), info={
+                            'loop': loop, 'transparency': transparent})
+                    f.write(b''.join(header))
+                else:
+                    f.write(b''.join(GifImagePlugin.getdata(*pending[0:2],
+                                                            **pending[2])))
+                # Written once the next frame is known, as identical frames
+                # extend its duration
+                pending = (img, (int(box[2]), int(box[0])), params)
+                count += 1
+
+            if pending is not None:
+                f.write(b''.join(GifImagePlugin.getdata(*pending[0:2],
+                                                        **pending[2])))
+            f.write(b';')
+        fields['frames'] = count
+        fields['bytes_written'] = os.path.getsize(filename)
+    return count
+
+
+def compress_gif(in_filename, out_filename, colors=256, scene_threshold=None,
+                 loop=0):
+    """ Re-encode an animation to a GIF in two passes over its frames
+
+    The first pass samples the frames to build the palettes, the second
+    maps the frames to them and encodes the changes between frames. Only
+    a few frames are held in memory.
+
+    Parameters
+    ----------
+    in_filename : str
+        Path of the input GIF or video.
+    out_filename : str
+        Path of the output GIF.
+    colors : int, optional
+        Number of colors of the GIF, including the transparent one (2-256).
+    scene_threshold : float, optional
+        Start a new palette at scene cuts (see plan_palettes).
+    loop : int, optional
+        Number of loops, 0 loops forever.
+
+    Returns
+    -------
+    count : int
+        Number of GIF frames written.
+
+    """
+    plan = plan_palettes(prefetch(iter_frames(in_filename)), colors,
+                         scene_threshold)
+    return write_gif(out_filename, prefetch(iter_frames(in_filename)), plan,
+                     loop)
@@ -0,0 +1,455 @@
+# -*- coding: utf-8 -*-
+import itertools
+import os
+import sqlite3
+
+from image_utils.utils.frames import parallel_map
+from image_utils.utils.image import resize
+from image_utils.utils.io import read_image
+from image_utils.utils.lazy import lazy_import
+from image_utils.utils.profiling import profiled
+
+np = lazy_import('numpy')
+fft = lazy_import('scipy.fft')
+
+# Side of the hashes, HASH_SIZE ** 2 bits (64)
+HASH_SIZE = 8
+# pHash keeps the lowest frequencies of a DCT of this many times the size
+PHASH_FACTOR = 4
+HASH_METHODS = ['ahash', 'dhash', 'phash']
+# Hamming distance under which two images are considered duplicates
+DEFAULT_THRESHOLD = 6
+# Bits of the chunks of the hashes indexed by HammingIndex
+CHUNK_BITS = 16
+
+
+def _thumbnail_shape(method):
+    """ Height and width of the thumbnails hashed by a method """
+    if method == 'ahash':
+        return HASH_SIZE, HASH_SIZE
+    if method == 'dhash':
+        return HASH_SIZE, HASH_SIZE + 1
+    if method == 'phash':
+        return HASH_SIZE * PHASH_FACTOR, HASH_SIZE * PHASH_FACTOR
+    raise ValueError('Unknown hash method {}, choose among {}.'.format(
+        method, ', '.join(HASH_METHODS)))
+
+
+def hash_thumbnail(img, method='phash'):
+    """ Small grayscale version of an image, as hashed by a method
+
+    Parameters
+    ----------
+    img : ndarray
+        Input image.
+    method : {'ahash', 'dhash', 'phash'}, optional
+        Hash the thumbnail is made for.
+
+    Returns
+    -------
+    thumbnail : ndarray
+        2D float32 array.
+
+    """
+    height, width = _thumbnail_shape(method)
+    if img.ndim == 3 and img.shape[2] in [2, 4]:
+        img = img[:, :, 0:img.shape[2] - 1]
+    if img.ndim == 3 and img.shape[2] == 1:
+        img = img[:, :, 0]
+    thumbnail = resize(np.ascontiguousarray(img), dimensions=(width, height))
+    return np.asarray(thumbnail.convert('L'), dtype=np.float32)
+
+
+def _pack(bits):
+    """ Hashes as Python ints, from a (N, HASH_SIZE ** 2) boolean array """
+    packed = np.packbits(bits.reshape(len(bits), -1), axis=1)
+    return [int.from_bytes(row.tobytes(), 'big') for row in packed]
+
+
+@profiled
+def hash_thumbnails(thumbnails, method='phash'):
+    """ Perceptual hashes of a batch of thumbnails, vectorized
+
+    aHash compares each pixel to the mean, dHash each pixel to its right
+    neighbour, and pHash the lowest frequencies of a DCT to their median.
+
+    Parameters
+    ----------
+    thumbnails : ndarray
+        Stack of thumbnails (N, H, W), see hash_thumbnail.
+    method : {'ahash', 'dhash', 'phash'}, optional
+        Hash to compute.
+
+    Returns
+    -------
+    hashes : list
+        Hash of each thumbnail, an int of HASH_SIZE ** 2 bits.
+
+    """
+    thumbnails = np.asarray(thumbnails, dtype=np.float32)
+    if len(thumbnails) == 0:
+        return []
+    if thumbnails.shape[1:] != _thumbnail_shape(method):
+        raise ValueError('Thumbnails of {} must be {}.'.format(
+            method, _thumbnail_shape(method)))
+
+    if method == 'ahash':
+        mean = thumbnails.mean(axis=(1, 2), keepdims=True)
+        return _pack(thumbnails > mean)
+    if method == 'dhash':
+        return _pack(thumbnails[:, :, 1:] > thumbnails[:, :, :-1])
+
+    dct = fft.dctn(thumbnails, axes=(1, 2), norm='ortho')
+    low = dct[:, 0:HASH_SIZE, 0:HASH_SIZE].reshape(len(thumbnails), -1)
+    # The DC term is left out of the median, it only carries the brightness
+    median = np.median(low[:, 1:], axis=1, keepdims=True)
+    return _pack(low > median)
+
+
+def hash_images(imgs, method='phash'):
+    """ Perceptual hashes of images held in memory
+
+    Parameters
+    ----------
+    imgs : list
+        Images to hash.
+    method : {'ahash', 'dhash', 'phash'}, optional
+        Hash to compute.
+
+    Returns
+    -------
+    hashes : list
+        Hash of each image.
+
+    """
+    return hash_thumbnails([hash_thumbnail(img, method) for img in imgs],
+                           method)
+
+
+def hash_files(filenames, method='phash', jobs=1, ignore_errors=False):
+    """ Perceptual hashes of image files
+
+    JPEG images are decoded at the smallest scale still larger than the
+    thumbnail (see read_image), which makes hashing large photos cheap.
+
+    Parameters
+    ----------
+    filenames : list
+        Paths of the images.
+    method : {'ahash', 'dhash', 'phash'}, optional
+        Hash to compute.
+    jobs : int, optional
+        Number of threads decoding the images.
+    ignore_errors : bool, optional
+        Give a None hash to the images that cannot be read, instead of
+        raising the error.
+
+    Returns
+    -------
+    hashes : list
+        Hash of each image.
+
+    """
+    shape = _thumbnail_shape(method)
+
+    def _thumbnail(filename):
+        try:
+            return hash_thumbnail(read_image(filename, shape), method)
+        except Exception:
+            if not ignore_errors:
+                raise
+            return None
+
+    thumbnails = list(parallel_map(_thumbnail, filenames, jobs))
+    valid = [i for i, thumbnail in enumerate(thumbnails)
+             if thumbnail is not None]
+    hashes = [None] * len(thumbnails)
+    for i, value in zip(valid, hash_thumbnails([thumbnails[i] for i in valid],
+                                               method)):
+        hashes[i] = value
+    return hashes
+
+
+def hamming_distance(a, b):
+    """ Number of differing bits between two hashes """
+    return bin(a ^ b).count('1')
+
+
+class HammingIndex(object):
+    """ Multi-index hashing of hashes, for Hamming distance lookups
+
+    Hashes are split into chunks of about CHUNK_BITS bits, each indexed in
+    a hash table. Two hashes within radius of each other have at least one
+    chunk within radius // chunks (pigeonhole principle): a search probes
+    the buckets of those few chunk values and only compares the query to
+    the hashes found there, instead of all of them.
+
+    Parameters
+    ----------
+    radius : int
+        Largest distance that can be searched.
+    bits : int, optional
+        Number of bits of the hashes.
+    items : iterable, optional
+        (hash, item) pairs to add.
+
+    """
+
+    def __init__(self, radius, bits=HASH_SIZE ** 2, items=()):
+        self.radius = radius
+        count = max(1, min(radius + 1, bits // CHUNK_BITS))
+        edges = [bits * i // count for i in range(count + 1)]
+        self._chunks = [(start, stop - start)
+                        for start, stop in zip(edges[:-1], edges[1:])]
+        # Bit flips of a chunk that are probed by a search
+        self._flips = [[sum(1 << b for b in combination)
+                        for r in range(radius // count + 1)
+                        for combination in itertools.combinations(
+                            range(width), r)]
+                       for _, width in self._chunks]
+        self._tables = [{} for _ in self._chunks]
+        self._hashes = []
+        self._items = []
+        for value, item in items:
+            self.add(value, item)
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def add(self, value, item=None):
+        """ Add a hash, with the item it identifies """
+        for (shift, width), table in zip(self._chunks, self._tables):
+            key = (value >> shift) & ((1 << width) - 1)
+            table.setdefault(key, []).append(len(self._hashes))
+        self._hashes.append(value)
+        self._items.append(item)
+
+    def search(self, value, radius=None):
+        """ Items whose hash is within radius of value
+
+        Parameters
+        ----------
+        value : int
+            Hash to look up.
+        radius : int, optional
+            Maximum distance, at most the radius of the index. [radius]
+
+        Returns
+        -------
+        matches : list
+            (distance, item) pairs, closest first then in insertion order.
+
+        """
+        radius = self.radius if radius is None else radius
+        if radius > self.radius:
+            raise ValueError('The index was built for a radius of {}.'.format(
+                self.radius))
+        candidates = set()
+        for (shift, width), flips, table in zip(self._chunks, self._flips,
+                                                self._tables):
+            key = (value >> shift) & ((1 << width) - 1)
+            for flip in flips:
+                bucket = table.get(key ^ flip)
+                if bucket:
+                    candidates.update(bucket)
+
+        # Sorted by index to break ties between equal distances
+        distances = sorted((hamming_distance(value, self._hashes[i]), i)
+                           for i in candidates)
+        return [(distance, self._items[i]) for distance, i in distances
+                if distance <= radius]
+
+
+def find_duplicates(hashes, threshold=DEFAULT_THRESHOLD):
+    """ Original of each hash, in order, within a Hamming distance
+
+    The first occurrence of a group of near-identical hashes is kept, the
+    later ones point to the closest kept hash.
+
+    Parameters
+    ----------
+    hashes : list
+        Hashes, e.g. from hash_files.
+    threshold : int, optional
+        Maximum Hamming distance between duplicates.
+
+    Returns
+    -------
+    originals : list
+        For each hash, None if it is kept, else the index of its original.
+        Missing (None) hashes are always kept.
+
+    """
+    kept = HammingIndex(threshold)
+    originals = []
+    for i, value in enumerate(hashes):
+        if value is None:
+            originals.append(None)
+            continue
+        matches = kept.search(value)
+        if matches:
+            originals.append(matches[0][1])
+        else:
+            originals.append(None)
+            kept.add(value, i)
+    return originals
+
+
+def _to_signed(value):
+    # SQLite integers are signed 64 bits
+    return value - 2 ** 64 if value >= 2 ** 63 else value
+
+
+class HashIndex(object):
+    """ Persistent index of perceptual hashes, stored in SQLite
+
+    Entries are keyed by the absolute path and the method, and invalidated
+    when the modification time or the size of the file changes (as in
+    metadata.MetadataIndex). The hashes of the whole index can be searched
+    by Hamming distance (see HammingIndex).
+
+    Parameters
+    ----------
+    filename : str
+        Path of the SQLite database (created if needed).
+
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._db = sqlite3.connect(filename, timeout=30)
+        self._db.execute('CREATE TABLE IF NOT EXISTS hashes ('
+                         'path TEXT, method TEXT, mtime REAL, size INTEGER, '
+                         'hash INTEGER, PRIMARY KEY (path, method))')
+        self._db.commit()
+        self._lookups = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, filenames, method='phash', jobs=1,
+                 ignore_errors=False):
+        """ Hashes of many images, from the index or computed
+
+        Parameters
+        ----------
+        filenames : list
+            Paths of the images.
+        method : {'ahash', 'dhash', 'phash'}, optional
+            Hash to compute.
+        jobs : int, optional
+            Number of threads decoding the images missing from the index.
+        ignore_errors : bool, optional
+            Give a None hash to the images that cannot be read, instead of
+            raising the error. They are not indexed.
+
+        Returns
+        -------
+        hashes : list
+            Hash of each image.
+
+        """
+        hashes = [None] * len(filenames)
+        missing = []
+        for i, filename in enumerate(filenames):
+            path = os.path.abspath(filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                if not ignore_errors:
+                    raise
+                continue
+            row = self._db.execute(
+                'SELECT hash FROM hashes WHERE path = ? AND method = ? '
+                'AND mtime = ? AND size = ?',
+                (path, method, stat.st_mtime, stat.st_size)).fetchone()
+            if row is not None:
+                self.hits += 1
+                hashes[i] = row[0] % 2 ** 64
+            else:
+                missing.append((i, path, stat))
+
+        self.misses += len(missing)
+        computed = hash_files([path for _, path, _ in missing], method, jobs,
+                              ignore_errors)
+        with self._db:
+            for (i, path, stat), value in zip(missing, computed):
+                hashes[i] = value
+                if value is None:
+                    continue
+                self._db.execute(
+                    'INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?)',
+                    (path, method, stat.st_mtime, stat.st_size,
+                     _to_signed(value)))
+        if missing:
+            self._lookups.pop(method, None)
+        return hashes
+
+    def search(self, value, radius, method='phash'):
+        """ Indexed images whose hash is within radius of value
+
+        Returns
+        -------
+        matches : list
+            (distance, path) pairs, closest first.
+
+        """
+        index = self._lookups.get(method)
+        if index is None or index.radius < radius:
+            rows = self._db.execute(
+                'SELECT hash, path FROM hashes WHERE method = ?', (method,))
+            index = HammingIndex(radius, items=((h % 2 ** 64, path)
+                                                for h, path in rows))
+            self._lookups[method] = index
+        return index.search(value, radius)
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def dedupe_files(filenames, threshold=DEFAULT_THRESHOLD, method='phash',
+                 index=None, jobs=1):
+    """ Drop the near-duplicates of a list of images
+
+    Parameters
+    ----------
+    filenames : list
+        Paths of the images.
+    threshold : int, optional
+        Maximum Hamming distance between duplicates.
+    method : {'ahash', 'dhash', 'phash'}, optional
+        Hash used to compare the images.
+    index : HashIndex, optional
+        Persistent index of the hashes, reused across runs.
+    jobs : int, optional
+        Number of threads decoding the images.
+
+    Images that cannot be read are kept, the error is left to whatever
+    processes them.
+
+    Returns
+    -------
+    kept : list
+        Filenames without duplicates, in order.
+    duplicates : dict
+        Original kept for each dropped filename.
+
+    """
+    if index is not None:
+        hashes = index.get_many(filenames, method, jobs, ignore_errors=True)
+    else:
+        hashes = hash_files(filenames, method, jobs, ignore_errors=True)
+
+    kept, duplicates = [], {}
+    for filename, original in zip(filenames,
+                                  find_duplicates(hashes, threshold)):
+        if original is None:
+            kept.append(filename)
+        else:
+            duplicates[filename] = filenames[original]
+    return kept, duplicates
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+import inspect
+import json
+import os
+
+from image_utils.utils.canvas import PaddedImage, write_padded
+from image_utils.utils.image import (auto_crop, remove_background, resize,
+                                     resize_dimensions)
+from image_utils.utils.io import read_image, write_image
+from image_utils.utils.lazy import lazy_import
+
+np = lazy_import('numpy')
+
+
+def _stage_remove_background(img, threshold=10, position=(0, 0),
+                             mode='fill'):
+    new_img, _ = remove_background(img, threshold, tuple(position), mode)
+    return new_img
+
+
+def _stage_auto_crop(img, borders=0):
+    return auto_crop(img, borders)
+
+
+def _stage_resize(img, ratio_frac=None, ratio_val=None, dimensions=None,
+                  scale=None):
+    # np.asarray copies the PIL image once, into a read-only array (np.array
+    # would copy it a second time to make it writable)
+    return np.asarray(resize(img, ratio_frac, ratio_val, dimensions, scale))
+
+
+def _stage_pad(img, dimensions=None, add_borders=None):
+    if add_borders is not None:
+        dimensions = (add_borders[0] + img.shape[0],
+                      add_borders[1] + img.shape[1])
+    elif dimensions is None:
+        raise ValueError('pad requires dimensions or add_borders.')
+    # Materialized by the next stage, or streamed by process_file
+    return PaddedImage(img, dimensions)
+
+
+STAGES = {'remove_background': _stage_remove_background,
+          'auto_crop': _stage_auto_crop,
+          'resize': _stage_resize,
+          'pad': _stage_pad}
+
+
+def load_pipeline(filename):
+    """ Load a pipeline specification from a JSON or YAML file
+
+    The specification is a list of stages (or a mapping with a 'stages'
+    key), each stage being a mapping with an 'op' key and its parameters:
+
+        stages:
+          - {op: remove_background, threshold: 10}
+          - {op: auto_crop, borders: 20}
+          - {op: resize, scale: 0.5}
+          - {op: pad, dimensions: [512, 512]}
+          - {op: compress, quality: 80}
+
+    Parameters
+    ----------
+    filename : str
+        Path of the specification (.json, .yaml or .yml).
+
+    Returns
+    -------
+    stages : list
+        List of stages, validated.
+
+    """
+    _, ext = os.path.splitext(filename)
+    with open(filename) as f:
+        if ext.lower() in ['.yaml', '.yml']:
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError('PyYAML is required to read YAML pipelines.')
+            spec = yaml.safe_load(f)
+        else:
+            spec = json.load(f)
+
+    if isinstance(spec, dict):
+        spec = spec.get('stages', [])
+    return validate_pipeline(spec)
+
+
+def validate_pipeline(stages):
+    """ Check that every stage of a pipeline and its parameters are known
+
+    Parameters
+    ----------
+    stages : list
+        List of mappings with an 'op' key and the stage parameters.
+
+    Returns
+    -------
+    stages : list
+        The same stages.
+
+    """
+    if not isinstance(stages, list):
+        raise ValueError('A pipeline must be a list of stages.')
+    for i, stage in enumerate(stages):
+        if not isinstance(stage, dict) or 'op' not in stage:
+            raise ValueError('Stage {} must be a mapping with an op '
+                             'key.'.format(i))
+        if stage['op'] == 'compress':
+            continue
+        if stage['op'] not in STAGES:
+            raise ValueError('Unknown stage {}, choose among {}.'.format(
+                stage['op'], ', '.join(list(STAGES) + ['compress'])))
+        # The first parameter of a stage function is the image
+        names = list(inspect.signature(STAGES[stage['op']]).parameters)[1:]
+        unknown = sorted(set(stage) - set(names) - {'op'})
+        if unknown:
+            raise ValueError('Unknown parameters {} of {}, choose among '
+                             '{}.'.format(', '.join(unknown), stage['op'],
+                                          ', '.join(names)))
+    return stages
+
+
+def pipeline_pixels(shape, stages):
+    """ Largest number of pixels of an image along a pipeline
+
+    Computed from the stage parameters without running the stages, e.g.
+    to refuse a request before it allocates more memory than available.
+    Cropping stages are assumed to keep the whole image.
+
+    Parameters
+    ----------
+    shape : tuple
+        Shape of the input image.
+    stages : list
+        List of mappings with an 'op' key and the stage parameters.
+
+    Returns
+    -------
+    pixels : int
+        Largest number of pixels of the input, output or any intermediate
+        image.
+
+    """
+    height, width = int(shape[0]), int(shape[1])
+    largest = height * width
+    for stage in validate_pipeline(stages):
+        params = {k: v for k, v in stage.items() if k != 'op'}
+        try:
+            if stage['op'] == 'resize':
+                width, height = resize_dimensions((height, width), **params)
+            elif stage['op'] == 'pad':
+                if params.get('add_borders') is not None:
+                    height += int(params['add_borders'][0])
+                    width += int(params['add_borders'][1])
+                elif params.get('dimensions') is not None:
+                    height = max(height, int(params['dimensions'][0]))
+                    width = max(width, int(params['dimensions'][1]))
+        except (TypeError, IndexError) as e:
+            raise ValueError('Invalid parameters for {}: {}'.format(
+                stage['op'], e))
+        largest = max(largest, height * width)
+    return largest
+
+
+def run_pipeline(img, stages):
+    """ Apply the stages of a pipeline to an image held in memory
+
+    The image is passed from stage to stage without being re-encoded.
+    The 'compress' stage does not touch the pixels, its parameters are
+    returned to be used by the final encode. Stages must not modify their
+    input in place, it can be read-only (e.g. after resize).
+
+    Parameters
+    ----------
+    img : ndarray
+        Input image.
+    stages : list
+        List of mappings with an 'op' key and the stage parameters.
+
+    Returns
+    -------
+    img : ndarray or PaddedImage
+        Processed image, a PaddedImage when the last stage is pad.
+    write_kwargs : dict
+        Options for the writer collected from the 'compress' stages.
+
+    """
+    write_kwargs = {}
+    for stage in validate_pipeline(stages):
+        params = {k: v for k, v in stage.items() if k != 'op'}
+        if stage['op'] == 'compress':
+            write_kwargs.update(params)
+        else:
+            if isinstance(img, PaddedImage):
+                img = img.materialize()
+            img = STAGES[stage['op']](img, **params)
+    return img, write_kwargs
+
+
+def process_file(in_filename, out_filename, stages):
+    """ Decode a file once, run a pipeline on it and encode it once
+
+    Parameters
+    ----------
+    in_filename : str
+        Path of the input image.
+    out_filename : str
+        Path of the output image.
+    stages : list
+        List of mappings with an 'op' key and the stage parameters.
+
+    """
+    img, write_kwargs = run_pipeline(read_image(in_filename), stages)
+    if isinstance(img, PaddedImage):
+        write_padded(out_filename, img, **write_kwargs)
+    else:
+        write_image(out_filename, img, **write_kwargs)
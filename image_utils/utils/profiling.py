@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+import atexit
+import cProfile
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_hooks = []
+# Traced peak of each open stage, as the global peak is reset between them
+_open_peaks = []
+_peaks_lock = threading.Lock()
+
+
+def add_hook(hook):
+    """ Register a function called with the record of every stage
+
+    Parameters
+    ----------
+    hook : callable
+        Called as hook(record) where record is a dict with the name of the
+        stage, its wall time, the peak RSS of the process, the peak memory
+        traced by tracemalloc (if it is tracing) and stage specific fields
+        such as the filename and the bytes read or written.
+
+    """
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    """ Unregister a hook added with add_hook """
+    _hooks.remove(hook)
+
+
+def _peak_rss():
+    """ Peak resident set size of the process in bytes """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if os.uname().sysname == 'Darwin' else peak * 1024
+
+
+def _fold_peak():
+    """ Fold the traced peak since the last reset into the open stages """
+    peak = tracemalloc.get_traced_memory()[1]
+    for entry in _open_peaks:
+        entry[0] = max(entry[0], peak)
+    tracemalloc.reset_peak()
+
+
+@contextmanager
+def stage(name, **fields):
+    """ Time a stage and report it to the hooks
+
+    Does nothing (beyond a list check) when no hook is registered. The
+    yielded dict can be updated with fields only known at the end (e.g.
+    bytes_written).
+
+    Parameters
+    ----------
+    name : str
+        Name of the stage (e.g. 'decode', 'resize', 'encode').
+    **fields
+        Extra fields of the record.
+
+    """
+    if not _hooks:
+        yield fields
+        return
+
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        # The enclosing stages keep the peak reached so far, this one
+        # starts from the memory currently traced
+        with _peaks_lock:
+            _fold_peak()
+            peak = [tracemalloc.get_traced_memory()[0]]
+            _open_peaks.append(peak)
+    start = time.perf_counter()
+    try:
+        yield fields
+    finally:
+        record = {'stage': name,
+                  'pid': os.getpid(),
+                  'time': time.time(),
+                  'wall_time': time.perf_counter() - start,
+                  'peak_rss': _peak_rss()}
+        if tracing:
+            with _peaks_lock:
+                _fold_peak()
+                _open_peaks.remove(peak)
+            record['peak_traced'] = peak[0]
+        record.update(fields)
+        for hook in list(_hooks):
+            hook(record)
+
+
+def profiled(func):
+    """ Decorator reporting each call of func as a stage """
+    @functools.wraps(func)
+    def _wrapper(*args, **kwargs):
+        if not _hooks:
+            return func(*args, **kwargs)
+        with stage(func.__name__):
+            return func(*args, **kwargs)
+    return _wrapper
+
+
+class JsonLinesWriter(object):
+    """ Hook appending every record as a line of JSON to a file
+
+    Parameters
+    ----------
+    filename : str
+        Path of the output file, opened in append mode.
+
+    """
+
+    def __init__(self, filename):
+        self._file = open(filename, 'a')
+
+    def __call__(self, record):
+        self._file.write(json.dumps(record, default=str) + '\n')
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def add_profiling_args(p):
+    """ Add the profiling options to an argparse parser
+
+    Parameters
+    ----------
+    p : argparse.ArgumentParser
+        Parser of the script.
+
+    """
+    g = p.add_argument_group('Profiling')
+    g.add_argument('--timings', default=None,
+                   help='Append per-stage timings, bytes read/written and '
+                        'peak RSS\nto this file as JSON lines.')
+    g.add_argument('--trace_memory', action='store_true',
+                   help='Also record the peak memory traced by tracemalloc '
+                        'in each stage\n(with --timings). Slows the run '
+                        'down, the timings are then skewed.')
+    g.add_argument('--profile', default=None,
+                   help='Dump cProfile statistics to this file.')
+
+
+def start_profiling(args):
+    """ Enable the profiling requested by the options of a script
+
+    The timings file and the cProfile statistics are written when the
+    interpreter exits. Only the main process is profiled by cProfile.
+    tracemalloc is only started with trace_memory, as it slows everything
+    down.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        Parsed arguments, with the options of add_profiling_args.
+
+    """
+    if getattr(args, 'timings', None):
+        writer = JsonLinesWriter(args.timings)
+        add_hook(writer)
+        if getattr(args, 'trace_memory', False):
+            tracemalloc.start()
+        atexit.register(writer.close)
+
+    if getattr(args, 'profile', None):
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+        def _dump():
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+        atexit.register(_dump)
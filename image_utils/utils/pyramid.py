@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+import math
+import os
+
+from image_utils.utils.frames import parallel_map, write_frame
+from image_utils.utils.image import resize
+from image_utils.utils.lazy import lazy_import
+from image_utils.utils.profiling import profiled
+
+np = lazy_import('numpy')
+Image = lazy_import('PIL.Image')
+
+# A level is derived from a previous one only if it is at least this much
+# smaller, so that each pixel goes through a single significant resampling.
+MIN_DERIVE_FACTOR = 2
+
+DZI_TEMPLATE = '''<?xml version="1.0" encoding="UTF-8"?>
+<Image xmlns="http://schemas.microsoft.com/deepzoom/2008"
+  Format="{fmt}" Overlap="{overlap}" TileSize="{tile_size}">
+  <Size Width="{width}" Height="{height}"/>
+</Image>
+'''
+
+
+@profiled
+def resize_pyramid(img, dimensions):
+    """ Resize an image to several dimensions from a single decode
+
+    The levels are produced from the largest to the smallest. Each level is
+    resampled from the smallest level already computed that is at least
+    twice its size, or from the original image.
+
+    Parameters
+    ----------
+    img : ndarray
+        Input image.
+    dimensions : list
+        Width and height of each level (as given to resize).
+
+    Returns
+    -------
+    levels : list
+        Resized images, in the order of dimensions.
+
+    """
+    order = sorted(range(len(dimensions)),
+                   key=lambda i: dimensions[i][0] * dimensions[i][1],
+                   reverse=True)
+    levels = [None] * len(dimensions)
+    done = []
+    for i in order:
+        width, height = (int(d) for d in dimensions[i])
+        source = img
+        for level in done:
+            if level.shape[1] >= MIN_DERIVE_FACTOR * width \
+                    and level.shape[0] >= MIN_DERIVE_FACTOR * height:
+                source = level
+        levels[i] = np.asarray(resize(source, dimensions=(width, height)))
+        done.append(levels[i])
+    return levels
+
+
+def deep_zoom_levels(shape):
+    """ Dimensions of the levels of a Deep Zoom pyramid
+
+    Level 0 is a single pixel and the last level is the full image, each
+    level being half (rounded up) the next one.
+
+    Parameters
+    ----------
+    shape : tuple
+        Shape of the image.
+
+    Returns
+    -------
+    dimensions : list
+        Width and height of each level, from level 0.
+
+    """
+    height, width = shape[0:2]
+    max_level = int(math.ceil(math.log2(max(width, height, 1))))
+    return [(int(math.ceil(width / 2 ** (max_level - level))),
+             int(math.ceil(height / 2 ** (max_level - level))))
+            for level in range(max_level + 1)]
+
+
+def iter_deep_zoom_tiles(width, height, tile_size=254, overlap=1):
+    """ Windows of the tiles of a Deep Zoom level
+
+    Parameters
+    ----------
+    width, height : int
+        Dimensions of the level.
+    tile_size : int, optional
+        Side of the tiles, without the overlap.
+    overlap : int, optional
+        Pixels shared with the neighbouring tiles.
+
+    Returns
+    -------
+    tiles : generator
+        (col, row, (row_start, row_stop, col_start, col_stop)) of each tile.
+
+    """
+    for row in range(int(math.ceil(height / tile_size))):
+        for col in range(int(math.ceil(width / tile_size))):
+            yield col, row, (max(0, row * tile_size - overlap),
+                             min(height, (row + 1) * tile_size + overlap),
+                             max(0, col * tile_size - overlap),
+                             min(width, (col + 1) * tile_size + overlap))
+
+
+def _halve(img, dimensions):
+    """ Next Deep Zoom level, a 2x2 box reduction of the previous one """
+    reduced = Image.fromarray(img).reduce(2)
+    if reduced.size != tuple(dimensions):
+        reduced = reduced.resize(dimensions)
+    return np.asarray(reduced)
+
+
+def write_pyramid(filenames, levels, level=None, jobs=1):
+    """ Write the levels of a pyramid in parallel
+
+    Parameters
+    ----------
+    filenames : list
+        Path of each level, the format is given by the extension.
+    levels : list
+        Images to write.
+    level : int, optional
+        Compression level or quality (see write_frame).
+    jobs : int, optional
+        Number of threads encoding the images.
+
+    """
+    def _write(i):
+        write_frame(filenames[i], levels[i], level)
+
+    for _ in parallel_map(_write, range(len(levels)), jobs):
+        pass
+
+
+@profiled
+def write_deep_zoom(filename, img, tile_size=254, overlap=1, fmt='jpg',
+                    level=None, jobs=1):
+    """ Write an image as a Deep Zoom (DZI) tiled pyramid
+
+    The descriptor is written to filename (e.g. image.dzi) and the tiles to
+    image_files/<level>/<col>_<row>.<fmt>. Each level is reduced from the
+    previous one and its tiles are encoded by a pool of threads.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the .dzi descriptor.
+    img : ndarray
+        Input image.
+    tile_size : int, optional
+        Side of the tiles, without the overlap.
+    overlap : int, optional
+        Pixels shared with the neighbouring tiles.
+    fmt : {'jpg', 'png', 'webp'}, optional
+        Format of the tiles.
+    level : int, optional
+        Compression level or quality of the tiles (see write_frame).
+    jobs : int, optional
+        Number of threads encoding the tiles.
+
+    Returns
+    -------
+    count : int
+        Number of tiles written.
+
+    """
+    root, _ = os.path.splitext(filename)
+    tiles_dir = root + '_files'
+    dimensions = deep_zoom_levels(img.shape)
+
+    count = 0
+    current = img
+    for index in range(len(dimensions) - 1, -1, -1):
+        if index < len(dimensions) - 1:
+            current = _halve(current, dimensions[index])
+        level_dir = os.path.join(tiles_dir, str(index))
+        os.makedirs(level_dir, exist_ok=True)
+
+        def _write(tile, current=current, level_dir=level_dir):
+            col, row, (r0, r1, c0, c1) = tile
+            write_frame(os.path.join(level_dir, '{}_{}.{}'.format(
+                col, row, fmt)), current[r0:r1, c0:c1], level)
+
+        width, height = dimensions[index]
+        for _ in parallel_map(_write, iter_deep_zoom_tiles(
+                width, height, tile_size, overlap), jobs):
+            count += 1
+
+    with open(filename, 'w') as f:
+        f.write(DZI_TEMPLATE.format(fmt=fmt, overlap=overlap,
+                                    tile_size=tile_size,
+                                    width=img.shape[1], height=img.shape[0]))
+    return count
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+from collections import namedtuple
+
+from image_utils.utils.frames import parallel_map
+from image_utils.utils.io import decode_image, encode_image
+from image_utils.utils.lazy import lazy_import
+from image_utils.utils.profiling import profiled, stage
+
+np = lazy_import('numpy')
+ndimage = lazy_import('scipy.ndimage')
+
+# Formats whose encoder has a quality setting
+SEARCH_EXTENSIONS = ['.jpg', '.jpeg', '.webp']
+
+# Side of the window of SSIM and number of rows compared at once
+SSIM_WINDOW = 7
+SSIM_STRIP = 256
+
+Candidate = namedtuple('Candidate', ['quality', 'data', 'size', 'score'])
+
+
+def _luma(img):
+    img = np.asarray(img, dtype=np.float32)
+    if img.ndim == 3:
+        return img[:, :, 0:3] @ np.array([0.299, 0.587, 0.114],
+                                         dtype=np.float32)
+    return img
+
+
+def _ssim_map(x, y):
+    """ SSIM of each pixel of two luminance images, uniform window """
+    mu_x = ndimage.uniform_filter(x, SSIM_WINDOW)
+    mu_y = ndimage.uniform_filter(y, SSIM_WINDOW)
+    # Sample covariances, as in scikit-image
+    norm = SSIM_WINDOW ** 2 / (SSIM_WINDOW ** 2 - 1)
+    var_x = norm * (ndimage.uniform_filter(x * x, SSIM_WINDOW) - mu_x * mu_x)
+    var_y = norm * (ndimage.uniform_filter(y * y, SSIM_WINDOW) - mu_y * mu_y)
+    cov = norm * (ndimage.uniform_filter(x * y, SSIM_WINDOW) - mu_x * mu_y)
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    return ((2 * mu_x * mu_y + c1) * (2 * cov + c2)) \
+        / ((mu_x * mu_x + mu_y * mu_y + c1) * (var_x + var_y + c2))
+
+
+def ssim(ref, img):
+    """ Structural similarity of the luminance of two images
+
+    The image is processed by strips of SSIM_STRIP rows (plus the margin
+    of the window), which bounds the memory of the float copies.
+
+    Parameters
+    ----------
+    ref : ndarray
+        Reference image.
+    img : ndarray
+        Image to compare, of the same shape.
+
+    Returns
+    -------
+    ssim : float
+        Mean SSIM (7x7 uniform window), 1 for identical images.
+
+    """
+    height = ref.shape[0]
+    margin = SSIM_WINDOW // 2
+    total = 0.0
+    for start in range(0, height, SSIM_STRIP):
+        stop = min(height, start + SSIM_STRIP)
+        top, bottom = max(0, start - margin), min(height, stop + margin)
+        ssim_map = _ssim_map(_luma(ref[top:bottom]), _luma(img[top:bottom]))
+        # Only the rows of the strip, the margins belong to its neighbours
+        total += ssim_map[start - top:stop - top].sum(dtype=np.float64)
+    return float(total / (ref.shape[0] * ref.shape[1]))
+
+
+def psnr(ref, img):
+    """ Peak signal-to-noise ratio of an image against a reference (dB)
+
+    Parameters
+    ----------
+    ref : ndarray
+        Reference image.
+    img : ndarray
+        Image to compare, of the same shape.
+
+    Returns
+    -------
+    psnr : float
+        PSNR in dB, inf for identical images.
+
+    """
+    squared = 0.0
+    for start in range(0, ref.shape[0], SSIM_STRIP):
+        diff = ref[start:start + SSIM_STRIP].astype(np.float32) \
+            - img[start:start + SSIM_STRIP]
+        squared += np.dot(diff.ravel(), diff.ravel())
+    mse = squared / ref.size
+    if mse == 0:
+        return float('inf')
+    return float(10 * np.log10(255 ** 2 / mse))
+
+
+def _spread(low, high, count):
+    """ Up to count qualities evenly spaced inside [low, high] """
+    if high - low + 1 <= count:
+        return list(range(low, high + 1))
+    points = np.linspace(low, high, count + 2)[1:-1]
+    return sorted(set(int(round(p)) for p in points))
+
+
+@profiled
+def search_quality(img, ext, max_bytes=None, min_ssim=None, min_psnr=None,
+                   jobs=1, min_quality=1, max_quality=100):
+    """ Search the quality meeting a size budget or a fidelity target
+
+    Candidates are encoded in memory. Each round encodes jobs qualities in
+    parallel, evenly spaced in the remaining range, so that jobs=1 is a
+    binary search. With max_bytes, the highest quality under the budget is
+    returned, with min_ssim or min_psnr the lowest (smallest) one reaching
+    the target.
+
+    Parameters
+    ----------
+    img : ndarray
+        Decoded image.
+    ext : str
+        Extension of the output format ('.jpg' or '.webp').
+    max_bytes : int, optional
+        Maximum size of the encoded image.
+    min_ssim : float, optional
+        Minimum SSIM of the encoded image against img.
+    min_psnr : float, optional
+        Minimum PSNR (dB) of the encoded image against img.
+    jobs : int, optional
+        Number of threads encoding candidates.
+    min_quality, max_quality : int, optional
+        Range of the qualities to search.
+
+    Returns
+    -------
+    candidate : Candidate
+        Quality, encoded data, size and score (SSIM or PSNR, None with
+        max_bytes) of the chosen encode.
+
+    """
+    targets = [t for t in [max_bytes, min_ssim, min_psnr] if t is not None]
+    if len(targets) != 1:
+        raise ValueError('Exactly one of max_bytes, min_ssim and min_psnr '
+                         'is required.')
+    if ext.lower() not in SEARCH_EXTENSIONS:
+        raise ValueError('Quality search requires a {} output.'.format(
+            ', '.join(SEARCH_EXTENSIONS)))
+
+    img = np.asarray(img)
+
+    def _evaluate(quality):
+        data = encode_image(img, ext, quality=quality)
+        score = None
+        if min_ssim is not None:
+            score = ssim(img, decode_image(data))
+        elif min_psnr is not None:
+            decoded = decode_image(data)
+            score = psnr(img[..., 0:decoded.shape[-1]]
+                         if decoded.ndim == 3 else img, decoded)
+        return Candidate(quality, data, len(data), score)
+
+    def _fits(candidate):
+        if max_bytes is not None:
+            return candidate.size <= max_bytes
+        return candidate.score >= (min_ssim if min_ssim is not None
+                                   else min_psnr)
+
+    # The size grows with the quality: the budget is met below a quality,
+    # the fidelity targets above it
+    highest = max_bytes is not None
+    low, high = min_quality, max_quality
+    best = None
+    tried = {}
+    with stage('quality_search') as fields:
+        while low <= high:
+            qualities = _spread(low, high, max(1, jobs))
+            for candidate in parallel_map(_evaluate, qualities, jobs):
+                tried[candidate.quality] = candidate
+            passing = [q for q in qualities if _fits(tried[q])]
+            failing = [q for q in qualities if not _fits(tried[q])]
+            if highest:
+                if passing:
+                    best = tried[max(passing)]
+                    low = best.quality + 1
+                above = [q for q in failing if q > low - 1]
+                high = min(above) - 1 if above else high
+            else:
+                if passing:
+                    best = tried[min(passing)]
+                    high = best.quality - 1
+                below = [q for q in failing if q < high + 1]
+                low = max(below) + 1 if below else low
+        fields['candidates'] = len(tried)
+
+        if best is None:
+            edge = tried[min_quality if highest else max_quality]
+            if highest:
+                raise ValueError('Cannot encode under {} bytes, quality {} '
+                                 'gives {} bytes.'.format(
+                                     max_bytes, edge.quality, edge.size))
+            raise ValueError('Cannot reach the target, quality {} scores '
+                             '{:.4f}.'.format(edge.quality, edge.score))
+        fields.update(quality=best.quality, bytes_written=best.size,
+                      score=best.score)
+    return best
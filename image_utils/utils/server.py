@@ -0,0 +1,412 @@
+# -*- coding: utf-8 -*-
+import functools
+import importlib
+import json
+import mimetypes
+import os
+import signal
+import socketserver
+import stat
+import threading
+import time
+from collections import deque
+from concurrent import futures
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+from image_utils.utils.io import decode_image, encode_image
+from image_utils.utils.metadata import probe_bytes
+from image_utils.utils.pipeline import (STAGES, pipeline_pixels, run_pipeline,
+                                        validate_pipeline)
+
+# Modules imported by the workers before their first request
+WARM_MODULES = ['numpy', 'scipy.ndimage', 'PIL.Image', 'imageio.v2',
+                'imageio.v3']
+
+
+class InputError(ValueError):
+    """ The image or the parameters of a request are invalid """
+
+
+def check_pixels(shape, stages, max_pixels):
+    """ Refuse a pipeline whose images would exceed max_pixels
+
+    Raises
+    ------
+    InputError
+        If the input, output or an intermediate image is too large, or
+        the stage parameters are invalid.
+
+    """
+    try:
+        pixels = pipeline_pixels(shape, stages)
+    except ValueError as e:
+        raise InputError(str(e))
+    if max_pixels is not None and pixels > max_pixels:
+        raise InputError('The request needs images of {} pixels, more than '
+                         'the {} allowed.'.format(pixels, max_pixels))
+
+
+def process_bytes(data, stages, ext, max_pixels=None):
+    """ Decode an image held in memory, run a pipeline and encode it
+
+    Errors due to the request (an image that cannot be decoded, invalid
+    stage parameters) are raised as InputError.
+
+    Parameters
+    ----------
+    data : bytes
+        Content of the input image file.
+    stages : list
+        List of mappings with an 'op' key and the stage parameters.
+    ext : str
+        Extension of the output format (e.g. '.png').
+    max_pixels : int, optional
+        Largest number of pixels of the images along the pipeline.
+
+    Returns
+    -------
+    data : bytes
+        Content of the output image file.
+
+    """
+    try:
+        img = decode_image(data)
+    except Exception as e:
+        raise InputError('Cannot decode the image: {}: {}'.format(
+            type(e).__name__, e))
+    # Checked again on the decoded image, whose header may not be known
+    check_pixels(img.shape, stages, max_pixels)
+    try:
+        img, write_kwargs = run_pipeline(img, stages)
+        return encode_image(img, ext, **write_kwargs)
+    except ValueError as e:
+        # Invalid parameters of a stage or of the encoder
+        raise InputError(str(e))
+
+
+def request_stages(operation, params):
+    """ Pipeline of a request, from its path and query parameters
+
+    Parameters
+    ----------
+    operation : str
+        Name of a stage (e.g. 'resize') or 'pipeline'.
+    params : dict
+        Query parameters, values are parsed as JSON when possible (e.g.
+        scale=0.5 or dimensions=[512,512]). For 'pipeline', the 'stages'
+        parameter holds the JSON list of stages.
+
+    Returns
+    -------
+    stages : list
+        List of stages, validated.
+
+    """
+    values = {}
+    for key, value in params.items():
+        try:
+            values[key] = json.loads(value)
+        except ValueError:
+            values[key] = value
+
+    if operation == 'pipeline':
+        if 'stages' not in values:
+            raise ValueError('pipeline requires a stages parameter.')
+        return validate_pipeline(values['stages'])
+    return validate_pipeline([dict(values, op=operation)])
+
+
+def _warm_up():
+    # Interrupting the server must not kill requests half-way
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for name in WARM_MODULES:
+        importlib.import_module(name)
+
+
+class WorkerPool(object):
+    """ Pool of worker processes with a bounded queue
+
+    Requests beyond the workers and the queue are refused immediately
+    (submit returns None) so that clients can back off instead of piling
+    up in memory. A worker dying (e.g. out of memory) breaks the whole
+    executor: it is replaced by a new one, only the requests it was
+    running fail.
+
+    Parameters
+    ----------
+    jobs : int, optional
+        Number of worker processes.
+    queue_size : int, optional
+        Number of requests waiting for a worker. [2 * jobs]
+
+    """
+
+    def __init__(self, jobs=1, queue_size=None):
+        self.jobs = jobs
+        self.capacity = jobs + (2 * jobs if queue_size is None
+                                else queue_size)
+        self._executor = self._new_executor()
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.restarts = 0
+        # Start the workers now rather than on the first requests
+        futures.wait([self._executor.submit(int) for _ in range(jobs)])
+
+    def _new_executor(self):
+        return futures.ProcessPoolExecutor(max_workers=self.jobs,
+                                           initializer=_warm_up)
+
+    def _restart(self, executor):
+        """ Replace a broken executor, once for all the requests it broke """
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = self._new_executor()
+            self.restarts += 1
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _release(self, executor, future):
+        with self._lock:
+            self.in_flight -= 1
+        if not future.cancelled() \
+                and isinstance(future.exception(), futures.BrokenExecutor):
+            self._restart(executor)
+
+    def _submit(self, func, args):
+        for retry in [False, True]:
+            with self._lock:
+                executor = self._executor
+            try:
+                return executor, executor.submit(func, *args)
+            except futures.BrokenExecutor:
+                # Broken since the last request, which was not run
+                if retry:
+                    raise
+                self._restart(executor)
+
+    def submit(self, func, *args):
+        """ Run func(*args) on a worker, None if the queue is full """
+        with self._lock:
+            if self.in_flight >= self.capacity:
+                return None
+            self.in_flight += 1
+        try:
+            executor, future = self._submit(func, args)
+        except BaseException:
+            with self._lock:
+                self.in_flight -= 1
+            raise
+        future.add_done_callback(functools.partial(self._release, executor))
+        return future
+
+    def shutdown(self):
+        self._executor.shutdown(cancel_futures=True)
+
+
+class ServerStats(object):
+    """ Request counters, throughput and latency percentiles
+
+    Parameters
+    ----------
+    window : int, optional
+        Number of recent requests used for the latency percentiles.
+
+    """
+
+    def __init__(self, window=1000):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self._start = time.time()
+        self.counts = {'requests': 0, 'completed': 0, 'failed': 0,
+                       'rejected': 0, 'bytes_in': 0, 'bytes_out': 0}
+
+    def add(self, **counts):
+        with self._lock:
+            for key, value in counts.items():
+                self.counts[key] += value
+
+    def record(self, latency, bytes_in, bytes_out):
+        """ Record a completed request """
+        with self._lock:
+            self._latencies.append(latency)
+            self.counts['completed'] += 1
+            self.counts['bytes_in'] += bytes_in
+            self.counts['bytes_out'] += bytes_out
+
+    def snapshot(self, pool=None):
+        """ Current statistics as a JSON serializable dict """
+        with self._lock:
+            stats = dict(self.counts)
+            latencies = sorted(self._latencies)
+        uptime = time.time() - self._start
+        stats['uptime'] = uptime
+        stats['throughput'] = stats['completed'] / uptime if uptime else 0.0
+        if latencies:
+            stats['latency'] = {
+                'mean': sum(latencies) / len(latencies),
+                'p50': latencies[len(latencies) // 2],
+                'p90': latencies[int(len(latencies) * 0.9)],
+                'p99': latencies[int(len(latencies) * 0.99)],
+                'max': latencies[-1]}
+        if pool is not None:
+            stats['jobs'] = pool.jobs
+            stats['in_flight'] = pool.in_flight
+            stats['queued'] = max(0, pool.in_flight - pool.jobs)
+            stats['capacity'] = pool.capacity
+            stats['restarts'] = pool.restarts
+        return stats
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """ POST /<operation>?param=value with the image as body
+
+    The output format is chosen with the format parameter (png by
+    default). GET /stats and GET /operations report the server state.
+    """
+
+    server_version = 'image_utils'
+
+    def address_string(self):
+        # Unix sockets have no client address
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return 'unix'
+
+    def _reply(self, code, body, content_type='application/json',
+               headers=None):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body, indent=2)
+        if isinstance(body, str):
+            body = (body + '\n').encode()
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, code, message, headers=None):
+        self._reply(code, {'error': message}, headers=headers)
+
+    def do_GET(self):
+        path = urlparse(self.path).path.strip('/')
+        if path == 'stats':
+            self._reply(200, self.server.stats.snapshot(self.server.pool))
+        elif path == 'operations':
+            self._reply(200, sorted(list(STAGES) + ['compress', 'pipeline']))
+        else:
+            self._error(404, 'Unknown path /{}.'.format(path))
+
+    def do_POST(self):
+        stats = self.server.stats
+        stats.add(requests=1)
+        start = time.perf_counter()
+
+        url = urlparse(self.path)
+        params = dict(parse_qsl(url.query))
+        ext = '.' + params.pop('format', 'png').lstrip('.').lower()
+        try:
+            stages = request_stages(url.path.strip('/'), params)
+        except ValueError as e:
+            stats.add(failed=1)
+            return self._error(400, str(e))
+
+        length = int(self.headers.get('Content-Length', 0))
+        if length <= 0:
+            stats.add(failed=1)
+            return self._error(411, 'The image must be sent as the body.')
+        if length > self.server.max_body:
+            stats.add(failed=1)
+            return self._error(413, 'The image exceeds {} bytes.'.format(
+                self.server.max_body))
+        data = self.rfile.read(length)
+
+        # Refused before reaching a worker, which could run out of memory
+        try:
+            info = probe_bytes(data)
+            if info is not None:
+                check_pixels((info.height, info.width), stages,
+                             self.server.max_pixels)
+        except ValueError as e:
+            stats.add(failed=1)
+            return self._error(400, str(e))
+
+        future = self.server.pool.submit(process_bytes, data, stages, ext,
+                                         self.server.max_pixels)
+        if future is None:
+            stats.add(rejected=1)
+            return self._error(503, 'Too many requests, retry later.',
+                               headers={'Retry-After': '1'})
+        try:
+            out = future.result()
+        except futures.BrokenExecutor as e:
+            # The pool replaces its workers, only this request fails
+            stats.add(failed=1)
+            return self._error(500, 'Worker died: {}'.format(e))
+        except InputError as e:
+            stats.add(failed=1)
+            return self._error(400, str(e))
+        except Exception as e:
+            stats.add(failed=1)
+            return self._error(500, '{}: {}'.format(type(e).__name__, e))
+
+        stats.record(time.perf_counter() - start, length, len(out))
+        content_type = mimetypes.guess_type('image' + ext)[0] \
+            or 'application/octet-stream'
+        self._reply(200, out, content_type)
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn,
+                      socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_close(self):
+        super().server_close()
+        os.remove(self.server_address)
+
+
+def make_server(pool, stats, host='127.0.0.1', port=8000, socket_path=None,
+                max_body=256 * 1024 ** 2, max_pixels=100 * 10 ** 6):
+    """ HTTP server running the requests on a worker pool
+
+    Parameters
+    ----------
+    pool : WorkerPool
+        Workers running the operations.
+    stats : ServerStats
+        Statistics updated by the requests.
+    host : str, optional
+        Address to listen on, ignored with socket_path.
+    port : int, optional
+        Port to listen on, ignored with socket_path.
+    socket_path : str, optional
+        Listen on this Unix socket instead of TCP.
+    max_body : int, optional
+        Maximum size of an input image in bytes.
+    max_pixels : int, optional
+        Maximum number of pixels of the images along a pipeline (input,
+        output and intermediate images). Larger requests are refused.
+
+    Returns
+    -------
+    server : socketserver.BaseServer
+        Server, call serve_forever() to start it.
+
+    """
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            if not stat.S_ISSOCK(os.stat(socket_path).st_mode):
+                raise IOError('{} exists and is not a socket.'.format(
+                    socket_path))
+            # Left over by a previous server
+            os.remove(socket_path)
+        server = _UnixHTTPServer(socket_path, _Handler)
+    else:
+        server = ThreadingHTTPServer((host, port), _Handler)
+    server.pool = pool
+    server.stats = stats
+    server.max_body = max_body
+    server.max_pixels = max_pixels
+    return server
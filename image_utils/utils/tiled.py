@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+import os
+
+from image_utils.utils.canvas import PaddedImage
+from image_utils.utils.io import read_image
+from image_utils.utils.lazy import lazy_import
+from image_utils.utils.mask import color_distance_mask, colors_distance_mask
+
+np = lazy_import('numpy')
+ndimage = lazy_import('scipy.ndimage')
+sparse = lazy_import('scipy.sparse')
+csgraph = lazy_import('scipy.sparse.csgraph')
+
+# Approximate number of bytes needed per pixel of a tile by the tiled
+# operations (input, distances, mask, labels and RGBA output).
+BYTES_PER_PIXEL = 24
+
+# TIFF tiles must have dimensions that are multiples of 16.
+TILE_MULTIPLE = 16
+
+
+def tile_size_for_budget(max_memory, bytes_per_pixel=BYTES_PER_PIXEL):
+    """ Side of the square tiles that fit in a memory budget
+
+    Parameters
+    ----------
+    max_memory : int
+        Memory budget in bytes.
+    bytes_per_pixel : int, optional
+        Working memory needed per pixel of a tile.
+
+    Returns
+    -------
+    tile_size : int
+        Side of the tiles, a multiple of 16.
+
+    """
+    side = int(np.sqrt(max_memory / bytes_per_pixel))
+    return max(TILE_MULTIPLE, side // TILE_MULTIPLE * TILE_MULTIPLE)
+
+
+def iter_tiles(shape, tile_size):
+    """ Iterate over the tiles of an image in row-major order
+
+    Parameters
+    ----------
+    shape : tuple
+        Shape of the image, only the first two dimensions are used.
+    tile_size : int
+        Side of the tiles.
+
+    Returns
+    -------
+    tiles : generator
+        (row_start, row_stop, col_start, col_stop) of each tile.
+
+    """
+    for r0 in range(0, shape[0], tile_size):
+        for c0 in range(0, shape[1], tile_size):
+            yield (r0, min(r0 + tile_size, shape[0]),
+                   c0, min(c0 + tile_size, shape[1]))
+
+
+def open_lazy(filename, shape=None, dtype='uint8'):
+    """ Open an image without loading its pixels in memory
+
+    NumPy files and raw files are memory-mapped. Uncompressed TIFF files are
+    memory-mapped using tifffile when it is installed. Other formats can
+    not be accessed by tiles and are fully decoded.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the image (.npy, .raw, .tif or any format known by imageio).
+    shape : tuple, optional
+        Shape of the image, required for raw files.
+    dtype : dtype, optional
+        Data type of raw files.
+
+    Returns
+    -------
+    img : ndarray
+        Memory-mapped (or decoded) image.
+
+    """
+    _, ext = os.path.splitext(filename)
+    ext = ext.lower()
+    if ext == '.npy':
+        return np.load(filename, mmap_mode='r')
+    if ext == '.raw':
+        if shape is None:
+            raise ValueError('The shape of a raw image must be given.')
+        return np.memmap(filename, dtype=dtype, mode='r', shape=tuple(shape))
+    if ext in ['.tif', '.tiff']:
+        try:
+            import tifffile
+            return tifffile.memmap(filename, mode='r')
+        except (ImportError, ValueError):
+            pass
+
+    return read_image(filename)
+
+
+def write_tiles(filename, shape, dtype, tiles, tile_size):
+    """ Write tiles, produced in row-major order, to a file
+
+    Nothing larger than a tile is held in memory. A .npy output is a
+    memory-mapped array filled tile by tile and a .tif output is a tiled
+    TIFF written with tifffile.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the output (.npy, .tif or .tiff).
+    shape : tuple
+        Shape of the output image.
+    dtype : dtype
+        Data type of the output image.
+    tiles : iterable
+        ((row_start, row_stop, col_start, col_stop), tile) in the order of
+        iter_tiles.
+    tile_size : int
+        Side of the tiles, a multiple of 16 for TIFF outputs.
+
+    """
+    _, ext = os.path.splitext(filename)
+    ext = ext.lower()
+    if ext == '.npy':
+        out = np.lib.format.open_memmap(filename, mode='w+', dtype=dtype,
+                                        shape=tuple(shape))
+        for (r0, r1, c0, c1), tile in tiles:
+            out[r0:r1, c0:c1] = tile
+        out.flush()
+        del out
+    elif ext in ['.tif', '.tiff']:
+        try:
+            import tifffile
+        except ImportError:
+            raise ImportError('tifffile is required to write tiled TIFF.')
+        if tile_size % TILE_MULTIPLE:
+            raise ValueError('TIFF tiles must be a multiple of 16.')
+        photometric = 'rgb' if len(shape) == 3 and shape[2] in [3, 4] \
+            else 'minisblack'
+        tifffile.imwrite(filename, (tile for _, tile in tiles),
+                         shape=tuple(shape), dtype=dtype,
+                         tile=(tile_size, tile_size),
+                         photometric=photometric)
+    else:
+        raise ValueError('Tiled outputs must be .npy or .tif files.')
+
+
+def _fill_background_components(img, value, threshold, seeds, tile_size):
+    """ Find the background components connected to the seeds, by tiles
+
+    Each tile is labeled independently. Labels touching across tile borders
+    are merged with a connected components pass on a graph of labels, so
+    only the tile borders are kept in memory.
+
+    Returns
+    -------
+    offsets : dict
+        Global label offset of each tile.
+    keep : ndarray
+        For each global label, whether it belongs to the background.
+
+    """
+    offsets = {}
+    bottom_rows, right_cols = {}, {}
+    edges = []
+    nb_total = 0
+    seed_labels = []
+    for r0, r1, c0, c1 in iter_tiles(img.shape, tile_size):
+        candidates = color_distance_mask(img[r0:r1, c0:c1], value, threshold)
+        labels, nb_labels = ndimage.label(candidates)
+        labels[labels > 0] += nb_total
+        offsets[(r0, c0)] = nb_total
+        nb_total += nb_labels
+
+        for row, col in seeds:
+            if r0 <= row < r1 and c0 <= col < c1:
+                seed_labels.append(labels[row - r0, col - c0])
+
+        # Merge with the tile above and the tile on the left
+        for border, neighbor in [(labels[0, :], bottom_rows.pop(
+                                    (r0 - tile_size, c0), None)),
+                                 (labels[:, 0], right_cols.pop(
+                                    (r0, c0 - tile_size), None))]:
+            if neighbor is None:
+                continue
+            both = (border > 0) & (neighbor > 0)
+            edges.append(np.stack([border[both], neighbor[both]]))
+        bottom_rows[(r0, c0)] = labels[-1, :].copy()
+        right_cols[(r0, c0)] = labels[:, -1].copy()
+
+    seed_labels = [label for label in seed_labels if label > 0]
+    if not seed_labels:
+        return offsets, np.zeros(nb_total + 1, dtype=bool)
+
+    edges = np.concatenate(edges, axis=1) if edges \
+        else np.zeros((2, 0), dtype=np.int64)
+    graph = sparse.coo_matrix((np.ones(edges.shape[1], dtype=bool),
+                               (edges[0], edges[1])),
+                              shape=(nb_total + 1, nb_total + 1))
+    _, components = csgraph.connected_components(graph, directed=False)
+    keep = np.isin(components, components[seed_labels])
+    keep[0] = False
+
+    return offsets, keep
+
+
+def remove_background_tiled(img, threshold=10, init_pos=(0, 0), mode='fill',
+                            tile_size=1024):
+    """ Remove background of img tile by tile
+
+    Same as image.remove_background but the image is only accessed by tiles
+    (e.g. a memory-mapped file) and the RGBA result is produced as tiles.
+    In fill mode the image is read twice: once to propagate the connected
+    background across tile borders and once to produce the output.
+
+    Parameters
+    ----------
+    img : ndarray
+        Input img, usually memory-mapped (see open_lazy).
+    threshold : int, optional
+        Threshold for background detection in case of noise.
+    init_pos : tuple or list, optional
+        Position at which the color is detected, or a list of positions.
+        In fill mode, all positions must have the same color.
+    mode : {'fill', 'value'}, optional
+        Either replace all close values or use a floodfill.
+    tile_size : int, optional
+        Side of the tiles.
+
+    Returns
+    -------
+    tiles : generator
+        ((row_start, row_stop, col_start, col_stop), tile) with RGBA tiles,
+        in the order of iter_tiles.
+
+    """
+    seeds = np.asarray(init_pos, dtype=np.intp).reshape(-1, 2)
+    values = np.array([img[row, col, 0:3] for row, col in seeds])
+    if mode == 'fill':
+        if len(np.unique(values, axis=0)) > 1:
+            raise ValueError('Tiled fill requires seeds of the same color.')
+        offsets, keep = _fill_background_components(img, values[0], threshold,
+                                                    seeds, tile_size)
+
+    for r0, r1, c0, c1 in iter_tiles(img.shape, tile_size):
+        tile = img[r0:r1, c0:c1]
+        if mode == 'fill':
+            candidates = color_distance_mask(tile, values[0], threshold)
+            labels, _ = ndimage.label(candidates)
+            labels[labels > 0] += offsets[(r0, c0)]
+            background = keep[labels]
+        else:
+            background = colors_distance_mask(tile, values, threshold,
+                                              inclusive=False)
+
+        new_tile = np.empty((r1 - r0, c1 - c0, 4), dtype=np.uint8)
+        new_tile[:, :, 0:3] = tile[:, :, 0:3]
+        new_tile[:, :, 3] = np.where(background, 0, 255)
+        yield (r0, r1, c0, c1), new_tile
+
+
+def pad_image_to_center_tiled(img, new_shape, tile_size=1024):
+    """ Pad image to center, tile by tile
+
+    Same as image.pad_image_to_center but the padded image is produced as
+    tiles, the full canvas is never allocated.
+
+    Parameters
+    ----------
+    img : ndarray
+        Input image, usually memory-mapped (see open_lazy).
+    new_shape : tuple
+        Dimensions of the output image.
+    tile_size : int, optional
+        Side of the tiles.
+
+    Returns
+    -------
+    tiles : generator
+        ((row_start, row_stop, col_start, col_stop), tile), in the order of
+        iter_tiles.
+
+    """
+    return PaddedImage(img, new_shape).iter_tiles(tile_size)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Run the image_utils scripts as subcommands of a single command.
+
+    iu.py resize in.png out.png --scale 0.5
+    iu.py remove_background --help
+
+The command is the name of a script without its iu_ prefix, the remaining
+arguments are passed to the script. Only the modules needed by the command
+are imported.
+"""
+
+import argparse
+import ast
+import glob
+import os
+import runpy
+import sys
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _commands():
+    """ Name and path of every iu_*.py script next to this one """
+    commands = {}
+    for path in glob.glob(os.path.join(SCRIPTS_DIR, 'iu_*.py')):
+        name = os.path.basename(path)[len('iu_'):-len('.py')]
+        commands[name] = path
+    return commands
+
+
+def _summary(path):
+    """ First line of the docstring of a script """
+    with open(path) as f:
+        doc = ast.get_docstring(ast.parse(f.read())) or ''
+    return doc.strip().split('\n')[0]
+
+
+def _build_arg_parser(commands):
+    epilog = 'Commands:\n' + '\n'.join(
+        '  {:<20}{}'.format(name, _summary(commands[name]))
+        for name in sorted(commands))
+    p = argparse.ArgumentParser(
+        description=__doc__, epilog=epilog,
+        formatter_class=argparse.RawTextHelpFormatter)
+    p.add_argument('command', choices=sorted(commands), metavar='command',
+                   help='Script to run (see the list below).')
+    p.add_argument('args', nargs=argparse.REMAINDER,
+                   help='Arguments of the command, see iu.py command -h.')
+    return p
+
+
+def main():
+    commands = _commands()
+    parser = _build_arg_parser(commands)
+    args = parser.parse_args()
+
+    path = commands[args.command]
+    sys.argv = [os.path.basename(path)] + args.args
+    runpy.run_path(path, run_name='__main__')
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,39 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-""" Remove background of image using pixel value from a position """
+""" Compress an image, a GIF or a video.
+
+GIFs are encoded with a single palette built from the colors of all the
+frames (or one palette per scene with --scene_threshold), each frame only
+storing the pixels that changed since the previous one.
+
+JPEG and WebP images can be given a target instead of a fixed --level, the
+quality is then searched by encoding candidates in memory:
+
+    iu_compress_image.py in.png out.jpg --max_bytes 200000
+    iu_compress_image.py in.png out.webp --min_ssim 0.98 --threads 4
+
+On the standard output, the searched image is written encoded in the
+format given by --format:
+
+    iu_compress_image.py in.png - --max_bytes 200000 --format .jpg | ...
+"""
 
 import argparse
 import os
 
-import imageio.v2 as imageio
+from image_utils.utils.batch import add_batch_args, batch_main
+from image_utils.utils.cache import add_cache_args, run_cached
+from image_utils.utils.frames import iter_frames, prefetch, write_frames
+from image_utils.utils.io import (is_pipe, read_image, write_bytes,
+                                  write_image)
+from image_utils.utils.palette import compress_gif
+from image_utils.utils.profiling import add_profiling_args, start_profiling
+from image_utils.utils.quality import search_quality
+
+# Arguments changing the output, part of the cache key
+CACHE_PARAMS = ['palette', 'scene_threshold', 'level', 'max_bytes',
+                'min_ssim', 'min_psnr', 'format']
 
 
 def _build_arg_parser():
@@ -14,50 +41,104 @@ def _build_arg_parser():
         description=__doc__,
         formatter_class=argparse.RawTextHelpFormatter)
     p.add_argument('in_filename',
-                   help='Path of the input image.')
+                   help='Path of the input image, - for the standard input.')
     p.add_argument('out_filename',
-                   help='Path of the output image.')
+                   help='Path of the output image, - for a .npy stream on '
+                        'the\nstandard output (or the searched image, see '
+                        '--format).')
     p2 = p.add_mutually_exclusive_group()
     p2.add_argument('--palette', type=int, default=32,
-                    help='Number of colors in the palette for GIF (0-64). '
+                    help='Number of colors in the palette for GIF (2-256). '
                          '[%(default)s]')
+    p.add_argument('--scene_threshold', type=float, default=None,
+                   help='Build a palette per scene for GIF, a scene starts '
+                        'when the colors\nof a frame differ from the '
+                        'previous one by more than this (0-1).\nA single '
+                        'palette for all the frames by default.')
     p.add_argument('--level', type=float, default=10,
                    help='Level of compression (0-100). [%(default)s]')
+    p3 = p.add_mutually_exclusive_group()
+    p3.add_argument('--max_bytes', type=int, default=None,
+                    help='Highest JPEG/WebP quality whose output fits in '
+                         'this many bytes.')
+    p3.add_argument('--min_ssim', type=float, default=None,
+                    help='Lowest JPEG/WebP quality whose output has at least '
+                         'this SSIM\n(0-1) with the input.')
+    p3.add_argument('--min_psnr', type=float, default=None,
+                    help='Lowest JPEG/WebP quality whose output has at least '
+                         'this PSNR\n(dB) with the input.')
+    p.add_argument('--format', default=None,
+                   help='Format of the searched output when writing to the '
+                        'standard output\n(e.g. .jpg or .webp).')
+    p.add_argument('--threads', type=int, default=1,
+                   help='Number of candidate qualities encoded in parallel. '
+                        '[%(default)s]')
     p.add_argument('-f', dest='force_overwrite', action='store_true',
                    help='Overwrite the output files if they exist.')
+    add_batch_args(p)
+    add_cache_args(p)
+    add_profiling_args(p)
     return p
 
 
+def _run(in_filename, out_filename, args):
+    _, ext = os.path.splitext(out_filename)
+    if args.max_bytes is not None or args.min_ssim is not None \
+            or args.min_psnr is not None:
+        if is_pipe(out_filename):
+            if args.format is None:
+                raise ValueError('--format is required to write a searched '
+                                 'quality to the standard output.')
+            ext = '.' + args.format.lstrip('.')
+        candidate = search_quality(read_image(in_filename), ext,
+                                   args.max_bytes, args.min_ssim,
+                                   args.min_psnr, args.threads)
+        write_bytes(out_filename, candidate.data)
+    elif ext in ['.jpg', '.jpeg', '.JPG', '.JPEG']:
+        new_img = read_image(in_filename)
+        new_img = new_img[:, :, 0:3]
+        write_image(out_filename, new_img, quality=args.level)
+    elif ext in ['.gif', '.GIF']:
+        compress_gif(in_filename, out_filename, args.palette,
+                     args.scene_threshold)
+    elif ext in ['.mp4', '.MP4', '.avi', '.AVI', '.mov', '.MOV']:
+        frames = prefetch(iter_frames(in_filename))
+        write_frames(out_filename, frames, quality=args.level)
+    else:
+        new_img = read_image(in_filename)
+        write_image(out_filename, new_img)
+
+
+def _process(in_filename, out_filename, args):
+    if not is_pipe(in_filename) and not os.path.isfile(in_filename):
+        raise IOError('{} does not exist.'.format(in_filename))
+
+    if os.path.isfile(out_filename) and not args.force_overwrite:
+        raise IOError('{} exists, delete it first.'.format(out_filename))
+
+    return run_cached(_run, 'compress', in_filename, out_filename,
+                      args, CACHE_PARAMS)
+
+
 def main():
     parser = _build_arg_parser()
     args = parser.parse_args()
+    start_profiling(args)
 
-    if not os.path.isfile(args.in_filename):
-        raise IOError('{} does not exist.'.format(args.in_filename))
-
-    if os.path.isfile(args.out_filename) and not args.force_overwrite:
-        raise IOError('{} exists, delete it first.'.format(args.out_filename))
+    if not 2 <= args.palette <= 256:
+        raise ValueError('--palette must be between 2 and 256.')
+    if args.scene_threshold is not None \
+            and not 0 <= args.scene_threshold <= 1:
+        raise ValueError('--scene_threshold must be between 0 and 1.')
+    if args.threads < 1:
+        raise ValueError('--threads must be at least 1.')
 
-    _, ext = os.path.splitext(args.out_filename)
-    if ext in ['.jpg', '.jpeg', '.JPG', '.JPEG']:
-        new_img = imageio.imread(args.in_filename)
-        new_img = new_img[:, :, 0:3]
-        imageio.imwrite(args.out_filename, new_img, quality=args.level)
-    elif ext in ['.gif', '.GIF']:
-        frames = imageio.mimread(args.in_filename)
-        with imageio.get_writer(args.out_filename, mode='I',
-                                quantizer=2, palettesize=args.palette) as writer:
-            for frame in frames:
-                writer.append_data(frame)
-    elif ext in ['.mp4', '.MP4', '.avi', '.AVI', '.mov', '.MOV']:
-        frames = imageio.mimread(args.in_filename)
-        with imageio.get_writer(args.out_filename, mode='I',
-                                quality=args.level) as writer:
-            for frame in frames:
-                writer.append_data(frame)
+    if args.batch:
+        batch_main(_process, args)
     else:
-        new_img = imageio.imread(args.in_filename)
-        imageio.imwrite(args.out_filename, new_img)
+        status = _process(args.in_filename, args.out_filename, args)
+        if status is not None:
+            print(status.capitalize() + '.')
 
 
 if __name__ == "__main__":
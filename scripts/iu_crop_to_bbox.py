@@ -6,9 +6,14 @@
 import argparse
 import os
 
-import imageio.v2 as imageio
-
+from image_utils.utils.batch import add_batch_args, batch_main
+from image_utils.utils.cache import add_cache_args, run_cached
 from image_utils.utils.image import auto_crop
+from image_utils.utils.io import is_pipe, read_image, write_image
+from image_utils.utils.profiling import add_profiling_args, start_profiling
+
+# Arguments changing the output, part of the cache key
+CACHE_PARAMS = ['borders']
 
 
 def _build_arg_parser():
@@ -16,29 +21,48 @@ def _build_arg_parser():
         description=__doc__,
         formatter_class=argparse.RawTextHelpFormatter)
     p.add_argument('in_filename',
-                   help='Path of the input image.')
+                   help='Path of the input image, - for the standard input.')
     p.add_argument('out_filename',
-                   help='Path of the output image.')
+                   help='Path of the output image, - for a .npy stream on '
+                        'the\nstandard output.')
     p.add_argument('--borders', type=int, default=0,
                    help='Border around the bounding box. [%(default)s]')
     p.add_argument('-f', dest='force_overwrite', action='store_true',
                    help='Overwrite the output files if they exist.')
+    add_batch_args(p)
+    add_cache_args(p)
+    add_profiling_args(p)
     return p
 
 
+def _run(in_filename, out_filename, args):
+    img = read_image(in_filename)
+    cropped = auto_crop(img, args.borders)
+    write_image(out_filename, cropped)
+
+
+def _process(in_filename, out_filename, args):
+    if not is_pipe(in_filename) and not os.path.isfile(in_filename):
+        raise IOError('{} does not exist.'.format(in_filename))
+
+    if os.path.isfile(out_filename) and not args.force_overwrite:
+        raise IOError('{} exists, delete it first.'.format(out_filename))
+
+    return run_cached(_run, 'auto_crop', in_filename, out_filename,
+                      args, CACHE_PARAMS)
+
+
 def main():
     parser = _build_arg_parser()
     args = parser.parse_args()
+    start_profiling(args)
 
-    if not os.path.isfile(args.in_filename):
-        raise IOError('{} does not exist.'.format(args.in_filename))
-
-    if os.path.isfile(args.out_filename) and not args.force_overwrite:
-        raise IOError('{} exists, delete it first.'.format(args.out_filename))
-
-    img = imageio.imread(args.in_filename)
-    cropped = auto_crop(img, args.borders)
-    imageio.imwrite(args.out_filename, cropped)
+    if args.batch:
+        batch_main(_process, args)
+    else:
+        status = _process(args.in_filename, args.out_filename, args)
+        if status is not None:
+            print(status.capitalize() + '.')
 
 
 if __name__ == "__main__":
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Find the near-duplicate images of a collection by perceptual hashing.
+
+Images whose hashes differ by at most --threshold bits are grouped, the
+first image of each group in the input order being the original:
+
+    iu_find_duplicates.py 'photos/*.jpg' --threshold 6 --json dups.json
+
+With --hash_index, the hashes are stored in a SQLite index and only new or
+modified images are decoded on the next runs.
+"""
+
+import argparse
+import json
+import os
+
+from image_utils.utils.batch import expand_inputs
+from image_utils.utils.perceptual_hash import (DEFAULT_THRESHOLD, HASH_METHODS,
+                                               HashIndex, dedupe_files)
+from image_utils.utils.profiling import add_profiling_args, start_profiling
+
+
+def _build_arg_parser():
+    p = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawTextHelpFormatter)
+    p.add_argument('in_filename', nargs='+',
+                   help='Paths of the input images, globs, directories or '
+                        'text files listing\nimages.')
+    p.add_argument('--method', choices=HASH_METHODS, default='phash',
+                   help='Perceptual hash. [%(default)s]')
+    p.add_argument('--threshold', type=int, default=DEFAULT_THRESHOLD,
+                   help='Maximum Hamming distance between duplicates, out '
+                        'of 64 bits. [%(default)s]')
+    p.add_argument('--hash_index', default=None,
+                   help='SQLite index of perceptual hashes, reused across '
+                        'runs.')
+    p.add_argument('--threads', type=int, default=1,
+                   help='Number of threads decoding the images. '
+                        '[%(default)s]')
+    p.add_argument('--json', default=None,
+                   help='Path of a JSON file mapping each duplicate to its '
+                        'original.')
+    p.add_argument('-f', dest='force_overwrite', action='store_true',
+                   help='Overwrite the output files if they exist.')
+    add_profiling_args(p)
+    return p
+
+
+def main():
+    parser = _build_arg_parser()
+    args = parser.parse_args()
+    start_profiling(args)
+
+    filenames = []
+    for pattern in args.in_filename:
+        if os.path.isfile(pattern) and \
+                os.path.splitext(pattern)[1].lower() not in ['.txt', '.lst']:
+            filenames.append(pattern)
+        else:
+            filenames.extend(expand_inputs(pattern))
+    if not filenames:
+        raise IOError('No input found for {}.'.format(
+            ' '.join(args.in_filename)))
+
+    if args.json and os.path.isfile(args.json) and not args.force_overwrite:
+        raise IOError('{} exists, delete it first.'.format(args.json))
+    if not 0 <= args.threshold <= 64:
+        raise ValueError('--threshold must be between 0 and 64.')
+
+    index = HashIndex(args.hash_index) if args.hash_index else None
+    try:
+        kept, duplicates = dedupe_files(filenames, args.threshold,
+                                        args.method, index, args.threads)
+    finally:
+        if index is not None:
+            index.close()
+
+    groups = {}
+    for duplicate, original in duplicates.items():
+        groups.setdefault(original, []).append(duplicate)
+    for original in kept:
+        if original in groups:
+            print(original)
+            for duplicate in groups[original]:
+                print('  {}'.format(duplicate))
+    print('{} images, {} duplicates.'.format(len(filenames),
+                                             len(duplicates)))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(duplicates, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
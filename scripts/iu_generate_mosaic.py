@@ -1,15 +1,30 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-""" Generate a mosaic from a set of images. """
+""" Generate a mosaic from a set of images.
+
+By default the images are scaled into a grid of identical cells. With
+--layout justified, they are laid out in rows scaled to fill the width of
+the canvas, keeping their ratio, which wastes far less canvas when the
+images have different ratios:
+
+    iu_generate_mosaic.py *.jpg out.jpg --layout justified --row_height 300
+"""
 
 import argparse
 import os
+import sys
+from contextlib import nullcontext
 
-import imageio.v2 as imageio
-import numpy as np
+from image_utils.utils.io import write_image
+from image_utils.utils.layout import LAYOUTS
+from image_utils.utils.lazy import lazy_import
+from image_utils.utils.metadata import MetadataIndex
+from image_utils.utils.mosaic import generate_mosaic_from_files
+from image_utils.utils.perceptual_hash import HashIndex, dedupe_files
+from image_utils.utils.profiling import add_profiling_args, start_profiling
 
-from image_utils.utils.image import generate_mosaic
+np = lazy_import('numpy')
 
 
 def _build_arg_parser():
@@ -19,7 +34,8 @@ def _build_arg_parser():
     p.add_argument('in_filename', nargs='+',
                    help='Path of the input images.')
     p.add_argument('out_filename',
-                   help='Path of the output image.')
+                   help='Path of the output image, - for a .npy stream on '
+                        'the\nstandard output.')
 
     p.add_argument('--rows', type=int, default=None,
                    help='Number of rows in the mosaic. [%(default)s]')
@@ -30,6 +46,18 @@ def _build_arg_parser():
     p.add_argument('--max_in_col', type=int, default=None,
                    help='Maximum number of images in a column. [%(default)s]')
 
+    p.add_argument('--layout', choices=LAYOUTS, default='grid',
+                   help='Grid of rows x cols cells, or justified rows of '
+                        'images. [%(default)s]')
+    p.add_argument('--canvas_width', type=int, default=None,
+                   help='Width of a justified mosaic. [squarish mosaic]')
+    p.add_argument('--row_height', type=int, default=None,
+                   help='Target height of the rows of a justified mosaic. '
+                        '[median height]')
+    p.add_argument('--spacing', type=int, default=0,
+                   help='Pixels between the images of a justified mosaic. '
+                        '[%(default)s]')
+
     p.add_argument('--squarish', action='store_true',
                    help='Try to make the mosaic a square.')
     p.add_argument('--auto_crop', action='store_true',
@@ -42,14 +70,35 @@ def _build_arg_parser():
                                                 'pad_to_max'],
                    default='resize_to_avg',
                    help='Method to use to scale the images. [%(default)s]')
+    p.add_argument('--max_cell_size', type=int, default=None,
+                   help='Largest side of a cell in pixels, to make a '
+                        'mosaic of thumbnails.\nNot with pad_to_max.')
+    p.add_argument('--metadata_index', default=None,
+                   help='SQLite index of image dimensions, reused across '
+                        'runs.')
+    p.add_argument('--dedupe', type=int, default=None, metavar='DISTANCE',
+                   help='Drop the images whose perceptual hash is within '
+                        'DISTANCE bits of\nan earlier image (e.g. 6).')
+    p.add_argument('--hash_index', default=None,
+                   help='SQLite index of perceptual hashes, reused across '
+                        'runs.')
+    p.add_argument('--jobs', type=int, default=1,
+                   help='Number of threads decoding and scaling the images. '
+                        '[%(default)s]')
+    p.add_argument('--full_decode', action='store_true',
+                   help='Decode JPEG images at full resolution, by default '
+                        'they are decoded\nat the smallest scale (1/2, 1/4 '
+                        'or 1/8) still larger than their cell.')
     p.add_argument('-f', dest='force_overwrite', action='store_true',
                    help='Overwrite the output files if they exist.')
+    add_profiling_args(p)
     return p
 
 
 def main():
     parser = _build_arg_parser()
     args = parser.parse_args()
+    start_profiling(args)
 
     for filename in args.in_filename:
         if not os.path.isfile(filename):
@@ -58,12 +107,34 @@ def main():
     if os.path.isfile(args.out_filename) and not args.force_overwrite:
         raise IOError('{} exists, delete it first.'.format(args.out_filename))
 
+    # Before the layout, which depends on the number of images
+    if args.dedupe is not None:
+        with HashIndex(args.hash_index) if args.hash_index \
+                else nullcontext() as hash_index:
+            args.in_filename, duplicates = dedupe_files(
+                args.in_filename, args.dedupe, index=hash_index,
+                jobs=args.jobs)
+        print('Dropped {} duplicates.'.format(len(duplicates)),
+              file=sys.stderr)
+
     if args.rows is not None and args.max_in_col is not None:
         raise ValueError("Cannot specify both --rows and --max_in_col.")
 
     if args.max_in_row and args.max_in_col:
         raise ValueError("Cannot specify both --max_in_row and --max_in_col.")
 
+    if args.max_cell_size is not None and args.scaling_method == 'pad_to_max':
+        raise ValueError("--max_cell_size requires a resize scaling method.")
+
+    if args.layout == 'justified' and args.scaling_method == 'pad_to_max':
+        raise ValueError("--layout justified resizes the images, it cannot "
+                         "be used with pad_to_max.")
+
+    if args.layout != 'justified' and (args.canvas_width or args.row_height
+                                       or args.spacing):
+        raise ValueError("--canvas_width, --row_height and --spacing "
+                         "require --layout justified.")
+
     if args.max_in_row:
         args.cols = args.max_in_row
         args.rows = np.ceil(len(args.in_filename) / args.max_in_row)
@@ -89,15 +160,25 @@ def main():
         raise ValueError("--auto_border requires --auto_crop.")
 
     if args.squarish:
-        print('Overwriting rows and column to make the mosaic squarish.')
+        print('Overwriting rows and column to make the mosaic squarish.',
+              file=sys.stderr)
         args.rows = args.cols = np.ceil(np.sqrt(len(args.in_filename)))
 
-    imgs = [imageio.imread(f) for f in args.in_filename]
-    mosaic = generate_mosaic(imgs, int(args.rows), int(args.cols),
-                             args.auto_crop, args.auto_border,
-                             args.scaling_method)
-
-    imageio.imwrite(args.out_filename, mosaic)
+    # A .npy output is built directly in a memory-mapped file
+    _, ext = os.path.splitext(args.out_filename)
+    memmap_filename = args.out_filename if ext.lower() == '.npy' else None
+
+    # Images are read one at a time, the canvas is the only large array
+    with MetadataIndex(args.metadata_index) if args.metadata_index \
+            else nullcontext() as index:
+        mosaic = generate_mosaic_from_files(
+            args.in_filename, int(args.rows), int(args.cols), args.auto_crop,
+            args.auto_border, args.scaling_method, memmap_filename, index,
+            args.jobs, not args.full_decode, args.max_cell_size, args.layout,
+            args.canvas_width, args.row_height, args.spacing)
+
+    if memmap_filename is None:
+        write_image(args.out_filename, mosaic)
 
 
 if __name__ == "__main__":
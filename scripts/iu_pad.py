@@ -6,9 +6,17 @@
 import argparse
 import os
 
-import imageio.v2 as imageio
+from image_utils.utils.batch import add_batch_args, batch_main
+from image_utils.utils.cache import add_cache_args, run_cached
+from image_utils.utils.canvas import PaddedImage, write_padded
+from image_utils.utils.io import is_pipe, read_image
+from image_utils.utils.metadata import MetadataIndex, image_info
+from image_utils.utils.profiling import add_profiling_args, start_profiling
+from image_utils.utils.tiled import (open_lazy, pad_image_to_center_tiled,
+                                     tile_size_for_budget, write_tiles)
 
-from image_utils.utils.image import pad_image_to_center
+# Arguments changing the output, part of the cache key
+CACHE_PARAMS = ['dimensions', 'add_borders', 'max_memory']
 
 
 def _build_arg_parser():
@@ -16,40 +24,89 @@ def _build_arg_parser():
         description=__doc__,
         formatter_class=argparse.RawTextHelpFormatter)
     p.add_argument('in_filename',
-                   help='Path of the input image.')
+                   help='Path of the input image, - for the standard input.')
     p.add_argument('out_filename',
-                   help='Path of the output image.')
+                   help='Path of the output image, - for a .npy stream on '
+                        'the\nstandard output.')
     p2 = p.add_mutually_exclusive_group(required=True)
     p2.add_argument('--dimensions', nargs=2, type=int,
                     help='Dimensions of the image in pixel.')
     p2.add_argument('--add_borders', nargs=2, type=int,
                     help='Scale of the image. [1.0]')
+    p.add_argument('--max_memory', type=float, default=None,
+                   help='Process the image by tiles using at most this much '
+                        'memory (MB).\nThe input is memory-mapped when '
+                        'possible (.npy, uncompressed .tif)\nand the '
+                        'output must be a .npy or a tiled .tif file.')
+    p.add_argument('--metadata_index', default=None,
+                   help='SQLite index of image dimensions, reused across '
+                        'runs.')
     p.add_argument('-f', dest='force_overwrite', action='store_true',
                    help='Overwrite the output files if they exist.')
+    add_batch_args(p)
+    add_cache_args(p)
+    add_profiling_args(p)
     return p
 
 
-def main():
-    parser = _build_arg_parser()
-    args = parser.parse_args()
-
-    if not os.path.isfile(args.in_filename):
-        raise IOError('{} does not exist.'.format(args.in_filename))
-
-    if os.path.isfile(args.out_filename) and not args.force_overwrite:
-        raise IOError('{} exists, delete it first.'.format(args.out_filename))
-
-    img = imageio.imread(args.in_filename)
+def _run(in_filename, out_filename, args):
+    # The target is checked from the header, before decoding the pixels
+    if args.metadata_index:
+        with MetadataIndex(args.metadata_index) as index:
+            info = image_info(in_filename, index)
+    else:
+        info = image_info(in_filename)
 
     if args.add_borders is not None:
-        args.dimensions = (args.add_borders[0] + img.shape[0],
-                           args.add_borders[1] + img.shape[1])
+        dimensions = (args.add_borders[0] + info.height,
+                      args.add_borders[1] + info.width)
     else:
-        if args.dimensions[0] < img.shape[0] or args.dimensions[1] < img.shape[1]:
+        dimensions = args.dimensions
+        if dimensions[0] < info.height or dimensions[1] < info.width:
             raise ValueError("--dimensions must be larger than image dimensions.")
 
-    padded = pad_image_to_center(img, args.dimensions)
-    imageio.imwrite(args.out_filename, padded)
+    if args.max_memory is not None:
+        img = open_lazy(in_filename)
+    else:
+        img = read_image(in_filename)
+
+    if args.max_memory is not None:
+        tile_size = tile_size_for_budget(args.max_memory * 1024 ** 2)
+        tiles = pad_image_to_center_tiled(img, dimensions, tile_size)
+        write_tiles(out_filename, tuple(dimensions) + img.shape[2:],
+                    img.dtype, tiles, tile_size)
+        return
+
+    # The canvas is streamed to the encoder, never allocated
+    write_padded(out_filename, PaddedImage(img, dimensions))
+
+
+def _process(in_filename, out_filename, args):
+    if not is_pipe(in_filename) and not os.path.isfile(in_filename):
+        raise IOError('{} does not exist.'.format(in_filename))
+
+    if os.path.splitext(in_filename)[1].lower() == '.raw':
+        raise ValueError('{}: raw images have no header giving their shape, '
+                         'convert them to .npy first.'.format(in_filename))
+
+    if os.path.isfile(out_filename) and not args.force_overwrite:
+        raise IOError('{} exists, delete it first.'.format(out_filename))
+
+    return run_cached(_run, 'pad', in_filename, out_filename,
+                      args, CACHE_PARAMS)
+
+
+def main():
+    parser = _build_arg_parser()
+    args = parser.parse_args()
+    start_profiling(args)
+
+    if args.batch:
+        batch_main(_process, args)
+    else:
+        status = _process(args.in_filename, args.out_filename, args)
+        if status is not None:
+            print(status.capitalize() + '.')
 
 
 if __name__ == "__main__":
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Apply a chain of operations to an image, decoding and encoding it once.
+
+The pipeline is described in a JSON or YAML file, e.g.:
+
+    stages:
+      - {op: remove_background, threshold: 10, mode: fill}
+      - {op: auto_crop, borders: 20}
+      - {op: resize, scale: 0.5}
+      - {op: pad, dimensions: [512, 512]}
+      - {op: compress, quality: 80}
+
+Available stages: remove_background, auto_crop, resize, pad and compress
+(options forwarded to the writer).
+"""
+
+import argparse
+import os
+
+from image_utils.utils.batch import add_batch_args, batch_main
+from image_utils.utils.cache import add_cache_args, run_cached
+from image_utils.utils.io import is_pipe
+from image_utils.utils.pipeline import load_pipeline, process_file
+from image_utils.utils.profiling import add_profiling_args, start_profiling
+
+# Arguments changing the output, part of the cache key (the stages are
+# loaded from in_pipeline)
+CACHE_PARAMS = ['stages']
+
+
+def _build_arg_parser():
+    p = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawTextHelpFormatter)
+    p.add_argument('in_filename',
+                   help='Path of the input image, - for the standard input.')
+    p.add_argument('out_filename',
+                   help='Path of the output image, - for a .npy stream on '
+                        'the\nstandard output.')
+    p.add_argument('in_pipeline',
+                   help='Path of the pipeline specification (.json, .yaml).')
+    p.add_argument('-f', dest='force_overwrite', action='store_true',
+                   help='Overwrite the output files if they exist.')
+    add_batch_args(p)
+    add_cache_args(p)
+    add_profiling_args(p)
+    return p
+
+
+def _run(in_filename, out_filename, args):
+    process_file(in_filename, out_filename, args.stages)
+
+
+def _process(in_filename, out_filename, args):
+    if not is_pipe(in_filename) and not os.path.isfile(in_filename):
+        raise IOError('{} does not exist.'.format(in_filename))
+
+    if os.path.isfile(out_filename) and not args.force_overwrite:
+        raise IOError('{} exists, delete it first.'.format(out_filename))
+
+    return run_cached(_run, 'pipeline', in_filename, out_filename,
+                      args, CACHE_PARAMS)
+
+
+def main():
+    parser = _build_arg_parser()
+    args = parser.parse_args()
+    start_profiling(args)
+
+    if not os.path.isfile(args.in_pipeline):
+        raise IOError('{} does not exist.'.format(args.in_pipeline))
+    args.stages = load_pipeline(args.in_pipeline)
+
+    if args.batch:
+        batch_main(_process, args)
+    else:
+        status = _process(args.in_filename, args.out_filename, args)
+        if status is not None:
+            print(status.capitalize() + '.')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Generate several sizes of an image, or a Deep Zoom pyramid, from a
+single decode.
+
+The levels are written next to the output, named after their dimensions:
+
+    iu_pyramid.py in.jpg out.jpg --scales 1 0.5 0.25 0.125
+        -> out_4000x3000.jpg, out_2000x1500.jpg, ...
+
+With a .dzi output, a Deep Zoom pyramid of tiles is written instead, as
+used by tiled image viewers (e.g. OpenSeadragon):
+
+    iu_pyramid.py in.jpg out.dzi --tile_size 254 --overlap 1
+        -> out.dzi, out_files/<level>/<col>_<row>.jpg
+"""
+
+import argparse
+import os
+
+from image_utils.utils.batch import add_batch_args, batch_main
+from image_utils.utils.image import resize_dimensions
+from image_utils.utils.io import read_image
+from image_utils.utils.metadata import image_info
+from image_utils.utils.profiling import add_profiling_args, start_profiling
+from image_utils.utils.pyramid import (resize_pyramid, write_deep_zoom,
+                                       write_pyramid)
+
+
+def _build_arg_parser():
+    p = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawTextHelpFormatter)
+    p.add_argument('in_filename',
+                   help='Path of the input image.')
+    p.add_argument('out_filename',
+                   help='Path of the output, its levels are named after it '
+                        '(.dzi for Deep Zoom).')
+    p2 = p.add_mutually_exclusive_group()
+    p2.add_argument('--scales', nargs='+', type=float, default=None,
+                    help='Scales of the levels, e.g. 1 0.5 0.25.')
+    p2.add_argument('--dimensions', nargs='+', type=int, default=None,
+                    help='Dimensions of the levels as width height pairs.')
+    p.add_argument('--tile_size', type=int, default=254,
+                   help='Side of the Deep Zoom tiles. [%(default)s]')
+    p.add_argument('--overlap', type=int, default=1,
+                   help='Overlap of the Deep Zoom tiles. [%(default)s]')
+    p.add_argument('--format', choices=['jpg', 'png', 'webp'], default='jpg',
+                   help='Format of the Deep Zoom tiles. [%(default)s]')
+    p.add_argument('--level', type=int, default=None,
+                   help='Quality (JPEG, WebP) or zlib level (PNG) of the '
+                        'outputs.')
+    p.add_argument('--threads', type=int, default=1,
+                   help='Number of threads encoding the levels or tiles of '
+                        'an image.\n[%(default)s]')
+    p.add_argument('--full_decode', action='store_true',
+                   help='Decode JPEG images at full resolution, by default '
+                        'they are decoded\nat the smallest scale still larger '
+                        'than the largest level.')
+    p.add_argument('-f', dest='force_overwrite', action='store_true',
+                   help='Overwrite the output files if they exist.')
+    add_batch_args(p)
+    add_profiling_args(p)
+    return p
+
+
+def level_filenames(out_filename, dimensions):
+    """ Path of each level, the dimensions appended to the output name """
+    root, ext = os.path.splitext(out_filename)
+    return ['{}_{}x{}{}'.format(root, int(width), int(height), ext)
+            for width, height in dimensions]
+
+
+def _dimensions(in_filename, args):
+    if args.dimensions is not None:
+        return [tuple(args.dimensions[i:i + 2])
+                for i in range(0, len(args.dimensions), 2)]
+    info = image_info(in_filename)
+    return [resize_dimensions((info.height, info.width), scale=scale)
+            for scale in args.scales]
+
+
+def _process(in_filename, out_filename, args):
+    if not os.path.isfile(in_filename):
+        raise IOError('{} does not exist.'.format(in_filename))
+
+    _, ext = os.path.splitext(out_filename)
+    if ext.lower() == '.dzi':
+        if os.path.isfile(out_filename) and not args.force_overwrite:
+            raise IOError('{} exists, delete it first.'.format(out_filename))
+        write_deep_zoom(out_filename, read_image(in_filename),
+                        args.tile_size, args.overlap, args.format,
+                        args.level, args.threads)
+        return
+
+    dimensions = _dimensions(in_filename, args)
+    filenames = level_filenames(out_filename, dimensions)
+    for filename in filenames:
+        if os.path.isfile(filename) and not args.force_overwrite:
+            raise IOError('{} exists, delete it first.'.format(filename))
+
+    largest = max(dimensions, key=lambda d: d[0] * d[1])
+    img = read_image(in_filename,
+                     None if args.full_decode else largest[::-1])
+    write_pyramid(filenames, resize_pyramid(img, dimensions), args.level,
+                  args.threads)
+
+
+def main():
+    parser = _build_arg_parser()
+    args = parser.parse_args()
+    start_profiling(args)
+
+    if args.batch:
+        ext = '.' + (args.out_ext or '').lstrip('.')
+    else:
+        _, ext = os.path.splitext(args.out_filename)
+    if ext.lower() != '.dzi' and args.scales is None \
+            and args.dimensions is None:
+        raise ValueError('--scales or --dimensions is required, unless the '
+                         'output is a .dzi.')
+    if args.dimensions is not None and len(args.dimensions) % 2:
+        raise ValueError('--dimensions must be width height pairs.')
+
+    if args.batch:
+        batch_main(_process, args)
+    else:
+        _process(args.in_filename, args.out_filename, args)
+
+
+if __name__ == "__main__":
+    main()
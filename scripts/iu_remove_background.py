@@ -6,9 +6,18 @@
 import argparse
 import os
 
-import imageio.v2 as imageio
+from image_utils.utils.batch import add_batch_args, batch_main
+from image_utils.utils.cache import add_cache_args, run_cached
+from image_utils.utils.image import image_corners, remove_background
+from image_utils.utils.io import is_pipe, read_image, write_image
+from image_utils.utils.metadata import image_info
+from image_utils.utils.profiling import add_profiling_args, start_profiling
+from image_utils.utils.tiled import (open_lazy, remove_background_tiled,
+                                     tile_size_for_budget, write_tiles)
 
-from image_utils.utils.image import remove_background
+# Arguments changing the output, part of the cache key
+CACHE_PARAMS = ['mode', 'position', 'corners', 'threshold', 'colors',
+                'max_memory']
 
 
 def _build_arg_parser():
@@ -16,38 +25,97 @@ def _build_arg_parser():
         description=__doc__,
         formatter_class=argparse.RawTextHelpFormatter)
     p.add_argument('in_filename',
-                   help='Path of the input image.')
+                   help='Path of the input image, - for the standard input.')
     p.add_argument('out_filename',
-                   help='Path of the output image.')
+                   help='Path of the output image, - for a .npy stream on '
+                        'the\nstandard output.')
     p.add_argument('--mode', choices=['fill', 'value'], default='fill',
                    help='Either replace all close values or use a floodfill. '
                         '[%(choices)s]')
-    p.add_argument('--position', nargs=2, type=int, default=[0, 0],
-                   help='Position at which the colored background is '
-                        'detected. [%(default)s]')
+    p2 = p.add_mutually_exclusive_group()
+    p2.add_argument('--position', nargs='+', type=int, default=[0, 0],
+                    help='Position(s) at which the colored background is '
+                         'detected,\nas row col pairs. [%(default)s]')
+    p2.add_argument('--corners', action='store_true',
+                    help='Detect the background from the four corners.')
     p.add_argument('--threshold', type=float, default=10,
                    help='Threshold for background detection in case of noise. '
                         '[%(default)s]')
+    p.add_argument('--colors', nargs='+', type=int, default=None,
+                   help='Additional background colors as R G B triplets, '
+                        'only in value mode.')
+    p.add_argument('--max_memory', type=float, default=None,
+                   help='Process the image by tiles using at most this much '
+                        'memory (MB).\nThe input is memory-mapped when '
+                        'possible (.npy, uncompressed .tif)\nand the '
+                        'output must be a .npy or a tiled .tif file.')
     p.add_argument('-f', dest='force_overwrite', action='store_true',
                    help='Overwrite the output files if they exist.')
+    add_batch_args(p)
+    add_cache_args(p)
+    add_profiling_args(p)
     return p
 
 
+def _run(in_filename, out_filename, args):
+    if args.corners:
+        position = image_corners(image_info(in_filename)[0:2])
+    else:
+        position = [tuple(args.position[i:i + 2])
+                    for i in range(0, len(args.position), 2)]
+
+    if args.max_memory is not None:
+        img = open_lazy(in_filename)
+        tile_size = tile_size_for_budget(args.max_memory * 1024 ** 2)
+        tiles = remove_background_tiled(img, args.threshold, position,
+                                        args.mode, tile_size)
+        write_tiles(out_filename, img.shape[0:2] + (4,), 'uint8', tiles,
+                    tile_size)
+        return
+
+    img = read_image(in_filename)
+    new_img, _ = remove_background(img, args.threshold,
+                                   position, args.mode, args.colors)
+    write_image(out_filename, new_img)
+
+
+def _process(in_filename, out_filename, args):
+    if not is_pipe(in_filename) and not os.path.isfile(in_filename):
+        raise IOError('{} does not exist.'.format(in_filename))
+
+    if os.path.splitext(in_filename)[1].lower() == '.raw':
+        raise ValueError('{}: raw images have no header giving their shape, '
+                         'convert them to .npy first.'.format(in_filename))
+
+    if os.path.isfile(out_filename) and not args.force_overwrite:
+        raise IOError('{} exists, delete it first.'.format(out_filename))
+
+    return run_cached(_run, 'remove_background', in_filename, out_filename,
+                      args, CACHE_PARAMS)
+
+
 def main():
     parser = _build_arg_parser()
     args = parser.parse_args()
+    start_profiling(args)
 
-    if not os.path.isfile(args.in_filename):
-        raise IOError('{} does not exist.'.format(args.in_filename))
+    if len(args.position) % 2:
+        raise ValueError('--position must be row col pairs.')
 
-    if os.path.isfile(args.out_filename) and not args.force_overwrite:
-        raise IOError('{} exists, delete it first.'.format(args.out_filename))
+    if args.colors is not None:
+        if len(args.colors) % 3:
+            raise ValueError('--colors must be R G B triplets.')
+        if args.mode != 'value':
+            raise ValueError('--colors is only supported in value mode.')
+        if args.max_memory is not None:
+            raise ValueError('--colors is not supported with --max_memory.')
 
-    args.position = tuple(args.position)
-    img = imageio.imread(args.in_filename)
-    new_img, _ = remove_background(img, args.threshold,
-                                   args.position, args.mode)
-    imageio.imwrite(args.out_filename, new_img)
+    if args.batch:
+        batch_main(_process, args)
+    else:
+        status = _process(args.in_filename, args.out_filename, args)
+        if status is not None:
+            print(status.capitalize() + '.')
 
 
 if __name__ == "__main__":
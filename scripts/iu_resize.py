@@ -6,9 +6,16 @@
 import argparse
 import os
 
-import imageio.v2 as imageio
+from image_utils.utils.batch import add_batch_args, batch_main
+from image_utils.utils.cache import add_cache_args, run_cached
+from image_utils.utils.image import resize, resize_dimensions
+from image_utils.utils.io import is_pipe, read_image, write_image
+from image_utils.utils.metadata import image_info
+from image_utils.utils.profiling import add_profiling_args, start_profiling
 
-from image_utils.utils.image import resize
+# Arguments changing the output, part of the cache key
+CACHE_PARAMS = ['dimensions', 'scale', 'ratio_frac', 'ratio_val',
+                'full_decode']
 
 
 def _build_arg_parser():
@@ -16,9 +23,10 @@ def _build_arg_parser():
         description=__doc__,
         formatter_class=argparse.RawTextHelpFormatter)
     p.add_argument('in_filename',
-                   help='Path of the input image.')
+                   help='Path of the input image, - for the standard input.')
     p.add_argument('out_filename',
-                   help='Path of the output image.')
+                   help='Path of the output image, - for a .npy stream on '
+                        'the\nstandard output.')
     p2 = p.add_mutually_exclusive_group(required=True)
     p2.add_argument('--dimensions', nargs=2, type=int,
                     help='Dimensions of the image in pixel.')
@@ -28,25 +36,50 @@ def _build_arg_parser():
                     help='Ratio of the image (X/Y). [1.0]')
     p2.add_argument('--ratio_val', nargs=2, type=float,
                     help='Ratio of the image as X & Y. [1.0 1.0]')
+    p.add_argument('--full_decode', action='store_true',
+                   help='Decode JPEG images at full resolution, by default '
+                        'they are decoded\nat the smallest scale (1/2, 1/4 '
+                        'or 1/8) still larger than the output.')
     p.add_argument('-f', dest='force_overwrite', action='store_true',
                    help='Overwrite the output files if they exist.')
+    add_batch_args(p)
+    add_cache_args(p)
+    add_profiling_args(p)
     return p
 
 
+def _run(in_filename, out_filename, args):
+    # The output size only depends on the original size, from the header
+    info = image_info(in_filename)
+    dimensions = resize_dimensions((info.height, info.width), args.ratio_frac,
+                                   args.ratio_val, args.dimensions, args.scale)
+    min_size = None if args.full_decode else dimensions[::-1]
+    img = read_image(in_filename, min_size)
+    write_image(out_filename, resize(img, dimensions=dimensions))
+
+
+def _process(in_filename, out_filename, args):
+    if not is_pipe(in_filename) and not os.path.isfile(in_filename):
+        raise IOError('{} does not exist.'.format(in_filename))
+
+    if os.path.isfile(out_filename) and not args.force_overwrite:
+        raise IOError('{} exists, delete it first.'.format(out_filename))
+
+    return run_cached(_run, 'resize', in_filename, out_filename,
+                      args, CACHE_PARAMS)
+
+
 def main():
     parser = _build_arg_parser()
     args = parser.parse_args()
+    start_profiling(args)
 
-    if not os.path.isfile(args.in_filename):
-        raise IOError('{} does not exist.'.format(args.in_filename))
-
-    if os.path.isfile(args.out_filename) and not args.force_overwrite:
-        raise IOError('{} exists, delete it first.'.format(args.out_filename))
-
-    img = imageio.imread(args.in_filename)
-    resized = resize(img, args.ratio_frac, args.ratio_val, args.dimensions,
-                     args.scale)
-    imageio.imwrite(args.out_filename, resized)
+    if args.batch:
+        batch_main(_process, args)
+    else:
+        status = _process(args.in_filename, args.out_filename, args)
+        if status is not None:
+            print(status.capitalize() + '.')
 
 
 if __name__ == "__main__":
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Serve the image operations over localhost HTTP or a Unix socket.
+
+The workers keep image_utils imported between requests. The image is the
+body of a POST request, the operation is the path and its parameters are
+the query (values are parsed as JSON), the encoded result is returned:
+
+    curl --data-binary @in.png -o out.png \\
+        'http://127.0.0.1:8000/resize?scale=0.5'
+    curl --unix-socket /tmp/iu.sock --data-binary @in.jpg -o out.jpg \\
+        'http://localhost/auto_crop?borders=20&format=jpg'
+    curl --data-binary @in.png -o out.png 'http://127.0.0.1:8000/pipeline'\\
+'?stages=[{"op":"remove_background"},{"op":"auto_crop"}]'
+
+Operations: remove_background, auto_crop, resize, pad, compress and
+pipeline. GET /stats reports the throughput, the latency percentiles and
+the queue. When the queue is full, requests are refused with a 503 status
+and a Retry-After header.
+"""
+
+import argparse
+import json
+import signal
+
+from image_utils.utils.profiling import add_profiling_args, start_profiling
+from image_utils.utils.server import ServerStats, WorkerPool, make_server
+
+
+def _build_arg_parser():
+    p = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawTextHelpFormatter)
+    p2 = p.add_mutually_exclusive_group()
+    p2.add_argument('--port', type=int, default=8000,
+                    help='Port to listen on, on localhost. [%(default)s]')
+    p2.add_argument('--socket', dest='socket_path', default=None,
+                    help='Listen on this Unix socket instead.')
+    p.add_argument('--host', default='127.0.0.1',
+                   help='Address to listen on. [%(default)s]')
+    p.add_argument('--jobs', type=int, default=1,
+                   help='Number of worker processes. [%(default)s]')
+    p.add_argument('--queue_size', type=int, default=None,
+                   help='Number of requests waiting for a worker before new '
+                        'ones are refused.\n[2 * jobs]')
+    p.add_argument('--max_body', type=float, default=256,
+                   help='Maximum size of an input image (MB). '
+                        '[%(default)s]')
+    p.add_argument('--max_pixels', type=float, default=100,
+                   help='Maximum number of pixels of the input, output and '
+                        'intermediate\nimages of a request (megapixels). '
+                        '[%(default)s]')
+    add_profiling_args(p)
+    return p
+
+
+def _terminate(signum, frame):
+    # Stop on SIGTERM as on Ctrl-C, printing the statistics
+    raise KeyboardInterrupt
+
+
+def main():
+    parser = _build_arg_parser()
+    args = parser.parse_args()
+    start_profiling(args)
+
+    if args.jobs < 1:
+        raise ValueError('--jobs must be at least 1.')
+    if args.queue_size is not None and args.queue_size < 0:
+        raise ValueError('--queue_size must be positive.')
+
+    pool = WorkerPool(args.jobs, args.queue_size)
+    stats = ServerStats()
+    server = make_server(pool, stats, args.host, args.port, args.socket_path,
+                         int(args.max_body * 1024 ** 2),
+                         int(args.max_pixels * 10 ** 6))
+    print('Listening on {}.'.format(
+        args.socket_path or 'http://{}:{}'.format(args.host, args.port)))
+    signal.signal(signal.SIGTERM, _terminate)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.shutdown()
+        print(json.dumps(stats.snapshot(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
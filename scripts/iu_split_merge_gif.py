@@ -1,12 +1,29 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-""" Crop an image to its bounding box. """
+""" Split a GIF into frames or merge frames into a GIF.
+
+A range of frames can be selected, as a Python slice of frame indices. The
+frames keep their index in their name, so that a long video can be split
+by several workers, each one on its own range:
+
+    iu_split_merge_gif.py in.mp4 --out_dir frames --frames 0:1000 -f
+    iu_split_merge_gif.py in.mp4 --out_dir frames --frames 1000:2000 -f
+
+and a preview extracted from one frame out of 100:
+
+    iu_split_merge_gif.py in.mp4 --out_dir preview --every_n 100
+"""
 
 import argparse
 import os
 
-import imageio.v2 as imageio
+from image_utils.utils.frames import (FRAME_FORMATS, count_frames,
+                                      frame_filename, iter_frames,
+                                      parallel_map, parse_frame_range,
+                                      prefetch, write_frame, write_frames)
+from image_utils.utils.io import read_image
+from image_utils.utils.profiling import add_profiling_args, start_profiling
 
 
 def _build_arg_parser():
@@ -20,14 +37,45 @@ def _build_arg_parser():
                     help='Path of the output image.')
     p2.add_argument('--out_dir',
                     help='Path of the output directory.')
+    p.add_argument('--format', choices=FRAME_FORMATS, default='png',
+                   help='Format of the frames in split mode. [%(default)s]')
+    p.add_argument('--level', type=int, default=None,
+                   help='zlib level for PNG (0-9) or quality for WebP/JPG '
+                        '(0-100)\nin split mode. [6 for PNG, 80 for WebP, '
+                        '90 for JPG]')
+    p.add_argument('--digits', type=int, default=None,
+                   help='Number of digits of the frame indices in split '
+                        'mode.\n[from the number of frames, or 6]')
+    p.add_argument('--frames', default=None, metavar='START:STOP:STEP',
+                   help='Frames to split (or input images to merge), e.g. '
+                        '100:200:5.\n[all]')
+    p.add_argument('--every_n', type=int, default=None,
+                   help='Keep one frame out of every_n, same as the step of '
+                        '--frames.')
+    p.add_argument('--jobs', type=int, default=1,
+                   help='Number of threads to encode (split) or decode '
+                        '(merge) frames. [%(default)s]')
     p.add_argument('-f', dest='force_overwrite', action='store_true',
                    help='Overwrite the output files if they exist.')
+    add_profiling_args(p)
     return p
 
 
 def main():
     parser = _build_arg_parser()
     args = parser.parse_args()
+    start_profiling(args)
+
+    start, stop, step = 0, None, 1
+    if args.frames is not None:
+        start, stop, step = parse_frame_range(args.frames)
+    if args.every_n is not None:
+        if args.every_n < 1:
+            raise ValueError('--every_n must be positive.')
+        if step != 1:
+            raise ValueError('Cannot specify both --every_n and a step in '
+                             '--frames.')
+        step = args.every_n
 
     if len(args.in_filenames) > 1:
         if args.out_filename is None:
@@ -36,7 +84,6 @@ def main():
         _, ext = os.path.splitext(args.out_filename)
         if ext not in ['.gif', '.GIF', '.mp4', '.MP4']:
             raise IOError('Output filename must be a GIF or MP4.')
-        frames = []
         for filename in args.in_filenames:
             _, ext = os.path.splitext(filename)
             if ext not in ['.jpg', '.JPG', '.jpeg', '.JPEG', '.png', '.PNG'] \
@@ -49,15 +96,12 @@ def main():
                 raise IOError('{} exists, delete it first.'.format(
                     args.out_filename))
 
-            frames.append(imageio.imread(filename))
-
         print(args.out_filename)
-        writer = imageio.get_writer(args.out_filename)
-        for im in frames:
-            writer.append_data(im)
-        writer.close()
-        #imageio.mimwrite(args.out_filename, frames)
-
+        # Frames are decoded in the background while the previous ones are
+        # encoded, never holding more than a few of them in memory
+        frames = parallel_map(read_image, args.in_filenames[start:stop:step],
+                              args.jobs)
+        write_frames(args.out_filename, prefetch(frames))
 
     else:
         _, ext = os.path.splitext(args.in_filenames[0])
@@ -66,15 +110,29 @@ def main():
                           'MP4s.')
         if not os.path.isfile(args.in_filenames[0]):
             raise IOError('{} does not exist.'.format(args.in_filenames[0]))
-        if not os.path.isdir(args.out_dir):
-            os.mkdir(args.out_dir)
-        elif not args.force_overwrite:
+        if os.path.isdir(args.out_dir) and not args.force_overwrite:
             raise IOError('{} exists, delete it first.'.format(
                 args.out_dir))
+        # Workers splitting their own ranges may create it concurrently
+        os.makedirs(args.out_dir, exist_ok=True)
+
+        digits = args.digits
+        if digits is None:
+            count = count_frames(args.in_filenames[0])
+            digits = len(str(count - 1)) if count else 6
+
+        def _write(item):
+            i, frame = item
+            filename = frame_filename(args.out_dir, i, args.format, digits)
+            write_frame(filename, frame, args.level)
 
-        gif = imageio.mimread(args.in_filenames[0])
-        for i, frame in enumerate(gif):
-            imageio.imwrite('{}/frame_{}.png'.format(args.out_dir, i), frame)
+        # Frames are named after their index in the input, not in the
+        # selection
+        frames = prefetch(iter_frames(args.in_filenames[0], start, stop,
+                                      step))
+        indices = range(start, stop if stop is not None else 2 ** 63, step)
+        for _ in parallel_map(_write, zip(indices, frames), args.jobs):
+            pass
 
 
 if __name__ == "__main__":